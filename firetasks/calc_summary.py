@@ -0,0 +1,159 @@
+"""
+Compact summary of a finished VASP run.
+
+WriteCalcSummary runs right after RunVasp and writes calc_summary.json: the
+final structure, INCAR, KPOINTS, band edges with their k-points, the Fermi
+level, the site magnetization and NBANDS. This is everything the *FromPrev
+writers of my_atomate.firetasks.firetasks take from the previous run, so
+they no longer parse its vasprun.xml and OUTCAR, which are hundreds of MB for
+HSE DOS runs. JCopyVaspOutputs copies the summary along with the outputs;
+without one the writers fall back to from_prev_calc.
+
+See my_atomate.powerups.add_calc_summary.
+
+"""
+
+import json
+import os
+
+from fireworks import explicit_serialize, FiretaskBase
+
+from atomate.utils.utils import get_logger
+
+__author__ = "Jeng-Yuan Tsai"
+__email__ = "tsaie79@gmail.com"
+
+
+logger = get_logger(__name__)
+
+CALC_SUMMARY_FILE = "calc_summary.json"
+
+
+def _find_output(calc_dir, fname):
+    from my_atomate.firetasks.staging import find_staged_file
+
+    found = find_staged_file(calc_dir, fname, set(os.listdir(calc_dir)))
+    return os.path.join(calc_dir, found) if found else None
+
+
+def get_calc_summary(calc_dir="."):
+    """
+    Summarize the VASP run in calc_dir. The DOS and projections are not parsed.
+
+    Returns:
+        dict
+    """
+    from monty.json import jsanitize
+    from pymatgen.io.vasp.outputs import Vasprun
+    from my_atomate.firetasks.parsers import get_outcar_magnetization
+    from my_atomate.firetasks.staging import get_size_fingerprint
+
+    vasprun_file = _find_output(calc_dir, "vasprun.xml")
+    if not vasprun_file:
+        raise ValueError("Cannot find vasprun.xml in {}".format(calc_dir))
+    vasprun = Vasprun(vasprun_file, parse_dos=False, parse_projected_eigen=False, parse_potcar_file=False)
+
+    magnetization = None
+    outcar_file = _find_output(calc_dir, "OUTCAR")
+    if vasprun.is_spin and outcar_file:
+        magnetization = get_outcar_magnetization(outcar_file) or None
+
+    gap, cbm, vbm, is_direct = vasprun.eigenvalue_band_properties
+    bs = vasprun.get_band_structure()
+    vbm_kpoint, cbm_kpoint = bs.get_vbm()["kpoint"], bs.get_cbm()["kpoint"]
+
+    return jsanitize({
+        # identifies the run the summary belongs to, see load_calc_summary; the
+        # uncompressed size (mod 2**32), as custodian gzips vasprun.xml and children
+        # decompress it, read from the gzip trailer rather than by decompressing
+        "vasprun_size": get_size_fingerprint(vasprun_file),
+        "final_structure": vasprun.final_structure.as_dict(),
+        "incar": dict(vasprun.incar),
+        "kpoints": vasprun.kpoints.as_dict(),
+        "parameters": {k: vasprun.parameters.get(k) for k in ("NBANDS", "ISPIN", "MAGMOM", "LDAU", "NELECT")},
+        "is_spin": vasprun.is_spin,
+        "efermi": vasprun.efermi,
+        "band_gap": gap,
+        "cbm": cbm,
+        "vbm": vbm,
+        "is_gap_direct": is_direct,
+        "vbm_kpoint": vbm_kpoint.frac_coords if vbm_kpoint else None,
+        "cbm_kpoint": cbm_kpoint.frac_coords if cbm_kpoint else None,
+        "magnetization": magnetization,
+    })
+
+
+def load_calc_summary(prev_calc_dir="."):
+    """
+    The summary of prev_calc_dir, or None if there is none or if it belongs
+    to another run than the vasprun.xml next to it, compressed or not (e.g. a
+    summary copied along from an earlier FW).
+    """
+    from my_atomate.firetasks.staging import get_size_fingerprint
+
+    fname = os.path.join(prev_calc_dir, CALC_SUMMARY_FILE)
+    if not os.path.exists(fname):
+        return None
+    with open(fname) as f:
+        summary = json.load(f)
+    vasprun_file = _find_output(prev_calc_dir, "vasprun.xml")
+    if vasprun_file and get_size_fingerprint(vasprun_file) != summary.get("vasprun_size"):
+        logger.warning("{} does not match {}, parsing the outputs".format(fname, vasprun_file))
+        return None
+    return summary
+
+
+def get_structure_from_summary(summary, site_properties=True):
+    """
+    The final structure of the summarized run. With site_properties, magmom
+    and the LDAU parameters are set per site as by pymatgen's
+    get_structure_from_prev_run.
+    """
+    from pymatgen.core.structure import Structure
+
+    structure = Structure.from_dict(summary["final_structure"])
+    if not site_properties:
+        return structure
+
+    props = {}
+    if summary["is_spin"]:
+        props["magmom"] = summary["magnetization"] or summary["parameters"]["MAGMOM"]
+    if summary["parameters"].get("LDAU"):
+        for k in ("LDAUU", "LDAUJ", "LDAUL"):
+            values, by_specie = summary["incar"][k], {}
+            for site in structure:
+                if site.specie.symbol not in by_specie:
+                    by_specie[site.specie.symbol] = values[len(by_specie)]
+            props[k.lower()] = [by_specie[site.specie.symbol] for site in structure]
+    return structure.copy(site_properties=props)
+
+
+@explicit_serialize
+class WriteCalcSummary(FiretaskBase):
+    """
+    Write calc_summary.json for the VASP run in the current dir. The summary
+    copied from the parent is removed first, so a run that cannot be
+    summarized leaves none and its children parse the outputs.
+
+    Optional params:
+        calc_dir (str): dir of the run. Defaults to the current dir.
+    """
+
+    optional_params = ["calc_dir"]
+
+    def run_task(self, fw_spec):
+        from xml.etree.ElementTree import ParseError
+
+        calc_dir = self.get("calc_dir", ".")
+        summary_file = os.path.join(calc_dir, CALC_SUMMARY_FILE)
+        if os.path.exists(summary_file):
+            os.remove(summary_file)
+        try:
+            summary = get_calc_summary(calc_dir)
+        except (IOError, ValueError, KeyError, ParseError) as e:
+            logger.warning("Cannot summarize {}: {}".format(os.path.abspath(calc_dir), e))
+            return
+        tmp_file = os.path.join(calc_dir, CALC_SUMMARY_FILE + ".tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(summary, f)
+        os.replace(tmp_file, summary_file)
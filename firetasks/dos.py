@@ -0,0 +1,332 @@
+"""
+DOS parsing and storage for DOS-heavy FWs.
+
+VaspToDbStreamDos is VaspToDb with the DOS taken from my_atomate.firetasks.parsers
+instead of pymatgen's Vasprun: the drone parses everything but the DOS, and
+the DOS is streamed into numpy arrays and stored in one of two ways:
+
+- "gridfs": the same GridFS layout as VaspCalcDb.insert_task, so
+  VaspCalcDb.get_dos reads it back unchanged.
+- "adaptive": the full-resolution total and projected DOS as compressed
+  float32 arrays (npz) in the dos_full_fs GridFS, and in the task doc an
+  adaptively downsampled total and element DOS ("dos_adaptive"), at full
+  resolution around the band edges and the levels near the gap and coarse
+  elsewhere. For the defect HSE runs (NEDOS=9000) this keeps the task docs
+  small while nothing is lost.
+
+get_dos returns either resolution.
+
+"""
+
+import io
+import os
+
+import numpy as np
+
+from fireworks import explicit_serialize
+
+from atomate.common.firetasks.glue_tasks import get_calc_loc
+from atomate.utils.utils import env_chk, get_logger
+from atomate.vasp.firetasks.parse_outputs import VaspToDb
+
+__author__ = "Jeng-Yuan Tsai"
+__email__ = "tsaie79@gmail.com"
+
+
+logger = get_logger(__name__)
+
+DOS_PARSERS = ["vasprun", "stream"]
+
+DOS_STORAGES = ["gridfs", "adaptive"]
+
+FULL_DOS_FS = "dos_full_fs"
+
+# adaptive grid: full resolution within FINE_WINDOW eV of the levels, every
+# COARSE_STRIDE-th point (averaged) elsewhere
+FINE_WINDOW = 0.5
+COARSE_STRIDE = 10
+# bands below and above the Fermi level whose energies count as levels
+NLEVEL_BANDS = 4
+
+
+def get_dos_todb_task(dos_parser="vasprun"):
+    """
+    The VaspToDb class for the dos_parser option of the FWs.
+    """
+    if dos_parser not in DOS_PARSERS:
+        raise ValueError("Unknown dos_parser {}, choose from {}".format(dos_parser, DOS_PARSERS))
+    return VaspToDbStreamDos if dos_parser == "stream" else VaspToDb
+
+
+def store_dos(db_file, task_id, dos):
+    """
+    Store a CompleteDos dict for task_id the way VaspCalcDb.insert_task does.
+    """
+    from atomate.vasp.database import VaspCalcDb
+
+    mmdb = VaspCalcDb.from_db_file(db_file, admin=True)
+    fs_id, compression_type = mmdb.insert_gridfs(dos, "dos_fs", task_id=task_id)
+    mmdb.collection.update_one({"task_id": task_id}, {"$set": {"calcs_reversed.0.dos_compression": compression_type,
+                                                               "calcs_reversed.0.dos_fs_id": fs_id}})
+    logger.info("Stored the streamed DOS of task {}".format(task_id))
+
+
+def add_dos_to_task_json(data, dos_storage="gridfs", fine_window=FINE_WINDOW, coarse_stride=COARSE_STRIDE,
+                         nlevel_bands=NLEVEL_BANDS, filename="task.json"):
+    """
+    Add the streamed DOS to the task.json VaspToDb writes without a db_file:
+    the CompleteDos dict in calcs_reversed.0.dos, as the drone puts it, and for
+    dos_storage="adaptive" the adaptive DOS as well.
+    """
+    import json
+    from my_atomate.firetasks.parsers import get_complete_dos_dict
+
+    with open(filename) as f:
+        task_doc = json.load(f)
+    task_doc["calcs_reversed"][0]["dos"] = get_complete_dos_dict(data)
+    if dos_storage == "adaptive":
+        task_doc["dos_adaptive"] = get_adaptive_dos(data, fine_window, coarse_stride, nlevel_bands)
+    with open(filename, "w") as f:
+        json.dump(task_doc, f)
+    logger.info("Added the streamed DOS to {}".format(filename))
+
+
+def get_dos_levels(data, nlevel_bands=NLEVEL_BANDS):
+    """
+    Band edges and levels around the gap from the eigenvalues of stream_vasprun.
+
+    Returns:
+        (float, float, [float]): vbm, cbm and the k-averaged energies of the
+            nlevel_bands highest occupied and lowest empty bands of each spin,
+            which include the defect levels in the gap
+    """
+    eigenvalues, occupations = data["eigenvalues"], data["occupations"]
+    occupied = occupations > 0.5
+    vbm = float(eigenvalues[occupied].max()) if occupied.any() else data["efermi"]
+    cbm = float(eigenvalues[~occupied].min()) if (~occupied).any() else data["efermi"]
+
+    levels = []
+    for s in range(len(eigenvalues)):
+        nocc = int(occupied[s].sum(axis=1).max())
+        bands = eigenvalues[s, :, max(nocc - nlevel_bands, 0):nocc + nlevel_bands]
+        levels.extend(bands.mean(axis=0).tolist())
+    return vbm, cbm, sorted(levels)
+
+
+def get_adaptive_segments(energies, levels, gap=None, fine_window=FINE_WINDOW, coarse_stride=COARSE_STRIDE):
+    """
+    Start indices of the segments of the adaptive grid: single points within
+    fine_window of a level or inside the gap, coarse_stride points elsewhere.
+    """
+    fine = np.zeros(len(energies), dtype=bool)
+    for e in levels:
+        fine |= np.abs(energies - e) <= fine_window
+    if gap:
+        fine |= (energies >= gap[0]) & (energies <= gap[1])
+    # a coarse segment also starts right after every fine run
+    after_fine = np.flatnonzero(fine[:-1] & ~fine[1:]) + 1
+    starts = np.union1d(np.union1d(np.flatnonzero(fine), np.arange(0, len(energies), coarse_stride)), after_fine)
+    return starts.astype(int)
+
+
+def downsample(values, starts):
+    """
+    Average values (last axis) over the segments beginning at starts, which
+    keeps the integrated DOS.
+    """
+    counts = np.diff(np.append(starts, values.shape[-1]))
+    return np.add.reduceat(values, starts, axis=-1) / counts
+
+
+def get_element_dos(data):
+    """
+    Projected DOS summed over the sites of each element and the orbitals of
+    each l: {element: {"s"|"p"|"d"|"f": (nspin, nedos)}}.
+    """
+    # VASP names the lm orbitals s, py, ..., dxy, ..., x2-y2, fy3x2, ...
+    ls = [o[0] if o[0] in "spdf" else "d" for o in data["orbitals"]]
+    element_dos = {}
+    for site, species in enumerate(data["species"]):
+        orbitals = element_dos.setdefault(species, {})
+        for j, l in enumerate(ls):
+            if l in orbitals:
+                orbitals[l] = orbitals[l] + data["pdos"][site, :, :, j]
+            else:
+                orbitals[l] = data["pdos"][site, :, :, j].copy()
+    return element_dos
+
+
+def get_adaptive_dos(data, fine_window=FINE_WINDOW, coarse_stride=COARSE_STRIDE, nlevel_bands=NLEVEL_BANDS):
+    """
+    The downsampled DOS of the task doc ("dos_adaptive").
+    """
+    spins = ["1", "-1"]
+    vbm, cbm, levels = get_dos_levels(data, nlevel_bands)
+    starts = get_adaptive_segments(data["energies"], levels, (vbm, cbm), fine_window, coarse_stride)
+    d = {
+        "efermi": data["efermi"],
+        "vbm": vbm,
+        "cbm": cbm,
+        "levels": levels,
+        "fine_window": fine_window,
+        "coarse_stride": coarse_stride,
+        "nedos": len(data["energies"]),
+        "energies": downsample(data["energies"], starts).tolist(),
+        "densities": {spins[s]: dos.tolist() for s, dos in enumerate(downsample(data["tdos"], starts))},
+    }
+    if data["pdos"] is not None:
+        d["element_dos"] = {
+            el: {l: {spins[s]: dos.tolist() for s, dos in enumerate(downsample(l_dos, starts))}
+                 for l, l_dos in orbitals.items()}
+            for el, orbitals in get_element_dos(data).items()
+        }
+    return d
+
+
+def pack_full_dos(data):
+    """
+    npz (zip-deflated) of the full-resolution DOS in float32, with what
+    get_complete_dos_dict needs to rebuild a CompleteDos.
+    """
+    arrays = {
+        "energies": data["energies"].astype(np.float32),
+        "tdos": data["tdos"].astype(np.float32),
+        "efermi": np.array(data["efermi"]),
+        "species": np.array(data["species"]),
+        "lattice": data["lattice"],
+        "frac_coords": data["frac_coords"],
+    }
+    if data["pdos"] is not None:
+        arrays["pdos"] = data["pdos"].astype(np.float32)
+        arrays["orbitals"] = np.array(data["orbitals"])
+    buf = io.BytesIO()
+    np.savez_compressed(buf, **arrays)
+    return buf.getvalue()
+
+
+def unpack_full_dos(content):
+    with np.load(io.BytesIO(content), allow_pickle=False) as f:
+        data = {k: f[k] for k in f.files}
+    data["efermi"] = float(data["efermi"])
+    data["species"] = data["species"].tolist()
+    data["pdos"] = data.get("pdos")
+    data["orbitals"] = data["orbitals"].tolist() if "orbitals" in data else None
+    return data
+
+
+def store_adaptive_dos(db_file, task_id, data, fine_window=FINE_WINDOW, coarse_stride=COARSE_STRIDE,
+                       nlevel_bands=NLEVEL_BANDS):
+    """
+    Store the full DOS in the dos_full_fs GridFS and the adaptive DOS in the
+    task doc of task_id.
+    """
+    import gridfs
+    from atomate.vasp.database import VaspCalcDb
+
+    mmdb = VaspCalcDb.from_db_file(db_file, admin=True)
+    content = pack_full_dos(data)
+    fs_id = gridfs.GridFS(mmdb.db, FULL_DOS_FS).put(content, task_id=task_id, compression="npz")
+    adaptive = get_adaptive_dos(data, fine_window, coarse_stride, nlevel_bands)
+    mmdb.collection.update_one({"task_id": task_id}, {"$set": {"calcs_reversed.0.dos_full_fs_id": fs_id,
+                                                               "calcs_reversed.0.dos_full_compression": "npz",
+                                                               "dos_adaptive": adaptive}})
+    logger.info("Stored the DOS of task {}: {} KB in {}, {} of {} points in the doc".format(
+        task_id, len(content) // 1024, FULL_DOS_FS, len(adaptive["energies"]), adaptive["nedos"]))
+
+
+def get_dos(db_file, task_id, resolution="adaptive"):
+    """
+    The DOS of a task.
+
+    Args:
+        db_file (str): calculation db
+        task_id (int)
+        resolution (str): "adaptive" for the downsampled total DOS of the
+            task doc, "full" for the full-resolution DOS, from dos_full_fs or
+            from the GridFS of VaspCalcDb for tasks parsed otherwise
+
+    Returns:
+        Dos for "adaptive", CompleteDos for "full"
+    """
+    from pymatgen.electronic_structure.core import Spin
+    from pymatgen.electronic_structure.dos import CompleteDos, Dos
+    from atomate.vasp.database import VaspCalcDb
+    from my_atomate.firetasks.parsers import get_complete_dos_dict
+
+    mmdb = VaspCalcDb.from_db_file(db_file)
+    doc = mmdb.collection.find_one({"task_id": task_id}, {"dos_adaptive": 1, "calcs_reversed.dos_full_fs_id": 1})
+    if doc is None:
+        raise ValueError("No task {}".format(task_id))
+
+    if resolution == "adaptive":
+        if "dos_adaptive" not in doc:
+            raise ValueError("Task {} has no adaptive DOS".format(task_id))
+        d = doc["dos_adaptive"]
+        return Dos(d["efermi"], np.array(d["energies"]),
+                   {Spin(int(s)): np.array(dos) for s, dos in d["densities"].items()})
+    if resolution != "full":
+        raise ValueError("Unknown resolution {}, choose from adaptive, full".format(resolution))
+
+    fs_id = doc["calcs_reversed"][0].get("dos_full_fs_id") if doc.get("calcs_reversed") else None
+    if fs_id is None:
+        return mmdb.get_dos(task_id)
+    import gridfs
+    data = unpack_full_dos(gridfs.GridFS(mmdb.db, FULL_DOS_FS).get(fs_id).read())
+    return CompleteDos.from_dict(get_complete_dos_dict(data))
+
+
+@explicit_serialize
+class VaspToDbStreamDos(VaspToDb):
+    """
+    VaspToDb whose DOS (with parse_dos) is extracted by stream_vasprun.
+    Without a db_file the DOS goes into task.json.
+
+    Optional params (in addition to those of VaspToDb):
+        dos_storage (str): "gridfs" (default) or "adaptive", see the module docstring
+        fine_window (float): eV around the levels kept at full resolution. Defaults to 0.5.
+        coarse_stride (int): points averaged elsewhere. Defaults to 10.
+        nlevel_bands (int): bands below and above the Fermi level taken as levels. Defaults to 4.
+    """
+
+    optional_params = VaspToDb.optional_params + ["dos_storage", "fine_window", "coarse_stride", "nlevel_bands"]
+
+    def run_task(self, fw_spec):
+        from my_atomate.firetasks.parsers import stream_vasprun, get_complete_dos_dict
+        from my_atomate.firetasks.staging import find_staged_file
+
+        dos_storage = self.get("dos_storage", "gridfs")
+        if dos_storage not in DOS_STORAGES:
+            raise ValueError("Unknown dos_storage {}, choose from {}".format(dos_storage, DOS_STORAGES))
+
+        parse_dos = self.get("parse_dos", False)
+        self["parse_dos"] = False
+        try:
+            action = super(VaspToDbStreamDos, self).run_task(fw_spec)
+        finally:
+            self["parse_dos"] = parse_dos
+
+        db_file = env_chk(self.get("db_file"), fw_spec)
+        task_id = action.stored_data.get("task_id") if action else None
+        if not parse_dos or (db_file and task_id is None):
+            return action
+
+        calc_dir = os.getcwd()
+        if "calc_dir" in self:
+            calc_dir = self["calc_dir"]
+        elif self.get("calc_loc"):
+            calc_dir = get_calc_loc(self["calc_loc"], fw_spec["calc_locs"])["path"]
+        vasprun_file = find_staged_file(calc_dir, "vasprun.xml", set(os.listdir(calc_dir)))
+        data = stream_vasprun(os.path.join(calc_dir, vasprun_file), parse_eigen=dos_storage == "adaptive")
+        if data["tdos"] is None:
+            logger.warning("No DOS in {}".format(os.path.join(calc_dir, vasprun_file)))
+            return action
+
+        if not db_file:
+            add_dos_to_task_json(data, dos_storage, self.get("fine_window", FINE_WINDOW),
+                                 self.get("coarse_stride", COARSE_STRIDE), self.get("nlevel_bands", NLEVEL_BANDS))
+        elif dos_storage == "adaptive":
+            store_adaptive_dos(db_file, task_id, data, self.get("fine_window", FINE_WINDOW),
+                               self.get("coarse_stride", COARSE_STRIDE), self.get("nlevel_bands", NLEVEL_BANDS))
+        else:
+            store_dos(db_file, task_id, get_complete_dos_dict(data))
+        return action
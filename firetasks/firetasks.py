@@ -1,26 +1,35 @@
-from fireworks import FiretaskBase, explicit_serialize
+"""
+Firetasks for FWs.
 
-from pymatgen.io.vasp.inputs import *
-from pymatgen.io.vasp.outputs import Chgcar
-from pymatgen.io.vasp.sets import MPStaticSet, MVLGWSet, MPHSEBSSet
-from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
-from pymatgen.symmetry.bandstructure import HighSymmKpath
+pymatgen sets, symmetry tools and the database are imported in run_task, so
+deserializing a FW that uses these tasks stays cheap.
 
-from atomate.common.firetasks.glue_tasks import get_calc_loc, PassResult, \
-    CopyFiles, CopyFilesFromCalcLoc
-from atomate.vasp.database import VaspCalcDb
-from atomate.utils.utils import env_chk
+The *FromPrev writers build their input set from the calc_summary.json of the
+previous run when there is one (see my_atomate.firetasks.calc_summary) and
+parse its vasprun.xml and OUTCAR only otherwise.
 
-from monty.shutil import compress_dir, decompress_dir
+"""
+
+from fireworks import FiretaskBase, FWAction, explicit_serialize
+
+from atomate.utils.utils import env_chk, get_logger
+
+from my_atomate.firetasks.gw_planner import plan_gw_parallelization, read_outcar_dimensions
+from my_atomate.firetasks.calc_summary import load_calc_summary, get_structure_from_summary
 
 from glob import glob
 
-import shutil, gzip, os, re, traceback, time
+import shutil, os, traceback, time, json
+
+
+logger = get_logger(__name__)
 
 
 @explicit_serialize
 class RmSelectiveDynPoscar(FiretaskBase):
     def run_task(self, fw_spec):
+        from pymatgen.core.structure import Structure
+
         input_strucutre = Structure.from_file("POSCAR")
         if "selective_dynamics" in input_strucutre.site_properties.keys():
             input_strucutre.remove_site_property("selective_dynamics")
@@ -32,6 +41,8 @@ class SelectiveDynmaicPoscar(FiretaskBase):
     required_params = ["selective_dynamics", "nsites"]
 
     def run_task(self, fw_spec):
+        from pymatgen.io.vasp.inputs import Poscar
+
         where = []
         for i in range(self["nsites"]):
             if i in self["selective_dynamics"]:
@@ -72,6 +83,8 @@ class JWriteScanVaspStaticFromPrev(FiretaskBase):
     ]
 
     def run_task(self, fw_spec):
+        from pymatgen.io.vasp.sets import MPStaticSet
+
         lepsilon = self.get("lepsilon")
 
         # more k-points for dielectric calc.
@@ -98,20 +111,40 @@ class JWriteScanVaspStaticFromPrev(FiretaskBase):
         }
         other_params["user_incar_settings"].update(updates)
 
-        vis = MPStaticSet.from_prev_calc(
-            prev_calc_dir=self.get("prev_calc_dir", "."),
-            reciprocal_density=self.get(
-                "reciprocal_density", default_reciprocal_density
-            ),
-            small_gap_multiply=self.get("small_gap_multiply", None),
-            standardize=self.get("standardize", False),
-            sym_prec=self.get("sym_prec", 0.1),
-            international_monoclinic=self.get(
-                "international_monoclinic", True
-            ),
-            lepsilon=lepsilon,
-            **other_params
-        )
+        prev_calc_dir = self.get("prev_calc_dir", ".")
+        reciprocal_density = self.get("reciprocal_density", default_reciprocal_density)
+        small_gap_multiply = self.get("small_gap_multiply", None)
+        summary = load_calc_summary(prev_calc_dir)
+        if summary:
+            from pymatgen.io.vasp.inputs import Kpoints
+
+            # same as MPStaticSet.override_from_prev_calc, which does not standardize either
+            if small_gap_multiply and summary["band_gap"] <= small_gap_multiply[0]:
+                reciprocal_density = reciprocal_density * small_gap_multiply[1]
+            vis = MPStaticSet(
+                get_structure_from_summary(summary),
+                prev_incar=summary["incar"],
+                prev_kpoints=Kpoints.from_dict(summary["kpoints"]),
+                reciprocal_density=reciprocal_density,
+                small_gap_multiply=small_gap_multiply,
+                sym_prec=self.get("sym_prec", 0.1),
+                international_monoclinic=self.get("international_monoclinic", True),
+                lepsilon=lepsilon,
+                **other_params
+            )
+        else:
+            vis = MPStaticSet.from_prev_calc(
+                prev_calc_dir=prev_calc_dir,
+                reciprocal_density=reciprocal_density,
+                small_gap_multiply=small_gap_multiply,
+                standardize=self.get("standardize", False),
+                sym_prec=self.get("sym_prec", 0.1),
+                international_monoclinic=self.get(
+                    "international_monoclinic", True
+                ),
+                lepsilon=lepsilon,
+                **other_params
+            )
 
         potcar_spec = self.get("potcar_spec", False)
         vis.write_input(".", potcar_spec=potcar_spec)
@@ -128,8 +161,15 @@ class JWriteMVLGWFromPrev(FiretaskBase):
         potcar_spec (bool): Instead of writing the POTCAR, write a
             "POTCAR.spec". This is intended to allow testing of workflows
             without requiring pseudo-potentials to be installed on the system.
+        ncores (int): MPI ranks of the job. Supports env_chk.
+        plan_parallel (bool): choose NBANDS/NCORE/KPAR/NOMEGA from the parent's
+            OUTCAR, ncores and mem_per_rank_gb (see gw_planner). The plan is
+            written to gw_plan.json and the stored_data of the launch. NPAR
+            (e.g. from prev_incar) is removed, since it would override NCORE.
+        mem_per_rank_gb (float): memory per rank for the planner. Supports
+            env_chk, defaults to ">>mem_per_rank_gb<<" or 2 GB.
         (documentation for all other optional params can be found in
-        MPStaticSet)
+        MVLGWSet)
 
     """
 
@@ -141,10 +181,13 @@ class JWriteMVLGWFromPrev(FiretaskBase):
         "mode",
         "nbands_factor",
         "ncores",
-        "other_params"
+        "other_params",
+        "plan_parallel",
+        "mem_per_rank_gb",
     ]
 
     def run_task(self, fw_spec):
+        from pymatgen.io.vasp.sets import MVLGWSet
 
         other_params = self.get("other_params", {})
         user_incar_settings = other_params.get("user_incar_settings", {})
@@ -152,6 +195,26 @@ class JWriteMVLGWFromPrev(FiretaskBase):
         if "user_incar_settings" not in other_params:
             other_params["user_incar_settings"] = {}
 
+        ncores = env_chk(self.get("ncores", 16), fw_spec, strict=False) or 16
+        mode = self.get("mode", "DIAG")
+        plan = None
+        if self.get("plan_parallel"):
+            plan = plan_gw_parallelization(
+                read_outcar_dimensions(os.path.join(self.get("prev_calc_dir", "."), "OUTCAR")),
+                nranks=int(ncores),
+                mem_per_rank_gb=float(env_chk(self.get("mem_per_rank_gb", ">>mem_per_rank_gb<<"), fw_spec,
+                                              strict=False) or 2),
+                mode=mode,
+                nbands_factor=self.get("nbands_factor", 5),
+                nomega=user_incar_settings.get("NOMEGA", 80),
+                encutgw=user_incar_settings.get("ENCUTGW", 250),
+            )
+            # explicit user settings win over the plan
+            plan["incar"].update({k: v for k, v in user_incar_settings.items() if k in plan["incar"]})
+            other_params["user_incar_settings"].update(plan["incar"])
+            with open("gw_plan.json", "w") as f:
+                json.dump(plan, f, indent=4)
+
         # updates = {
         #     # "ADDGRID": True,
         #     # "LASPH": True,
@@ -161,20 +224,43 @@ class JWriteMVLGWFromPrev(FiretaskBase):
         #     # "NELM": 200,
         # }
         # other_params["user_incar_settings"].update(updates)
-        print(self.get("nbands"), self.get("nbands_factor"), self.get("ncores"))
-        vis = MVLGWSet.from_prev_calc(
-            prev_calc_dir=self.get("prev_calc_dir", "."),
-            prev_incar=self.get("prev_incar", None),
-            nbands=self.get("nbands", None),
-            reciprocal_density=self.get("reciprocal_density", 100),
-            mode=self.get("mode", "DIAG"),
-            copy_wavecar=False,
-            nbands_factor=self.get("nbands_factor", 5),
-            ncores=self.get("ncores", 16),
-            **other_params
-        )
+        logger.info("nbands: {}, nbands_factor: {}, ncores: {}".format(self.get("nbands"), self.get("nbands_factor"),
+                                                                       ncores))
+        summary = load_calc_summary(self.get("prev_calc_dir", "."))
+        if summary:
+            # same as MVLGWSet.override_from_prev_calc: the previous INCAR and NBANDS win
+            vis = MVLGWSet(
+                get_structure_from_summary(summary, site_properties=False),
+                prev_incar=summary["incar"],
+                nbands=int(summary["parameters"]["NBANDS"]),
+                reciprocal_density=self.get("reciprocal_density", 100),
+                mode=mode,
+                copy_wavecar=False,
+                nbands_factor=self.get("nbands_factor", 5),
+                ncores=int(ncores),
+                **other_params
+            )
+        else:
+            vis = MVLGWSet.from_prev_calc(
+                prev_calc_dir=self.get("prev_calc_dir", "."),
+                prev_incar=self.get("prev_incar", None),
+                nbands=self.get("nbands", None),
+                reciprocal_density=self.get("reciprocal_density", 100),
+                mode=mode,
+                copy_wavecar=False,
+                nbands_factor=self.get("nbands_factor", 5),
+                ncores=int(ncores),
+                **other_params
+            )
 
         vis.write_input(".")
+        if plan:
+            from pymatgen.io.vasp.inputs import Incar
+
+            incar = Incar.from_file("INCAR")
+            if incar.pop("NPAR", None) is not None:
+                incar.write_file("INCAR")
+            return FWAction(stored_data={"gw_plan": plan})
 
 @explicit_serialize
 class JFileTransferTask(FiretaskBase):
@@ -247,7 +333,7 @@ class JFileTransferTask(FiretaskBase):
                     if 'src' in f:
                         src = os.path.abspath(os.path.expanduser(os.path.expandvars(f['src']))) if shell_interpret else f['src']
                     else:
-                        src = abspath(os.path.expanduser(os.path.expandvars(f))) if shell_interpret else f
+                        src = os.path.abspath(os.path.expanduser(os.path.expandvars(f))) if shell_interpret else f
 
                     if mode == 'rtransfer':
                         dest = self['dest']
@@ -266,10 +352,10 @@ class JFileTransferTask(FiretaskBase):
 
                     else:
                         if 'dest' in f:
-                            dest = os.path.abspath(os.path.expanduser(os.pathexpandvars(f['dest']))) if shell_interpret else f['dest']
+                            dest = os.path.abspath(os.path.expanduser(os.path.expandvars(f['dest']))) if shell_interpret else f['dest']
                         else:
                             dest = os.path.abspath(os.path.expanduser(os.path.expandvars(self['dest']))) if shell_interpret else self['dest']
-                        FileTransferTask.fn_list[mode](src, dest)
+                        self.fn_list[mode](src, dest)
 
             except:
                 traceback.print_exc()
@@ -317,6 +403,9 @@ class JWriteInputsFromDB(FiretaskBase):
     optional_params = ["dest", "modify_incar"]
 
     def run_task(self, fw_spec):
+        from pymatgen.io.vasp.inputs import Incar, Kpoints, Poscar
+        from atomate.vasp.database import VaspCalcDb
+
         pth = self.get("dest", os.getcwd())
         db = VaspCalcDb.from_db_file(self["db_file"])
         e = db.collection.find_one({"task_id": self.get("task_id")})
@@ -339,6 +428,11 @@ class JWriteInputsFromDB(FiretaskBase):
 class WriteTwoDBSKpoints(FiretaskBase):
     optional_params = ["added_kpoints", "reciprocal_density", "kpoints_line_density", "mode"]
     def run_task(self, fw_spec):
+        from pymatgen.core.structure import Structure
+        from pymatgen.io.vasp.inputs import Kpoints
+        from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
+        from pymatgen.symmetry.bandstructure import HighSymmKpath
+
                  #structure, added_kpoints=None, reciprocal_density=50, kpoints_line_density=20, mode="line")
         structure = None
         try:
@@ -436,14 +530,136 @@ class WriteVaspHSEBSFromPrev(FiretaskBase):
     ]
 
     def run_task(self, fw_spec):
-        vis = MPHSEBSSet.from_prev_calc(
-            self.get("prev_calc_dir", "."),
-            mode=self.get("mode", "uniform"),
-            reciprocal_density=self.get("reciprocal_density", 50),
-            kpoints_line_density=self.get("kpoints_line_density", 10),
-            copy_chgcar=False,
-            **self.get("other_params", {})
-        )
+        from pymatgen.io.vasp.sets import MPHSEBSSet
+
+        mode = self.get("mode", "uniform")
+        summary = load_calc_summary(self.get("prev_calc_dir", "."))
+        if summary:
+            # same as MPHSEBSSet.override_from_prev_calc: the band edges are added in gap mode
+            other_params = dict(self.get("other_params", {}))
+            added_kpoints = list(other_params.pop("added_kpoints", None) or [])
+            if mode.lower() == "gap":
+                added_kpoints.extend(k for k in (summary["vbm_kpoint"], summary["cbm_kpoint"]) if k)
+            vis = MPHSEBSSet(
+                get_structure_from_summary(summary),
+                added_kpoints=added_kpoints,
+                mode=mode,
+                reciprocal_density=self.get("reciprocal_density", 50),
+                kpoints_line_density=self.get("kpoints_line_density", 10),
+                copy_chgcar=False,
+                **other_params
+            )
+        else:
+            vis = MPHSEBSSet.from_prev_calc(
+                self.get("prev_calc_dir", "."),
+                mode=mode,
+                reciprocal_density=self.get("reciprocal_density", 50),
+                kpoints_line_density=self.get("kpoints_line_density", 10),
+                copy_chgcar=False,
+                **self.get("other_params", {})
+            )
         potcar_spec = self.get("potcar_spec", False)
         vis.write_input(".", potcar_spec=potcar_spec)
 
+
+
+@explicit_serialize
+class SplitHSEBSKpoints(FiretaskBase):
+    """
+    Keep the weighted k-points of KPOINTS and the ichunk-th of nchunks
+    contiguous slices of the zero-weight (band structure) k-points, so that
+    the path of a line-mode HSE band structure runs in parallel FWs. Put it
+    after WriteVaspHSEBSFromPrev.
+
+    Required params:
+        ichunk (int): chunk of this FW, from 0
+        nchunks (int): number of chunks
+    """
+
+    required_params = ["ichunk", "nchunks"]
+
+    def run_task(self, fw_spec):
+        import numpy as np
+        from pymatgen.io.vasp.inputs import Kpoints
+
+        kpoints = Kpoints.from_file("KPOINTS")
+        labels = kpoints.labels or [None] * len(kpoints.kpts)
+        zero_weight = [i for i, w in enumerate(kpoints.kpts_weights) if w == 0]
+        chunk = set(np.array_split(zero_weight, self["nchunks"])[self["ichunk"]].tolist())
+        keep = [i for i in range(len(kpoints.kpts)) if i not in zero_weight or i in chunk]
+
+        Kpoints(
+            comment="{} (chunk {} of {})".format(kpoints.comment, self["ichunk"] + 1, self["nchunks"]),
+            style=Kpoints.supported_modes.Reciprocal,
+            num_kpts=len(keep),
+            kpts=[kpoints.kpts[i] for i in keep],
+            kpts_weights=[kpoints.kpts_weights[i] for i in keep],
+            labels=[labels[i] for i in keep],
+        ).write_file("KPOINTS")
+
+
+@explicit_serialize
+class MergeHSEBSChunks(FiretaskBase):
+    """
+    Stitch the zero-weight eigenvalues of the SplitHSEBSKpoints chunks into
+    one BandStructureSymmLine and insert a task doc: the doc of the first
+    chunk with the merged band structure in GridFS, as VaspToDb with
+    bandstructure_mode="line" would.
+
+    Required params:
+        chunk_names ([str]): calc_locs names of the chunks, in path order
+
+    Optional params:
+        db_file (str): path to the db file. Supports env_chk.
+        additional_fields (dict): fields added to the task doc
+    """
+
+    required_params = ["chunk_names"]
+    optional_params = ["db_file", "additional_fields"]
+
+    def run_task(self, fw_spec):
+        import numpy as np
+        from pymatgen.electronic_structure.bandstructure import BandStructureSymmLine
+        from pymatgen.io.vasp.inputs import Kpoints
+        from pymatgen.io.vasp.outputs import Vasprun
+        from atomate.common.firetasks.glue_tasks import get_calc_loc
+        from atomate.vasp.database import VaspCalcDb
+        from atomate.vasp.drones import VaspDrone
+        from my_atomate.firetasks.staging import find_staged_file
+
+        chunk_dirs = [get_calc_loc(name, fw_spec["calc_locs"])["path"] for name in self["chunk_names"]]
+        kpts, labels, eigenvalues, efermis = [], [], {}, []
+        for calc_dir in chunk_dirs:
+            files = set(os.listdir(calc_dir))
+            vrun = Vasprun(os.path.join(calc_dir, find_staged_file(calc_dir, "vasprun.xml", files)),
+                           parse_dos=False, parse_potcar_file=False)
+            kpoints = Kpoints.from_file(os.path.join(calc_dir, find_staged_file(calc_dir, "KPOINTS", files)))
+            chunk_labels = kpoints.labels or [None] * len(kpoints.kpts)
+            zero_weight = [i for i, w in enumerate(kpoints.kpts_weights) if w == 0]
+            kpts.extend(vrun.actual_kpoints[i] for i in zero_weight)
+            labels.extend(chunk_labels[i] for i in zero_weight)
+            for spin, eig in vrun.eigenvalues.items():
+                eigenvalues.setdefault(spin, []).append(eig[zero_weight, :, 0].T)
+            efermis.append(vrun.efermi)
+            structure = vrun.final_structure
+
+        labels_dict = {label.strip(): k for k, label in zip(kpts, labels) if label}
+        bs = BandStructureSymmLine(
+            kpts,
+            {spin: np.hstack(eigs) for spin, eigs in eigenvalues.items()},
+            structure.lattice.reciprocal_lattice,
+            efermis[0],
+            labels_dict,
+            structure=structure,
+        )
+
+        additional_fields = dict(self.get("additional_fields", {}))
+        additional_fields["hse_bs_chunks"] = {"dirs": chunk_dirs, "efermi": efermis}
+        task_doc = VaspDrone(additional_fields=additional_fields, parse_dos=False,
+                             bandstructure_mode=False).assimilate(chunk_dirs[0])
+        task_doc["calcs_reversed"][0]["bandstructure"] = bs.as_dict()
+
+        mmdb = VaspCalcDb.from_db_file(env_chk(self.get("db_file"), fw_spec), admin=True)
+        task_id = mmdb.insert_task(task_doc, use_gridfs=True)
+        return FWAction(stored_data={"task_id": task_id, "nkpts": len(kpts),
+                                     "efermi_spread": max(efermis) - min(efermis)})
@@ -0,0 +1,131 @@
+"""
+Parallelization planner for the MVLGWSet DIAG/GW/BSE steps.
+
+GW in VASP runs with NCORE = 1, distributes bands over the ranks of a k-point
+group and holds the response function for every frequency. The planner picks
+KPAR, NBANDS (a multiple of the ranks per k-point group) and NOMEGA so that the
+predicted memory per rank fits the worker.
+
+"""
+
+import math
+import re
+
+__author__ = "Jeng-Yuan Tsai"
+__email__ = "tsaie79@gmail.com"
+
+
+# bytes of a complex double
+COMPLEX = 16
+
+# fixed memory per rank: executable, FFT work arrays, MPI buffers
+OVERHEAD_GB = 0.5
+
+# plane waves in the cutoff sphere per point of the (doubled) FFT grid
+PW_SPHERE_FRACTION = math.pi / 6 / 8
+
+MIN_NOMEGA = 32
+
+
+OUTCAR_PATTERNS = {
+    "nkpts": re.compile(r"NKPTS\s*=\s*(\d+)"),
+    "nbands": re.compile(r"NBANDS\s*=\s*(\d+)"),
+    "nplwv": re.compile(r"NPLWV\s*=\s*(\d+)"),
+    "ispin": re.compile(r"ISPIN\s*=\s*(\d+)"),
+    "encut": re.compile(r"ENCUT\s*=\s*([\d.]+)"),
+    "nplw": re.compile(r"maximum number of plane-waves:\s*(\d+)"),
+}
+
+
+def read_outcar_dimensions(filename="OUTCAR"):
+    """
+    NKPTS, NBANDS, NPLWV, ISPIN, ENCUT and the max number of plane waves from
+    the header of an OUTCAR. Stops reading as soon as everything is found.
+    """
+    found = {}
+    with open(filename, "rt") as f:
+        for line in f:
+            for key, pattern in OUTCAR_PATTERNS.items():
+                if key not in found:
+                    m = pattern.search(line)
+                    if m:
+                        found[key] = float(m.group(1)) if key == "encut" else int(m.group(1))
+            if len(found) == len(OUTCAR_PATTERNS):
+                break
+    missing = {"nkpts", "nbands", "nplwv"} - set(found)
+    if missing:
+        raise ValueError("Cannot read {} from {}".format(sorted(missing), filename))
+    found.setdefault("ispin", 1)
+    found.setdefault("nplw", int(found["nplwv"] * PW_SPHERE_FRACTION))
+    return found
+
+
+def predict_gw_memory(nbands, nplw, nkpts, ispin, nranks, kpar, nomega, encut=None, encutgw=None):
+    """
+    Predicted memory per rank in GB: wavefunctions of a k-point group spread
+    over its ranks, plus the response function (NPW_GW^2 per frequency and
+    q-point) spread over all ranks.
+    """
+    ranks_per_group = nranks // kpar
+    nkpts_per_group = math.ceil(nkpts / kpar)
+    wfn = nbands * nplw * nkpts_per_group * ispin * COMPLEX / ranks_per_group
+
+    chi = 0
+    if nomega:
+        npw_gw = nplw * (encutgw / encut) ** 1.5 if encut and encutgw else nplw
+        chi = nomega * npw_gw ** 2 * nkpts * COMPLEX / nranks
+    return OVERHEAD_GB + (wfn + chi) / 1024 ** 3
+
+
+def plan_gw_parallelization(dims, nranks, mem_per_rank_gb, mode="DIAG", nbands_factor=5, nomega=80,
+                            encutgw=250):
+    """
+    Choose NBANDS, NCORE, KPAR and NOMEGA for a DIAG/GW/BSE step.
+
+    Args:
+        dims (dict): output of read_outcar_dimensions for the parent calculation
+        nranks (int): MPI ranks of the job
+        mem_per_rank_gb (float): memory available per rank
+        mode (str): "DIAG", "GW" or "BSE"
+        nbands_factor (int): DIAG only, NBANDS = nbands_factor * parent NBANDS before rounding
+        nomega (int): GW only, the largest NOMEGA to use
+        encutgw (float): GW only, ENCUTGW of the run
+
+    Returns:
+        dict: the chosen INCAR values ("incar") and the inputs and prediction behind them
+    """
+    nbands_target = dims["nbands"] * nbands_factor if mode == "DIAG" else dims["nbands"]
+    nomega = nomega if mode == "GW" else 0
+
+    candidates = []
+    for kpar in [k for k in range(1, min(nranks, dims["nkpts"]) + 1) if nranks % k == 0]:
+        ranks_per_group = nranks // kpar
+        nbands = int(math.ceil(nbands_target / ranks_per_group) * ranks_per_group)
+        n_omega = nomega
+        mem = predict_gw_memory(nbands, dims["nplw"], dims["nkpts"], dims["ispin"], nranks, kpar, n_omega,
+                                dims.get("encut"), encutgw)
+        while mode == "GW" and mem > mem_per_rank_gb and n_omega > MIN_NOMEGA:
+            n_omega = max(MIN_NOMEGA, n_omega - 16)
+            mem = predict_gw_memory(nbands, dims["nplw"], dims["nkpts"], dims["ispin"], nranks, kpar, n_omega,
+                                    dims.get("encut"), encutgw)
+        candidates.append({"kpar": kpar, "nbands": nbands, "nomega": n_omega, "mem": mem})
+
+    fitting = [c for c in candidates if c["mem"] <= mem_per_rank_gb]
+    if fitting:
+        # more k-point groups parallelize better; then fewer padding bands and more frequencies
+        best = max(fitting, key=lambda c: (c["kpar"], c["nomega"], -c["nbands"]))
+    else:
+        best = min(candidates, key=lambda c: c["mem"])
+
+    incar = {"NBANDS": best["nbands"], "NCORE": 1, "KPAR": best["kpar"]}
+    if mode == "GW":
+        incar["NOMEGA"] = best["nomega"]
+    return {
+        "incar": incar,
+        "mode": mode,
+        "nranks": nranks,
+        "mem_per_rank_gb": mem_per_rank_gb,
+        "predicted_mem_per_rank_gb": best["mem"],
+        "fits": bool(fitting),
+        "parent": dims,
+    }
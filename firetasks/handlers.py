@@ -0,0 +1,457 @@
+"""
+Custodian handlers and the handler groups of the J*FWs.
+
+ScfStallHandler is a monitor for runs whose SCF cycle tends to wander for all
+NELM steps, e.g. the ALGO=All runs with fixed FERWE/FERDO occupations of
+JHSEcDFTFW. It reads only the bytes appended to OSZICAR and OUTCAR since the
+last poll and aborts the run as soon as the convergence trend shows that it
+will not converge, instead of waiting for NELM. The run is then restarted with
+the next INCAR fallback, or stopped when none is left. The diagnosis goes into
+the corrections of custodian.json and from there into the task doc.
+
+The Incremental* handlers are the monitors of atomate's default group
+(VaspErrorHandler, StdErrHandler, NonConvergingErrorHandler,
+PotimErrorHandler and PositiveEnergyErrorHandler) with the same checks and
+corrections, but they keep an offset per file and scan only the lines
+appended since the last poll, instead of re-reading vasp.out and re-parsing
+OSZICAR, INCAR, POSCAR and POTCAR every polling interval. The
+"incremental" group swaps them into the default group.
+
+RunVaspCustodian takes the name of an atomate handler group or a list of
+handlers; get_handler_group resolves the names of HANDLER_GROUPS to lists.
+
+"""
+
+import math
+import os
+import re
+
+from custodian.custodian import ErrorHandler
+from custodian.vasp.handlers import (
+    VaspErrorHandler, MeshSymmetryErrorHandler, UnconvergedErrorHandler, NonConvergingErrorHandler,
+    PotimErrorHandler, PositiveEnergyErrorHandler, FrozenJobErrorHandler, StdErrHandler, DriftErrorHandler,
+)
+
+from atomate.utils.utils import get_logger
+
+__author__ = "Jeng-Yuan Tsai"
+__email__ = "tsaie79@gmail.com"
+
+
+logger = get_logger(__name__)
+
+# electronic step of OSZICAR: algorithm, N, E, dE, d eps, ncg, rms
+SCF_LINE = re.compile(rb"^(\w+) *: *(\d+) +(\S+) +(\S+) +(\S+) +(\d+) +(\S+)")
+
+IONIC_LINE = re.compile(rb"^ *\d+ F=")
+
+# ionic step of OSZICAR: E0 and dE
+IONIC_VALUES = re.compile(rb"^ *\d+ F= *\S+ E0= *(\S+) +d E *= *(\S+)")
+
+MAGNETIZATION_LINE = re.compile(rb"number of electron +\S+ +magnetization((?: +-?[\d.]+)+)")
+
+# tried in this order, one per stall
+DEFAULT_FALLBACKS = [
+    {"ALGO": "Damped", "TIME": 0.4},
+    {"ALGO": "Damped", "TIME": 0.1, "AMIX": 0.1, "BMIX": 0.0001, "AMIX_MAG": 0.4, "BMIX_MAG": 0.0001},
+]
+
+
+class FileTail:
+    """
+    Lines appended to a file since the last read. The last ANCHOR bytes read
+    are read again every time: if they changed, the file was rewritten (as
+    when custodian restarts VASP) and is read from the start, with replaced
+    set until the next read.
+    """
+
+    ANCHOR = 64
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.replaced = False
+        self.reset()
+
+    def reset(self):
+        self.offset = 0
+        self.anchor = b""
+        self.partial = b""
+
+    def read_lines(self):
+        self.replaced = False
+        try:
+            size = os.path.getsize(self.filename)
+        except OSError:
+            return []
+        with open(self.filename, "rb") as f:
+            f.seek(self.offset - len(self.anchor))
+            data = f.read(max(size - self.offset, 0) + len(self.anchor))
+            if data[:len(self.anchor)] != self.anchor:
+                self.reset()
+                self.replaced = True
+                f.seek(0)
+                data = f.read(size)
+            else:
+                data = data[len(self.anchor):]
+        if not data:
+            return []
+        self.offset += len(data)
+        self.anchor = (self.anchor + data)[-self.ANCHOR:]
+        lines = (self.partial + data).split(b"\n")
+        # the last line may still be written
+        self.partial = lines.pop()
+        return lines
+
+
+def _to_float(text):
+    try:
+        return float(text)
+    except ValueError:
+        # VASP prints ***** for numbers that do not fit
+        return None
+
+
+def count_reversals(values, tol):
+    """
+    Number of sign changes between successive differences larger than tol.
+    """
+    diffs = [b - a for a, b in zip(values, values[1:]) if abs(b - a) > tol]
+    return sum(1 for a, b in zip(diffs, diffs[1:]) if a * b < 0)
+
+
+class ScfStallHandler(ErrorHandler):
+    """
+    Monitor that aborts an SCF cycle that stopped converging. Per ionic step,
+    after min_steps electronic steps, the last window steps are checked for:
+
+        diverging: the rms residual grew by diverge_factor over its minimum
+        oscillating_magnetization: the total magnetization reverses direction
+            in at least half of the steps with an amplitude above mag_amplitude
+        stalled: |dE| did not reach a new minimum
+
+    Every correction applies the next INCAR update of fallbacks; with none
+    left the run is stopped.
+    """
+
+    is_monitor = True
+
+    def __init__(self, output_filename="OSZICAR", outcar_filename="OUTCAR", fallbacks=None, window=20,
+                 min_steps=40, diverge_factor=100, mag_amplitude=0.05):
+        """
+        Args:
+            output_filename (str): OSZICAR
+            outcar_filename (str): OUTCAR, for the magnetization of every step
+            fallbacks ([dict]): INCAR updates, DEFAULT_FALLBACKS if None
+            window (int): electronic steps the trends are computed on
+            min_steps (int): electronic steps of an ionic step before any check
+            diverge_factor (float): growth of the rms residual counted as divergence
+            mag_amplitude (float): smallest magnetization swing (mu_B) counted as oscillation
+        """
+        self.output_filename = output_filename
+        self.outcar_filename = outcar_filename
+        self.fallbacks = DEFAULT_FALLBACKS if fallbacks is None else fallbacks
+        self.window = window
+        self.min_steps = min_steps
+        self.diverge_factor = diverge_factor
+        self.mag_amplitude = mag_amplitude
+        self.max_num_corrections = len(self.fallbacks) + 1
+        self.nfallbacks = 0
+        self.diagnosis = None
+        self._oszicar = FileTail(output_filename)
+        self._outcar = FileTail(outcar_filename)
+        self._reset_steps()
+
+    def _reset_steps(self):
+        self._de, self._rms, self._mag = [], [], []
+
+    def _read(self):
+        lines = self._oszicar.read_lines()
+        if self._oszicar.replaced:
+            self._reset_steps()
+        for line in lines:
+            m = SCF_LINE.match(line)
+            if m:
+                de, rms = _to_float(m.group(4)), _to_float(m.group(7))
+                if de is not None and rms is not None:
+                    self._de.append(abs(de))
+                    self._rms.append(rms)
+            elif IONIC_LINE.match(line):
+                self._reset_steps()
+        for line in self._outcar.read_lines():
+            if b"magnetization" not in line:
+                continue
+            m = MAGNETIZATION_LINE.search(line)
+            if m:
+                values = [float(x) for x in m.group(1).split()]
+                # length of the vector for non-collinear runs
+                self._mag.append(values[0] if len(values) == 1 else math.sqrt(sum(x ** 2 for x in values)))
+
+    def diagnose(self):
+        """
+        The reason to abort the current ionic step, None if it may still converge.
+        """
+        nsteps, window = len(self._de), self.window
+        if nsteps < max(self.min_steps, window + 1):
+            return None
+        rms_min, rms = min(self._rms), self._rms[-1]
+        if rms_min > 0 and rms > self.diverge_factor * rms_min:
+            return {"reason": "diverging", "nsteps": nsteps, "rms": rms, "rms_min": rms_min}
+        mag = self._mag[-window:]
+        if len(mag) == window and max(mag) - min(mag) > self.mag_amplitude and \
+                count_reversals(mag, self.mag_amplitude / 10) >= window // 2:
+            return {"reason": "oscillating_magnetization", "nsteps": nsteps, "mag_min": min(mag),
+                    "mag_max": max(mag)}
+        best_before, best_window = min(self._de[:-window]), min(self._de[-window:])
+        if best_window >= best_before:
+            return {"reason": "stalled", "nsteps": nsteps, "de": self._de[-1], "de_min": best_before}
+        return None
+
+    def check(self):
+        self._read()
+        self.diagnosis = self.diagnose()
+        return self.diagnosis is not None
+
+    def correct(self):
+        from custodian.utils import backup
+        from custodian.vasp.handlers import VASP_BACKUP_FILES
+        from custodian.vasp.interpreter import VaspModder
+
+        backup(VASP_BACKUP_FILES)
+        diagnosis = self.diagnosis
+        self._oszicar.reset()
+        self._outcar.reset()
+        self._reset_steps()
+
+        if self.nfallbacks < len(self.fallbacks):
+            actions = [{"dict": "INCAR", "action": {"_set": self.fallbacks[self.nfallbacks]}}]
+            VaspModder().apply_actions(actions)
+            self.nfallbacks += 1
+            logger.warning("SCF {} after {} steps, restarting with {}".format(
+                diagnosis["reason"], diagnosis["nsteps"], actions[0]["action"]["_set"]))
+        else:
+            actions = None
+            logger.warning("SCF {} after {} steps, no fallback left".format(diagnosis["reason"],
+                                                                            diagnosis["nsteps"]))
+        return {"errors": ["scf_" + diagnosis["reason"]], "actions": actions, "diagnosis": diagnosis}
+
+
+def find_error_msgs(lines, error_msgs, errors=None):
+    """
+    The messages of error_msgs ({error: [msg]}) found in lines.
+
+    Returns:
+        dict: {error: {msg}}
+    """
+    found = {}
+    for line in lines:
+        text = line.decode("utf-8", "replace")
+        for err, msgs in error_msgs.items():
+            if errors is None or err in errors:
+                for msg in msgs:
+                    if msg in text:
+                        found.setdefault(err, set()).add(msg)
+    return found
+
+
+class IncrementalMixin:
+    """
+    State of an Incremental* handler: a FileTail on output_filename and what
+    was read from it. Both are reset when the file is rewritten and after a
+    correction, i.e. when VASP starts again.
+    """
+
+    def _init_tail(self):
+        self._tail = FileTail(self.output_filename)
+        self._reset()
+
+    def _reset(self):
+        raise NotImplementedError
+
+    def _read_lines(self):
+        lines = self._tail.read_lines()
+        if self._tail.replaced:
+            self._reset()
+        return lines
+
+    def correct(self):
+        d = super().correct()
+        self._tail.reset()
+        self._reset()
+        return d
+
+
+class IncrementalVaspErrorHandler(IncrementalMixin, VaspErrorHandler):
+    """
+    VaspErrorHandler scanning only the new lines of vasp.out. INCAR is read
+    only for a brmix error, which is ignored for charged cells as before.
+    """
+
+    def __init__(self, output_filename="vasp.out", natoms_large_cell=100, errors_subset_to_catch=None):
+        super().__init__(output_filename=output_filename, natoms_large_cell=natoms_large_cell,
+                         errors_subset_to_catch=errors_subset_to_catch)
+        self._init_tail()
+
+    def _reset(self):
+        self.errors = set()
+
+    def check(self):
+        from pymatgen.io.vasp.inputs import Incar
+
+        found = find_error_msgs(self._read_lines(), self.error_msgs, self.errors_subset_to_catch)
+        if "brmix" in found and "NELECT" in Incar.from_file("INCAR"):
+            found.pop("brmix")
+        for err, msgs in found.items():
+            if err not in self.errors:
+                logger.error("{}: {}".format(err, ", ".join(sorted(msgs))))
+        self.errors.update(found)
+        return len(self.errors) > 0
+
+
+class IncrementalStdErrHandler(IncrementalMixin, StdErrHandler):
+    """
+    StdErrHandler scanning only the new lines of std_err.txt.
+    """
+
+    def __init__(self, output_filename="std_err.txt"):
+        super().__init__(output_filename=output_filename)
+        self._init_tail()
+
+    def _reset(self):
+        self.errors = set()
+
+    def check(self):
+        self.errors.update(find_error_msgs(self._read_lines(), self.error_msgs))
+        return len(self.errors) > 0
+
+
+class IncrementalNonConvergingErrorHandler(IncrementalMixin, NonConvergingErrorHandler):
+    """
+    NonConvergingErrorHandler counting the electronic steps of every ionic
+    step from the new lines of OSZICAR. NELM is read from INCAR once there
+    are enough ionic steps to decide, instead of VaspInput.from_directory
+    (INCAR, KPOINTS, POSCAR and POTCAR) every poll.
+    """
+
+    def __init__(self, output_filename="OSZICAR", nionic_steps=10):
+        super().__init__(output_filename=output_filename, nionic_steps=nionic_steps)
+        self._init_tail()
+
+    def _reset(self):
+        self._esteps = []
+        self._nelm = None
+
+    def check(self):
+        from pymatgen.io.vasp.inputs import Incar
+
+        for line in self._read_lines():
+            m = SCF_LINE.match(line)
+            if m:
+                if m.group(2) == b"1":
+                    self._esteps.append(1)
+                elif self._esteps:
+                    self._esteps[-1] += 1
+        # the last ionic step may still be running
+        if len(self._esteps) <= self.nionic_steps:
+            return False
+        if self._nelm is None:
+            self._nelm = Incar.from_file("INCAR").get("NELM", 60)
+        return all(n == self._nelm for n in self._esteps[-(self.nionic_steps + 1):-1])
+
+
+class IncrementalPotimErrorHandler(IncrementalMixin, PotimErrorHandler):
+    """
+    PotimErrorHandler keeping the largest ionic dE from the new lines of
+    OSZICAR. POSCAR is read once for the number of atoms.
+    """
+
+    def __init__(self, input_filename="POSCAR", output_filename="OSZICAR", dE_threshold=1):
+        super().__init__(input_filename=input_filename, output_filename=output_filename, dE_threshold=dE_threshold)
+        self._init_tail()
+
+    def _reset(self):
+        self._nionic = 0
+        self._max_de = None
+        self._natoms = None
+
+    def check(self):
+        from pymatgen.io.vasp.inputs import Poscar
+
+        for line in self._read_lines():
+            m = IONIC_VALUES.match(line)
+            if m:
+                self._nionic += 1
+                de = _to_float(m.group(2))
+                # the first ionic step is not counted, as in PotimErrorHandler
+                if self._nionic > 1 and de is not None:
+                    self._max_de = de if self._max_de is None else max(self._max_de, de)
+        if self._max_de is None:
+            return False
+        if self._natoms is None:
+            self._natoms = len(Poscar.from_file(self.input_filename).structure)
+        return self._max_de / self._natoms > self.dE_threshold
+
+
+class IncrementalPositiveEnergyErrorHandler(IncrementalMixin, PositiveEnergyErrorHandler):
+    """
+    PositiveEnergyErrorHandler keeping the E0 of the last ionic step from the
+    new lines of OSZICAR.
+    """
+
+    def __init__(self, output_filename="OSZICAR"):
+        super().__init__(output_filename=output_filename)
+        self._init_tail()
+
+    def _reset(self):
+        self._e0 = None
+
+    def check(self):
+        for line in self._read_lines():
+            m = IONIC_VALUES.match(line)
+            if m:
+                self._e0 = _to_float(m.group(1))
+        return self._e0 is not None and self._e0 > 0
+
+
+def get_default_handlers():
+    """
+    The "default" handler group of atomate's RunVaspCustodian, which defines
+    it inside run_task.
+    """
+    return [VaspErrorHandler(), MeshSymmetryErrorHandler(), UnconvergedErrorHandler(), NonConvergingErrorHandler(),
+            PotimErrorHandler(), PositiveEnergyErrorHandler(), FrozenJobErrorHandler(), StdErrHandler(),
+            DriftErrorHandler()]
+
+
+def get_incremental_handlers():
+    """
+    The default group with the Incremental* monitors, in the same order.
+    """
+    return [IncrementalVaspErrorHandler(), MeshSymmetryErrorHandler(), UnconvergedErrorHandler(),
+            IncrementalNonConvergingErrorHandler(), IncrementalPotimErrorHandler(),
+            IncrementalPositiveEnergyErrorHandler(), FrozenJobErrorHandler(), IncrementalStdErrHandler(),
+            DriftErrorHandler()]
+
+
+HANDLER_GROUPS = {
+    "scf_monitor": lambda: get_default_handlers() + [ScfStallHandler()],
+    # for runs that cannot use the default handlers, e.g. GW
+    "scf_monitor_only": lambda: [ScfStallHandler()],
+    "incremental": get_incremental_handlers,
+    "incremental_scf_monitor": lambda: get_incremental_handlers() + [ScfStallHandler()],
+}
+
+
+def get_handler_group(name):
+    """
+    handler_group of RunVaspCustodian: a name of HANDLER_GROUPS becomes its
+    list of handlers, other names are atomate's and are returned as they are.
+
+    Args:
+        name (str or [ErrorHandler])
+
+    Returns:
+        str or [ErrorHandler]
+    """
+    if isinstance(name, str) and name in HANDLER_GROUPS:
+        return HANDLER_GROUPS[name]()
+    return name
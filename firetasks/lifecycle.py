@@ -0,0 +1,162 @@
+"""
+Reference-counted lifecycle of large intermediate files (WAVECAR, CHGCAR, ...).
+
+The producing FW writes a manifest listing, for every artifact, the tokens of
+the child FWs that still have to copy it. Each consuming child drops a marker
+file named after its token into the producer's directory once it is done. When
+every consumer of an artifact has checked in, the artifact is compressed or
+deleted. Markers are plain files, so reruns are safe, and the release of an
+artifact is claimed by creating its marker exclusively, so that of several
+siblings checking in at once only one compresses or deletes it.
+
+See my_atomate.powerups.manage_artifacts for wiring this into a workflow.
+
+"""
+
+import glob
+import json
+import os
+
+from fireworks import explicit_serialize, FiretaskBase, FWAction
+
+from atomate.utils.utils import env_chk, get_logger
+
+from my_atomate.firetasks.staging import compress_file, get_compressed_extension
+
+__author__ = "Jeng-Yuan Tsai"
+__email__ = "tsaie79@gmail.com"
+
+
+logger = get_logger(__name__)
+
+MANIFEST = ".artifacts.json"
+MARKER_DIR = ".artifacts"
+
+
+def get_artifact_files(calc_dir, artifact):
+    """
+    All files in calc_dir holding the given artifact, e.g. WAVECAR, WAVECAR.relax1,
+    WAVECAR.gz or WFULL0001.tmp.
+    """
+    files = glob.glob(os.path.join(calc_dir, artifact + "*"))
+    return sorted(f for f in files if not f.endswith(".staging"))
+
+
+def _claim_release(marker_dir, artifact):
+    """
+    Atomically create the released marker of artifact. Returns False if it
+    already exists, i.e. another process has claimed the release.
+    """
+    os.makedirs(marker_dir, exist_ok=True)
+    try:
+        fd = os.open(os.path.join(marker_dir, "released-" + artifact), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    os.close(fd)
+    return True
+
+
+def release_ready_artifacts(calc_dir):
+    """
+    Compress or delete every artifact in calc_dir whose consumers have all
+    checked in. Artifacts that were already released, or are being released
+    by another process, are skipped.
+
+    Returns:
+        dict: {artifact: [released files]}
+    """
+    with open(os.path.join(calc_dir, MANIFEST)) as f:
+        manifest = json.load(f)
+    marker_dir = os.path.join(calc_dir, MARKER_DIR)
+    done = set(os.listdir(marker_dir)) if os.path.isdir(marker_dir) else set()
+
+    released = {}
+    for artifact, tokens in manifest["artifacts"].items():
+        if "released-" + artifact in done or not set(tokens) <= done:
+            continue
+        if not _claim_release(marker_dir, artifact):
+            continue
+        released[artifact] = []
+        try:
+            for fname in get_artifact_files(calc_dir, artifact):
+                if manifest["action"] == "delete":
+                    try:
+                        os.remove(fname)
+                    except FileNotFoundError:
+                        continue
+                elif get_compressed_extension(fname):
+                    continue
+                else:
+                    fname = compress_file(fname, codec=manifest.get("codec", "gz"), nthreads=manifest.get("nthreads"))
+                released[artifact].append(fname)
+        except Exception:
+            # give the release back so that the next consumer can retry it
+            os.remove(os.path.join(marker_dir, "released-" + artifact))
+            raise
+        logger.info("{} {} in {}".format(manifest["action"], released[artifact], calc_dir))
+    return released
+
+
+@explicit_serialize
+class TrackArtifacts(FiretaskBase):
+    """
+    Register the artifacts of the current directory and the tokens of the
+    children that consume them. Artifacts without consumers are released right
+    away. Meant to be the last task of the producing FW.
+
+    Required params:
+        artifacts (dict): {artifact name: [consumer tokens]}
+
+    Optional params:
+        action (str): "compress" (default) or "delete"
+        codec (str): "gz" (default) or "zst", for action="compress"
+        nthreads (int): compression threads. Supports env_chk.
+    """
+
+    required_params = ["artifacts"]
+    optional_params = ["action", "codec", "nthreads"]
+
+    def run_task(self, fw_spec):
+        manifest = {
+            "artifacts": self["artifacts"],
+            "action": self.get("action", "compress"),
+            "codec": self.get("codec", "gz"),
+            "nthreads": env_chk(self.get("nthreads"), fw_spec),
+        }
+        # a rerun produces fresh artifacts, forget earlier check-ins and releases
+        if os.path.isdir(MARKER_DIR):
+            for marker in os.listdir(MARKER_DIR):
+                os.remove(os.path.join(MARKER_DIR, marker))
+        with open(MANIFEST, "w") as f:
+            json.dump(manifest, f, indent=4)
+        released = release_ready_artifacts(os.getcwd())
+        return FWAction(stored_data={"released_artifacts": released})
+
+
+@explicit_serialize
+class ReleaseArtifacts(FiretaskBase):
+    """
+    Check in as a consumer of the artifacts of the parent directories and
+    release those that no other child still needs. Meant to be the last task
+    of the consuming FW.
+
+    Required params:
+        token (str): consumer token assigned by manage_artifacts
+    """
+
+    required_params = ["token"]
+
+    def run_task(self, fw_spec):
+        released = []
+        for calc_loc in fw_spec.get("calc_locs", []):
+            calc_dir = calc_loc["path"]
+            if calc_loc.get("filesystem") or not os.path.exists(os.path.join(calc_dir, MANIFEST)):
+                continue
+            with open(os.path.join(calc_dir, MANIFEST)) as f:
+                tokens = set(t for ts in json.load(f)["artifacts"].values() for t in ts)
+            if self["token"] not in tokens:
+                continue
+            os.makedirs(os.path.join(calc_dir, MARKER_DIR), exist_ok=True)
+            open(os.path.join(calc_dir, MARKER_DIR, self["token"]), "w").close()
+            released.append({"calc_dir": calc_dir, "released": release_ready_artifacts(calc_dir)})
+        return FWAction(stored_data={"released_artifacts": released})
@@ -0,0 +1,441 @@
+"""
+Lightweight extractors for large VASP outputs.
+
+stream_vasprun walks vasprun.xml with iterparse and copies eigenvalues, the
+total and projected DOS and the final structure into preallocated numpy
+arrays, clearing every element once it is read. Memory stays at the size of
+the arrays instead of the DOM-like lists of pymatgen's Vasprun, which takes
+many GB for large supercells with dense DOS (NEDOS=9000, LORBIT).
+
+The OUTCAR/OSZICAR extractors read single values (Fermi level, final energy,
+magnetization, NELECT, NBANDS, convergence) without building pymatgen's
+Outcar, which parses every line of files that reach hundreds of MB for HSE
+runs. Values printed at the end are searched backwards in a memory map of
+the file, values of the header forwards until they are found.
+
+"""
+
+import contextlib
+import mmap
+import os
+import re
+
+import numpy as np
+
+__author__ = "Jeng-Yuan Tsai"
+__email__ = "tsaie79@gmail.com"
+
+
+def _get_parameters(elem):
+    params = {}
+    for name, cast in (("NBANDS", int), ("NEDOS", int), ("ISPIN", int), ("NIONS", int), ("LORBIT", int)):
+        i = elem.find(".//i[@name='{}']".format(name))
+        if i is not None and i.text and i.text.strip().lstrip("-").isdigit():
+            params[name] = cast(i.text)
+    for name in ("LNONCOLLINEAR", "LSORBIT"):
+        i = elem.find(".//i[@name='{}']".format(name))
+        if i is not None and i.text:
+            params[name] = i.text.strip().upper().startswith("T")
+    return params
+
+
+def _get_rows(elem):
+    """
+    The <r> rows of a <set> as one float array (nrows, ncols).
+    """
+    rows = [r.text for r in elem.iter("r")]
+    data = np.fromstring(" ".join(rows), sep=" ")
+    return data.reshape(len(rows), -1) if rows else data
+
+
+def _get_varray(elem, name):
+    v = elem.find("varray[@name='{}']".format(name))
+    return np.array([[float(x) for x in row.text.split()] for row in v.findall("v")])
+
+
+def _get_structure_arrays(elem):
+    crystal = elem.find("crystal")
+    return _get_varray(crystal, "basis"), _get_varray(elem, "positions")
+
+
+def stream_vasprun(filename, parse_eigen=True, parse_dos=True, parse_pdos=True):
+    """
+    Extract eigenvalues, DOS and the final structure from vasprun.xml
+    without holding the document in memory. Compressed files are read
+    through monty's zopen. Only the last calculation block counts.
+
+    Args:
+        filename (str): vasprun.xml, possibly compressed
+        parse_eigen (bool): eigenvalues and occupations
+        parse_dos (bool): total DOS
+        parse_pdos (bool): projected DOS (LORBIT)
+
+    Returns:
+        dict: {"parameters", "species", "lattice", "frac_coords", "kpoints",
+            "kpoint_weights", "efermi", "eigenvalues" (nspin, nkpts, nbands),
+            "occupations" (nspin, nkpts, nbands), "energies" (nedos),
+            "tdos" (nspin, nedos), "orbitals" ([str]), "pdos" (nions, nspin,
+            nedos, norbitals)}; the arrays not parsed are None. For
+            noncollinear runs only the total (spin 1) projected DOS is kept,
+            as Vasprun does, and the magnetization components are dropped.
+    """
+    from xml.etree.ElementTree import iterparse
+    from monty.io import zopen
+
+    out = {"parameters": {}, "species": [], "lattice": None, "frac_coords": None, "kpoints": None,
+           "kpoint_weights": None, "efermi": None, "eigenvalues": None, "occupations": None, "energies": None,
+           "tdos": None, "orbitals": None, "pdos": None}
+    stack = []
+    spin = ion = None
+
+    with zopen(filename, "rb") as f:
+        for event, elem in iterparse(f, events=("start", "end")):
+            tag = elem.tag
+            if event == "start":
+                stack.append(tag)
+                if tag == "partial":
+                    out["orbitals"] = []
+                elif tag == "set":
+                    comment = elem.get("comment", "")
+                    if comment.startswith("spin"):
+                        spin = int(comment.split()[-1]) - 1
+                    elif comment.startswith("ion"):
+                        ion = int(comment.split()[-1]) - 1
+                continue
+
+            stack.pop()
+            parent = stack[-1] if stack else None
+            in_calculation = "calculation" in stack
+            params = out["parameters"]
+
+            if tag == "parameters" and parent == "modeling":
+                params.update(_get_parameters(elem))
+                elem.clear()
+            elif tag == "kpoints" and parent == "modeling":
+                out["kpoints"] = _get_varray(elem, "kpointlist")
+                out["kpoint_weights"] = _get_varray(elem, "weights").ravel()
+                elem.clear()
+            elif tag == "atominfo":
+                out["species"] = [rc.find("c").text.strip()
+                                  for rc in elem.find("array[@name='atoms']").iter("rc")]
+                params.setdefault("NIONS", len(out["species"]))
+                elem.clear()
+            elif tag == "structure":
+                out["lattice"], out["frac_coords"] = _get_structure_arrays(elem)
+                elem.clear()
+            elif tag == "set" and in_calculation and "projected" not in stack and \
+                    elem.get("comment", "").startswith("kpoint") and "eigenvalues" in stack:
+                if parse_eigen:
+                    if out["eigenvalues"] is None:
+                        shape = (params.get("ISPIN", 1), len(out["kpoints"]), params["NBANDS"])
+                        out["eigenvalues"], out["occupations"] = np.zeros(shape), np.zeros(shape)
+                    k = int(elem.get("comment").split()[-1]) - 1
+                    rows = _get_rows(elem)
+                    out["eigenvalues"][spin, k], out["occupations"][spin, k] = rows[:, 0], rows[:, 1]
+                elem.clear()
+            elif tag == "i" and parent == "dos" and elem.get("name") == "efermi":
+                out["efermi"] = float(elem.text)
+            elif tag == "field" and "partial" in stack:
+                out["orbitals"].append(elem.text.strip())
+            elif tag == "set" and "total" in stack and elem.get("comment", "").startswith("spin"):
+                noncollinear = params.get("LNONCOLLINEAR") or params.get("LSORBIT")
+                if parse_dos and not (noncollinear and spin > 0):
+                    rows = _get_rows(elem)
+                    if out["tdos"] is None:
+                        out["tdos"] = np.zeros((params.get("ISPIN", 1), len(rows)))
+                        out["energies"] = rows[:, 0].copy()
+                    out["tdos"][spin] = rows[:, 1]
+                elem.clear()
+            elif tag == "set" and "partial" in stack and elem.get("comment", "").startswith("spin"):
+                noncollinear = params.get("LNONCOLLINEAR") or params.get("LSORBIT")
+                if parse_pdos and not (noncollinear and spin > 0):
+                    rows = _get_rows(elem)
+                    if out["pdos"] is None:
+                        out["pdos"] = np.zeros((params["NIONS"], params.get("ISPIN", 1), len(rows),
+                                                rows.shape[1] - 1))
+                    out["pdos"][ion, spin] = rows[:, 1:]
+                elem.clear()
+            elif tag in ("projected", "projected_kpoints_opt", "eigenvalues_kpoints_opt", "partial", "total",
+                         "eigenvalues", "scstep") and in_calculation:
+                elem.clear()
+            elif tag == "calculation":
+                elem.clear()
+
+    # the first field of the partial DOS is the energy
+    out["orbitals"] = out["orbitals"][1:] if parse_pdos and out["pdos"] is not None else None
+    return out
+
+
+def get_structure(data):
+    from pymatgen.core.structure import Structure
+
+    return Structure(data["lattice"], data["species"], data["frac_coords"])
+
+
+def get_complete_dos_dict(data):
+    """
+    CompleteDos.as_dict()-compatible dict of the DOS of stream_vasprun, as
+    stored by VaspCalcDb, so that CompleteDos.from_dict and
+    VaspCalcDb.get_dos read it back.
+    """
+    from pymatgen.electronic_structure.core import Orbital, OrbitalType
+
+    spins = ["1", "-1"]
+    d = {
+        "@module": "pymatgen.electronic_structure.dos",
+        "@class": "CompleteDos",
+        "efermi": data["efermi"],
+        "structure": get_structure(data).as_dict(),
+        "energies": data["energies"].tolist(),
+        "densities": {spins[s]: data["tdos"][s].tolist() for s in range(len(data["tdos"]))},
+        "pdos": [],
+    }
+    if data["pdos"] is not None:
+        # same convention as Vasprun: lm-decomposed if any orbital name has an x
+        lm = any("x" in o for o in data["orbitals"])
+        names = [str(Orbital(j) if lm else OrbitalType(j)) for j in range(len(data["orbitals"]))]
+        for site_pdos in data["pdos"]:
+            d["pdos"].append({name: {"densities": {spins[s]: site_pdos[s, :, j].tolist()
+                                                   for s in range(len(site_pdos))}}
+                              for j, name in enumerate(names)})
+    return d
+
+
+# block size of the backward search
+TAIL_BLOCK = 4 * 1024 ** 2
+
+# longest match found across the boundary of two blocks
+TAIL_OVERLAP = 4096
+
+OUTCAR_TAIL_PATTERNS = {
+    "efermi": re.compile(rb"E-fermi :\s*(-?[\d.]+)"),
+    "e_fr_energy": re.compile(rb"free  energy   TOTEN  =\s*(-?[\d.]+)"),
+    "e_0_energy": re.compile(rb"energy\(sigma->0\) =\s*(-?[\d.]+)"),
+    "magnetization": re.compile(rb"number of electron +\S+ +magnetization((?: +-?[\d.]+)+)"),
+}
+
+OUTCAR_HEAD_PATTERNS = {
+    "NELECT": re.compile(rb"NELECT\s*=\s*([\d.]+)"),
+    "NBANDS": re.compile(rb"NBANDS\s*=\s*(\d+)"),
+    "NKPTS": re.compile(rb"NKPTS\s*=\s*(\d+)"),
+    "ISPIN": re.compile(rb"ISPIN\s*=\s*(\d+)"),
+    "NIONS": re.compile(rb"NIONS\s*=\s*(\d+)"),
+}
+
+OSZICAR_FINAL_PATTERN = re.compile(
+    rb"^ *(\d+) F= *(\S+) E0= *(\S+) +d E *= *(\S+)(?: +mag= *((?: *-?[\d.]+)+))?", re.M)
+
+
+def _is_compressed(filename):
+    from my_atomate.firetasks.staging import get_compressed_extension
+
+    return bool(get_compressed_extension(filename))
+
+
+def _to_floats(text):
+    """
+    One float, or a list for several (non-collinear magnetization).
+    """
+    values = [float(x) for x in text.split()]
+    return values[0] if len(values) == 1 else values
+
+
+@contextlib.contextmanager
+def _mapped(filename):
+    with open(filename, "rb") as f:
+        if not os.fstat(f.fileno()).st_size:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            yield buf
+
+
+def _rsearch(buf, pattern, block=TAIL_BLOCK):
+    """
+    The last match of pattern in buf, searching block by block from the end.
+    """
+    end = len(buf)
+    while end > 0:
+        start = max(end - block, 0)
+        last = None
+        for m in pattern.finditer(buf, start, min(end + TAIL_OVERLAP, len(buf))):
+            # matches starting past end were searched with the previous block
+            if m.start() < end:
+                last = m
+        if last is not None:
+            return last
+        end = start
+    return None
+
+
+def _groups(m):
+    return tuple(g.decode() if g is not None else None for g in (m.groups() or (m.group(),)))
+
+
+def tail_search(filename, pattern):
+    """
+    Groups of the last match of pattern in filename.
+
+    Plain files are memory-mapped and searched from the end, so a value
+    printed at the end of the run is found without reading the rest of the
+    file. Compressed files cannot be read backwards and are scanned line by
+    line, so pattern should not span lines.
+
+    Args:
+        filename (str): e.g. OUTCAR, possibly compressed
+        pattern (re.Pattern): bytes regex
+
+    Returns:
+        tuple of str, or None if nothing matches. Without groups, the match.
+    """
+    if _is_compressed(filename):
+        from monty.io import zopen
+
+        last = None
+        with zopen(filename, "rb") as f:
+            for line in f:
+                m = pattern.search(line)
+                if m:
+                    last = _groups(m)
+        return last
+
+    with _mapped(filename) as buf:
+        m = _rsearch(buf, pattern)
+        return _groups(m) if m else None
+
+
+def tail_block(filename, header, footer):
+    """
+    The lines after the last line matching header, up to the next line
+    matching footer (or the end of the file), e.g. the last magnetization
+    table of an OUTCAR.
+
+    Returns:
+        str or None if header does not match.
+    """
+    if _is_compressed(filename):
+        from monty.io import zopen
+
+        last, lines = None, None
+        with zopen(filename, "rb") as f:
+            for line in f:
+                if header.search(line):
+                    lines = []
+                elif lines is not None:
+                    if footer.search(line):
+                        last, lines = lines, None
+                    else:
+                        lines.append(line)
+        last = lines if lines is not None else last
+        return b"".join(last).decode() if last is not None else None
+
+    with _mapped(filename) as buf:
+        m = _rsearch(buf, header)
+        if not m:
+            return None
+        start = buf.find(b"\n", m.end()) + 1 or len(buf)
+        end = footer.search(buf, start)
+        return buf[start:end.start() if end else len(buf)].decode()
+
+
+def head_search(filename, patterns):
+    """
+    The first match of every pattern, reading forwards only until all of
+    them are found. For the parameters echoed in the header of an OUTCAR.
+
+    Args:
+        patterns (dict): {key: bytes regex with one group}
+
+    Returns:
+        dict: {key: str} of the patterns found
+    """
+    from monty.io import zopen
+
+    found = {}
+    with zopen(filename, "rb") as f:
+        for line in f:
+            for key, pattern in patterns.items():
+                if key not in found:
+                    m = pattern.search(line)
+                    if m:
+                        found[key] = m.group(1).decode()
+            if len(found) == len(patterns):
+                break
+    return found
+
+
+def get_outcar_values(filename="OUTCAR", keys=("efermi", "e_fr_energy", "e_0_energy", "magnetization")):
+    """
+    The last values of keys in OUTCAR_TAIL_PATTERNS: Fermi level, free energy,
+    energy(sigma->0) and total magnetization (a list for non-collinear runs).
+
+    Returns:
+        dict: {key: float or None}
+    """
+    values = {}
+    for key in keys:
+        groups = tail_search(filename, OUTCAR_TAIL_PATTERNS[key])
+        values[key] = _to_floats(groups[0]) if groups else None
+    return values
+
+
+def get_outcar_efermi(filename="OUTCAR"):
+    return get_outcar_values(filename, ["efermi"])["efermi"]
+
+
+def get_outcar_parameters(filename="OUTCAR", keys=("NELECT", "NBANDS", "NKPTS", "ISPIN", "NIONS")):
+    """
+    NELECT, NBANDS, NKPTS, ISPIN and NIONS from the header of an OUTCAR.
+
+    Returns:
+        dict: {key: int, or float for NELECT}; keys not found are missing.
+    """
+    found = head_search(filename, {k: OUTCAR_HEAD_PATTERNS[k] for k in keys})
+    return {k: float(v) if k == "NELECT" else int(v) for k, v in found.items()}
+
+
+def get_outcar_magnetization(filename="OUTCAR"):
+    """
+    Total magnetization of every site from the last "magnetization (x)"
+    table of an OUTCAR (LORBIT), None if there is no table.
+    """
+    table = tail_block(filename, re.compile(rb" magnetization \(x\)"), re.compile(rb"^tot", re.M))
+    if table is None:
+        return None
+    return [float(line.split()[-1]) for line in table.splitlines()
+            if line.split() and line.split()[0].isdigit()]
+
+
+def get_outcar_convergence(filename="OUTCAR"):
+    """
+    Convergence flags of a run:
+
+        electronic: the last SCF loop reached EDIFF (None if there was none)
+        ionic: the relaxation reached EDIFFG
+        finished: VASP wrote its timing summary, i.e. was not killed
+
+    An unconverged relaxation has no ionic match, so that search reads the
+    whole file, still without parsing it.
+    """
+    electronic = tail_search(filename, re.compile(rb"aborting loop (because EDIFF is reached|EDIFF was not reached)"))
+    return {
+        "electronic": electronic[0].startswith("because") if electronic else None,
+        "ionic": tail_search(filename, re.compile(rb"reached required accuracy")) is not None,
+        "finished": tail_search(filename, re.compile(rb"General timing and accounting")) is not None,
+    }
+
+
+def get_oszicar_final(filename="OSZICAR"):
+    """
+    The last ionic step of an OSZICAR.
+
+    Returns:
+        dict: {"nionic_steps", "F", "E0", "dE", "magnetization"}, or None if
+            no ionic step finished. magnetization is None for non-spin runs.
+    """
+    groups = tail_search(filename, OSZICAR_FINAL_PATTERN)
+    if not groups:
+        return None
+    step, f, e0, de, mag = groups
+    return {"nionic_steps": int(step), "F": float(f), "E0": float(e0), "dE": float(de),
+            "magnetization": _to_floats(mag) if mag else None}
@@ -0,0 +1,154 @@
+"""
+Per-firetask timing and resource instrumentation.
+
+ProfiledTask wraps any firetask and records wall time, CPU time, peak RSS, bytes
+read/written and the number of files in the launch dir. Records accumulate in
+profiling.json in the launch dir, are attached as "profiling" to the task doc by
+a wrapped VaspToDb and to the stored_data of the launch.
+
+See my_atomate.powerups.add_profiling and my_atomate.tools.profiling.
+
+"""
+
+import json
+import os
+import resource
+import time
+
+from fireworks import explicit_serialize, FiretaskBase, FWAction
+from fireworks.utilities.fw_serializers import load_object
+
+__author__ = "Jeng-Yuan Tsai"
+__email__ = "tsaie79@gmail.com"
+
+
+PROFILING_FILE = "profiling.json"
+
+# ru_inblock/ru_oublock count 512-byte blocks
+BLOCK_SIZE = 512
+
+PROC_IO = "/proc/self/io"
+
+
+def _get_fw_name(task):
+    return task._fw_name if isinstance(task, FiretaskBase) else task["_fw_name"]
+
+
+def get_task_name(task):
+    """
+    Class name of a firetask (object or dict); for a ProfiledTask, that of the
+    task it wraps.
+    """
+    name = _get_fw_name(task).strip("{}").split(".")[-1]
+    if name == "ProfiledTask":
+        return get_task_name(task["task"])
+    return name
+
+
+def unwrap_task(task):
+    """
+    The firetask a ProfiledTask wraps, deserialized; any other task as is.
+    """
+    if _get_fw_name(task).strip("{}").split(".")[-1] != "ProfiledTask":
+        return task
+    inner = task["task"]
+    return inner if isinstance(inner, FiretaskBase) else load_object(inner)
+
+
+def get_io_counters():
+    """
+    Bytes read and written through read/write calls by this process and its
+    reaped children, from /proc/self/io (rchar/wchar). Unlike the block
+    counters of getrusage these include page cache hits and network
+    filesystems. None if /proc/self/io is not available.
+    """
+    try:
+        with open(PROC_IO) as f:
+            counters = dict(line.split(":") for line in f if ":" in line)
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def get_resource_snapshot(path="."):
+    """
+    Cumulative resource usage of this process and its (reaped) children.
+    Bytes read/written come from /proc/self/io, or from the getrusage block
+    counters where that is not available.
+    """
+    own, children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    files = [f for f in os.listdir(path) if os.path.isfile(os.path.join(path, f))]
+    io = get_io_counters() or ((own.ru_inblock + children.ru_inblock) * BLOCK_SIZE,
+                               (own.ru_oublock + children.ru_oublock) * BLOCK_SIZE)
+    return {
+        "wall": time.time(),
+        "cpu": own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime,
+        "bytes_read": io[0],
+        "bytes_written": io[1],
+        # kB on linux
+        "maxrss_self": own.ru_maxrss * 1024,
+        "maxrss_children": children.ru_maxrss * 1024,
+        "nfiles": len(files),
+    }
+
+
+def get_profiling_record(name, before, after):
+    return {
+        "task": name,
+        "wall_time": after["wall"] - before["wall"],
+        "cpu_time": after["cpu"] - before["cpu"],
+        "bytes_read": after["bytes_read"] - before["bytes_read"],
+        "bytes_written": after["bytes_written"] - before["bytes_written"],
+        # high-water marks: the largest process seen so far, not per task
+        "peak_rss": after["maxrss_self"],
+        "peak_rss_children": after["maxrss_children"],
+        "nfiles": after["nfiles"],
+        "nfiles_created": after["nfiles"] - before["nfiles"],
+    }
+
+
+def load_profiling(path="."):
+    fname = os.path.join(path, PROFILING_FILE)
+    if not os.path.exists(fname):
+        return {}
+    with open(fname) as f:
+        return json.load(f)
+
+
+@explicit_serialize
+class ProfiledTask(FiretaskBase):
+    """
+    Run a firetask and record its resource usage.
+
+    Required params:
+        task (dict): serialized firetask to run
+        index (int): position of the task in the FW, used to key the records
+            so that reruns in the same dir overwrite rather than append
+    """
+
+    required_params = ["task", "index"]
+
+    def run_task(self, fw_spec):
+        task = unwrap_task(self)
+        name = get_task_name(task)
+        records = load_profiling()
+
+        if "VaspToDb" in name:
+            task["additional_fields"] = dict(task.get("additional_fields") or {})
+            task["additional_fields"]["profiling"] = [records[k] for k in sorted(records, key=int)]
+
+        before = get_resource_snapshot()
+        action, failed = None, True
+        try:
+            action = task.run_task(fw_spec)
+            failed = False
+        finally:
+            record = get_profiling_record(name, before, get_resource_snapshot())
+            record["failed"] = failed
+            records[str(self["index"])] = record
+            with open(PROFILING_FILE, "w") as f:
+                json.dump(records, f, indent=4)
+
+        action = action if isinstance(action, FWAction) else FWAction()
+        action.stored_data["profiling"] = [records[k] for k in sorted(records, key=int)]
+        return action
@@ -1,39 +1,48 @@
 """
 Firetasks for FWs.
 
+pytopomat, spglib, pymatgen and the database are imported in run_task, so
+deserializing a FW that uses these tasks stays cheap.
+
 """
 
-import shutil
 import json
 import os
-import numpy as np
-
-from monty.json import MontyEncoder, jsanitize
-
-from spglib import standardize_cell
-
-from pymatgen.core.structure import Structure
-from pymatgen.io.vasp import Incar, Outcar, Kpoints
 
-from pytopomat.irvsp_caller import IRVSPCaller, IRVSPOutput, IRVSPOutputAll
-from pytopomat.vasp2trace_caller import (
-    Vasp2TraceCaller,
-    Vasp2Trace2Caller,
-    Vasp2TraceOutput,
-)
-from pytopomat.z2pack_caller import Z2PackCaller
+from monty.json import jsanitize
 
 from fireworks import explicit_serialize, FiretaskBase, FWAction
 from fireworks.utilities.fw_serializers import DATETIME_HANDLER
 
 from atomate.utils.utils import env_chk, get_logger
-from atomate.utils.database import CalcDb
-from atomate.vasp.database import VaspCalcDb
 
 
 logger = get_logger(__name__)
 
 
+def get_run_info(wd):
+    """
+    Formula and structure (dict) of the POSCAR and the Fermi level of the
+    OUTCAR in wd; None for what cannot be read. The Fermi level is searched
+    from the end of the OUTCAR instead of parsing it with pymatgen's Outcar.
+    """
+    from pymatgen.core.structure import Structure
+    from my_atomate.firetasks.parsers import get_outcar_efermi
+
+    formula = structure = efermi = None
+    try:
+        raw_struct = Structure.from_file(os.path.join(wd, "POSCAR"))
+        formula = raw_struct.composition.formula
+        structure = raw_struct.as_dict()
+    except (IOError, ValueError) as e:
+        logger.warning("Cannot read the POSCAR in {}: {}".format(wd, e))
+    try:
+        efermi = get_outcar_efermi(os.path.join(wd, "OUTCAR"))
+    except (IOError, ValueError) as e:
+        logger.warning("Cannot read the Fermi level in {}: {}".format(wd, e))
+    return formula, structure, efermi
+
+
 @explicit_serialize
 class RunIRVSP(FiretaskBase):
     """
@@ -42,24 +51,15 @@ class RunIRVSP(FiretaskBase):
     """
     optional_params = ["set_spn", "symprec"]
     def run_task(self, fw_spec):
+        from pymatgen.io.vasp import Kpoints
+        from pytopomat.irvsp_caller import IRVSPCaller, IRVSPOutput
 
         wd = os.getcwd()
         set_spn = self["set_spn"]
         symprec = self["symprec"]
         irvsp_caller = IRVSPCaller(wd, set_spn=set_spn, symprec=symprec)
 
-        try:
-            raw_struct = Structure.from_file(wd + "/POSCAR")
-            formula = raw_struct.composition.formula
-            structure = raw_struct.as_dict()
-
-            outcar = Outcar(wd + "/OUTCAR")
-            efermi = outcar.efermi
-
-        except:
-            formula = None
-            structure = None
-            efermi = None
+        formula, structure, efermi = get_run_info(wd)
 
         kpoints = Kpoints.from_file(wd + "/KPOINTS")
         data = IRVSPOutput(wd + "/outir.txt", kpoints)
@@ -83,24 +83,15 @@ class RunIRVSPAll(FiretaskBase):
     """
     required_params = ["set_spn", "symprec"]
     def run_task(self, fw_spec):
+        from pymatgen.io.vasp import Kpoints
+        from pytopomat.irvsp_caller import IRVSPCaller, IRVSPOutput, IRVSPOutputAll
 
         wd = os.getcwd()
         set_spn = self["set_spn"]
         symprec = self["symprec"]
         irvsp_caller = IRVSPCaller(wd, set_spn=set_spn, symprec=symprec)
 
-        try:
-            raw_struct = Structure.from_file(wd + "/POSCAR")
-            formula = raw_struct.composition.formula
-            structure = raw_struct.as_dict()
-
-            outcar = Outcar(wd + "/OUTCAR")
-            efermi = outcar.efermi
-
-        except:
-            formula = None
-            structure = None
-            efermi = None
+        formula, structure, efermi = get_run_info(wd)
 
         kpoints = Kpoints.from_file(wd + "/KPOINTS")
         general = IRVSPOutputAll(wd + "/outir.txt")
@@ -127,24 +118,14 @@ class RunIRVSPsingleKpt(FiretaskBase):
     """
     required_params = ["set_spn", "symprec"]
     def run_task(self, fw_spec):
+        from pytopomat.irvsp_caller import IRVSPCaller, IRVSPOutputAll
 
         wd = os.getcwd()
         set_spn = self["set_spn"]
         symprec = self["symprec"]
         irvsp_caller = IRVSPCaller(wd, set_spn=set_spn, symprec=symprec)
 
-        try:
-            raw_struct = Structure.from_file(wd + "/POSCAR")
-            formula = raw_struct.composition.formula
-            structure = raw_struct.as_dict()
-
-            outcar = Outcar(wd + "/OUTCAR")
-            efermi = outcar.efermi
-
-        except:
-            formula = None
-            structure = None
-            efermi = None
+        formula, structure, efermi = get_run_info(wd)
 
         general = IRVSPOutputAll(wd + "/outir.txt")
         data = general.as_dict().copy()
@@ -169,6 +150,8 @@ class StandardizeCell(FiretaskBase):
     """
 
     def run_task(self, fw_spec):
+        from pymatgen.core.structure import Structure
+        from spglib import standardize_cell
 
         wd = os.getcwd()
 
@@ -235,6 +218,8 @@ class IRVSPToDb(FiretaskBase):
             with open("irvsp.json", "w") as f:
                 f.write(json.dumps(d, default=DATETIME_HANDLER, indent=4))
         else:
+            from atomate.vasp.database import VaspCalcDb
+
             db = VaspCalcDb.from_db_file(db_file, admin=True)
             db.collection = db.db[self.get("collection_name", db.collection.name)]
             t_id = db.insert(d)
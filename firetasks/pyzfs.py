@@ -1,9 +1,7 @@
 from fireworks import explicit_serialize, FiretaskBase, FWAction
+from fireworks.utilities.fw_serializers import DATETIME_HANDLER
 
 from atomate.utils.utils import env_chk, get_logger, logger
-from atomate.vasp.database import VaspCalcDb
-
-from pymatgen.io.vasp.inputs import Structure
 
 from monty.serialization import loadfn
 from monty.json import jsanitize
@@ -24,6 +22,7 @@ class RunPyzfs(FiretaskBase):
     required_params = ["pyzfs_cmd"]
 
     def run_task(self, fw_spec):
+        from pymatgen.core.structure import Structure
 
         wd = os.getcwd()
 
@@ -71,8 +70,10 @@ class PyzfsToDb(FiretaskBase):
             with open("pyzfs_todb.json", "w") as f:
                 f.write(json.dumps(d, default=DATETIME_HANDLER, indent=4))
         else:
+            from atomate.vasp.database import VaspCalcDb
+
             db = VaspCalcDb.from_db_file(db_file, admin=True)
-            print(self.get("collection_name", db.collection.name))
+            logger.info("Storing pyzfs results in {}".format(self.get("collection_name", db.collection.name)))
             db.collection = db.db[self.get("collection_name", db.collection.name)]
             t_id = db.insert(d)
             logger.info("Pyzfs calculation complete.")
@@ -0,0 +1,587 @@
+"""
+Staging of VASP outputs between launch directories.
+
+Compressed files (WAVECAR.gz, CHGCAR.zst, ...) are decompressed while they are
+copied, in a single pass, with a multithreaded codec whenever one is available
+on the worker (bgzip for BGZF, pigz for plain gzip, pzstd/zstd for zstd frames).
+The pure-python codecs are only used as a fallback.
+
+RunVaspCustodianScratch runs VASP in node-local scratch and writes back only a
+declared set of outputs. CompressOutputs compresses finished outputs, optionally
+in a detached process so that the FW can complete right away:
+
+    python -m my_atomate.firetasks.staging [--codec gz|zst] [--nthreads N] FILE [FILE ...]
+
+"""
+
+import bz2
+import glob
+import gzip
+import hashlib
+import json
+import lzma
+import os
+import re
+import shutil
+import struct
+import subprocess
+import sys
+import time
+import uuid
+
+from fireworks import explicit_serialize, FiretaskBase, FWAction
+
+from atomate.common.firetasks.glue_tasks import get_calc_loc
+from atomate.utils.utils import env_chk, get_logger
+from atomate.vasp.firetasks.glue_tasks import CopyVaspOutputs
+from atomate.vasp.firetasks.run_calc import RunVaspCustodian
+
+from my_atomate.firetasks.calc_summary import CALC_SUMMARY_FILE
+
+__author__ = "Jeng-Yuan Tsai"
+__email__ = "tsaie79@gmail.com"
+
+
+logger = get_logger(__name__)
+
+COMPRESSED_EXTENSIONS = (".gz", ".GZ", ".zst", ".bz2", ".xz")
+
+BUFFER_SIZE = 16 * 1024 ** 2
+
+COMPRESS_FILES = ["vasprun.xml", "OUTCAR", "PROCAR", "DOSCAR", "WAVECAR"]
+
+# always written back from node scratch; the outputs switched on by the INCAR
+# are added by get_incar_outputs
+STAGE_OUT_FILES = [
+    "INCAR", "KPOINTS", "POSCAR", "POTCAR", "CONTCAR", "OUTCAR", "OSZICAR", "vasprun.xml", "EIGENVAL",
+    "IBZKPT", "vasp.out", "std_err.txt", "custodian.json",
+]
+
+
+def get_nthreads(nthreads=None):
+    """
+    Number of threads a codec may use; defaults to the cores this process is bound to.
+    """
+    if nthreads:
+        return int(nthreads)
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def get_compressed_extension(path):
+    for ext in COMPRESSED_EXTENSIONS:
+        if path.endswith(ext):
+            return ext
+    return ""
+
+
+def is_bgzf(path):
+    """
+    True if path is a BGZF file, i.e. a gzip stream of independent blocks that
+    bgzip can decompress in parallel.
+    """
+    with open(path, "rb") as f:
+        header = f.read(18)
+    # gzip magic, FEXTRA flag set and a "BC" extra subfield
+    return len(header) == 18 and header[:2] == b"\x1f\x8b" and header[3] & 4 and header[12:14] == b"BC"
+
+
+def _decompress_cmd(path, nthreads):
+    ext = get_compressed_extension(path)
+    if ext in (".gz", ".GZ"):
+        if shutil.which("bgzip") and is_bgzf(path):
+            return ["bgzip", "-d", "-c", "-@", str(nthreads), path]
+        if shutil.which("pigz"):
+            return ["pigz", "-d", "-c", "-p", str(nthreads), path]
+    elif ext == ".zst":
+        if shutil.which("pzstd"):
+            return ["pzstd", "-d", "-c", "-q", "-p", str(nthreads), path]
+        if shutil.which("zstd"):
+            return ["zstd", "-d", "-c", "-q", "-T{}".format(nthreads), path]
+    elif ext == ".bz2" and shutil.which("lbzip2"):
+        return ["lbzip2", "-d", "-c", "-n", str(nthreads), path]
+    elif ext == ".xz" and shutil.which("xz"):
+        return ["xz", "-d", "-c", "-T{}".format(nthreads), path]
+    return None
+
+
+def _open_compressed(path):
+    ext = get_compressed_extension(path)
+    if ext in (".gz", ".GZ"):
+        return gzip.open(path, "rb")
+    if ext == ".bz2":
+        return bz2.open(path, "rb")
+    if ext == ".xz":
+        return lzma.open(path, "rb")
+    if ext == ".zst":
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+    return open(path, "rb")
+
+
+def get_uncompressed_size(path):
+    """
+    Size of the content of path, the same for a file and its compressed copy.
+    Compressed files are decompressed in a stream to count it.
+    """
+    if not get_compressed_extension(path):
+        return os.path.getsize(path)
+    size = 0
+    with _open_compressed(path) as f:
+        for chunk in iter(lambda: f.read(BUFFER_SIZE), b""):
+            size += len(chunk)
+    return size
+
+
+def _get_bgzf_size(f, file_size):
+    # every BGZF block stores its size (BSIZE) in the header and the size of
+    # its content (ISIZE) in the last 4 bytes
+    size, offset = 0, 0
+    while offset < file_size:
+        f.seek(offset)
+        header = f.read(18)
+        if len(header) < 18 or header[:2] != b"\x1f\x8b" or header[12:14] != b"BC":
+            return None
+        offset += struct.unpack("<H", header[16:18])[0] + 1
+        f.seek(offset - 4)
+        size += struct.unpack("<I", f.read(4))[0]
+    return size
+
+
+def get_size_fingerprint(path):
+    """
+    The size of the content of path modulo 2**32, the same for a file and its
+    compressed copy. gzip files are not decompressed: the size is read from
+    the ISIZE trailer, summed over the blocks of a BGZF file. Other codecs are
+    streamed through get_uncompressed_size.
+    """
+    ext = get_compressed_extension(path)
+    if not ext:
+        return os.path.getsize(path) % 2 ** 32
+    if ext in (".gz", ".GZ"):
+        file_size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            size = _get_bgzf_size(f, file_size) if is_bgzf(path) else None
+            if size is None:
+                f.seek(file_size - 4)
+                size = struct.unpack("<I", f.read(4))[0]
+        return size % 2 ** 32
+    return get_uncompressed_size(path) % 2 ** 32
+
+
+def decompress_copy(src, dest, nthreads=None):
+    """
+    Copy src to dest, decompressing on the fly if src is compressed. The data is
+    read once and written once; the compressed file is never materialized in
+    the destination directory.
+
+    Args:
+        src (str): source file, possibly ending in one of COMPRESSED_EXTENSIONS
+        dest (str): destination file (uncompressed)
+        nthreads (int): threads for the external codec. Defaults to all available cores.
+
+    Returns:
+        str: dest
+    """
+    if not get_compressed_extension(src):
+        shutil.copyfile(src, dest)
+        return dest
+
+    cmd = _decompress_cmd(src, get_nthreads(nthreads))
+    tmp = dest + ".staging"
+    try:
+        with open(tmp, "wb") as f_out:
+            if cmd:
+                subprocess.run(cmd, stdout=f_out, stderr=subprocess.PIPE, check=True)
+            else:
+                with _open_compressed(src) as f_in:
+                    shutil.copyfileobj(f_in, f_out, BUFFER_SIZE)
+        os.replace(tmp, dest)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return dest
+
+
+def _compress_cmd(path, codec, nthreads):
+    if codec == "gz":
+        if shutil.which("bgzip"):
+            return ["bgzip", "-c", "-@", str(nthreads), path]
+        if shutil.which("pigz"):
+            return ["pigz", "-c", "-p", str(nthreads), path]
+    elif codec == "zst":
+        if shutil.which("pzstd"):
+            return ["pzstd", "-c", "-q", "-p", str(nthreads), path]
+        if shutil.which("zstd"):
+            return ["zstd", "-c", "-q", "-T{}".format(nthreads), path]
+    return None
+
+
+def compress_file(path, codec="gz", nthreads=None, remove_original=True):
+    """
+    Compress path to path.gz (BGZF when bgzip is installed, so that it can be
+    decompressed in parallel later) or path.zst (pzstd frames). The output is
+    written to a temporary file unique to this call and renamed, so readers
+    never see a partial file and concurrent callers do not clobber each other.
+    If path is already gone but the compressed file exists, another caller
+    got there first and dest is returned as is.
+
+    Args:
+        path (str): file to compress
+        codec (str): "gz" or "zst"
+        nthreads (int): threads for the external codec. Defaults to all available cores.
+        remove_original (bool): remove path once the compressed file is in place
+
+    Returns:
+        str: path of the compressed file
+    """
+    dest = "{}.{}".format(path, codec)
+    if not os.path.exists(path) and os.path.exists(dest):
+        return dest
+    tmp = "{}.{}.staging".format(dest, uuid.uuid4().hex)
+    cmd = _compress_cmd(path, codec, get_nthreads(nthreads))
+    try:
+        with open(tmp, "wb") as f_out:
+            if cmd:
+                subprocess.run(cmd, stdout=f_out, stderr=subprocess.PIPE, check=True)
+            elif codec == "gz":
+                with open(path, "rb") as f_in, gzip.GzipFile(fileobj=f_out, mode="wb", compresslevel=6) as gz:
+                    shutil.copyfileobj(f_in, gz, BUFFER_SIZE)
+            elif codec == "zst":
+                import zstandard
+                cctx = zstandard.ZstdCompressor(threads=get_nthreads(nthreads))
+                with open(path, "rb") as f_in:
+                    cctx.copy_stream(f_in, f_out)
+            else:
+                raise ValueError("Unsupported codec: {}".format(codec))
+        os.replace(tmp, dest)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    if remove_original:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    return dest
+
+
+def checksum_copy(src, dest):
+    """
+    Copy src to dest and verify the copy by re-reading dest. dest is fsynced
+    and, where the OS supports it, dropped from the page cache first, so that
+    the re-read comes from the storage rather than from the written buffers.
+
+    Returns:
+        (str, int): sha256 hex digest and size of the copied file
+    """
+    h = hashlib.sha256()
+    with open(src, "rb") as f_in, open(dest, "wb") as f_out:
+        for chunk in iter(lambda: f_in.read(BUFFER_SIZE), b""):
+            h.update(chunk)
+            f_out.write(chunk)
+        f_out.flush()
+        os.fsync(f_out.fileno())
+    shutil.copystat(src, dest)
+
+    h_dest = hashlib.sha256()
+    with open(dest, "rb") as f:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        for chunk in iter(lambda: f.read(BUFFER_SIZE), b""):
+            h_dest.update(chunk)
+    if h.hexdigest() != h_dest.hexdigest():
+        raise IOError("Checksum mismatch staging {} -> {}".format(src, dest))
+    return h.hexdigest(), os.path.getsize(dest)
+
+
+def find_staged_file(from_dir, fname, all_files):
+    """
+    Locate fname in from_dir, following the atomate conventions: the last
+    ".relaxN" file wins and the file may be compressed.
+
+    Returns:
+        str or None: the file name in from_dir, None if missing.
+    """
+    # relax10 comes after relax2
+    pattern = re.compile(re.escape(fname) + r"\.relax(\d+)(\.|$)")
+    relax_steps = [int(m.group(1)) for m in map(pattern.match, all_files) if m]
+    relax_ext = ".relax{}".format(max(relax_steps)) if relax_steps else ""
+    for ext in ("",) + COMPRESSED_EXTENSIONS:
+        if fname + relax_ext + ext in all_files:
+            return fname + relax_ext + ext
+    return None
+
+
+@explicit_serialize
+class JCopyVaspOutputs(CopyVaspOutputs):
+    """
+    Drop-in replacement for CopyVaspOutputs that decompresses while copying,
+    using a multithreaded codec when one is installed. Remote filesystems are
+    handled by CopyVaspOutputs as before. calc_summary.json is copied along
+    with the default files when the parent wrote one.
+
+    Optional params (in addition to those of CopyVaspOutputs):
+        files_to_copy ([str]): copy exactly these files instead of the standard
+            VASP inputs/outputs plus additional_files.
+        additional_files ([str]): as in CopyVaspOutputs; "$ALL" copies every
+            file of the parent dir under its uncompressed name.
+        continue_on_missing (bool): skip missing files instead of raising.
+        nthreads (int): threads for decompression. Supports env_chk. Defaults
+            to all available cores.
+    """
+
+    optional_params = CopyVaspOutputs.optional_params + ["files_to_copy", "continue_on_missing", "nthreads"]
+
+    def run_task(self, fw_spec):
+        calc_loc = get_calc_loc(self["calc_loc"], fw_spec["calc_locs"]) if self.get("calc_loc") else {}
+
+        files_to_copy = self.get("files_to_copy")
+        self.contcar_to_poscar = self.get("contcar_to_poscar", True)
+        self.copy_all = not files_to_copy and "$ALL" in self.get("additional_files", [])
+        if files_to_copy:
+            self.contcar_to_poscar = False
+        elif self.copy_all:
+            # same as CopyVaspOutputs: setup_copy lists the whole parent dir
+            self.contcar_to_poscar = False
+            files_to_copy = None
+        else:
+            files_to_copy = ["INCAR", "POSCAR", "KPOINTS", "POTCAR", "OUTCAR", "vasprun.xml", CALC_SUMMARY_FILE]
+            files_to_copy.extend(self.get("additional_files", []))
+            if self.contcar_to_poscar:
+                files_to_copy = [f for f in files_to_copy if f != "POSCAR"] + ["CONTCAR"]
+
+        self.setup_copy(
+            self.get("calc_dir", None),
+            filesystem=self.get("filesystem", None),
+            files_to_copy=files_to_copy,
+            from_path_dict=calc_loc,
+        )
+        self.copy_files(fw_spec)
+
+    def copy_files(self, fw_spec=None):
+        if getattr(self.fileclient, "ssh", None) is not None:
+            # CopyVaspOutputs raises on missing files and runs without a summary are common
+            self.files_to_copy = [f for f in self.files_to_copy if f != CALC_SUMMARY_FILE]
+            return super(JCopyVaspOutputs, self).copy_files()
+
+        nthreads = env_chk(self.get("nthreads"), fw_spec or {})
+        all_files = set(os.listdir(self.from_dir))
+        if getattr(self, "copy_all", False):
+            return self._copy_all_files(all_files, nthreads)
+        for f in self.files_to_copy:
+            src = find_staged_file(self.from_dir, f, all_files)
+            if src is None:
+                if self.get("continue_on_missing", False) or f == CALC_SUMMARY_FILE:
+                    continue
+                raise ValueError("Cannot find file: {}".format(f))
+            dest_fname = "POSCAR" if f == "CONTCAR" and self.contcar_to_poscar else f
+            logger.info("Staging {} -> {}".format(os.path.join(self.from_dir, src), dest_fname))
+            try:
+                decompress_copy(os.path.join(self.from_dir, src), os.path.join(self.to_dir, dest_fname), nthreads)
+            except FileNotFoundError:
+                # the parent's CompressOutputs replaced the file while we were listing the dir
+                src = find_staged_file(self.from_dir, f, set(os.listdir(self.from_dir)))
+                if src is None:
+                    raise ValueError("Cannot find file: {}".format(f))
+                decompress_copy(os.path.join(self.from_dir, src), os.path.join(self.to_dir, dest_fname), nthreads)
+
+    def _copy_all_files(self, all_files, nthreads):
+        for src in sorted(all_files):
+            path = os.path.join(self.from_dir, src)
+            if not os.path.isfile(path) or src.endswith(".staging"):
+                continue
+            ext = get_compressed_extension(src)
+            dest_fname = src[:-len(ext)] if ext else src
+            if ext and dest_fname in all_files:
+                # both variants exist while the parent compresses; the plain file is complete
+                continue
+            logger.info("Staging {} -> {}".format(path, dest_fname))
+            try:
+                decompress_copy(path, os.path.join(self.to_dir, dest_fname), nthreads)
+            except FileNotFoundError:
+                # replaced by its compressed version since the dir was listed
+                compressed = find_staged_file(self.from_dir, dest_fname, set(os.listdir(self.from_dir)))
+                if compressed is None:
+                    raise ValueError("Cannot find file: {}".format(src))
+                decompress_copy(os.path.join(self.from_dir, compressed), os.path.join(self.to_dir, dest_fname),
+                                nthreads)
+
+
+def get_incar_outputs(incar):
+    """
+    Names (or glob patterns) of the optional outputs VASP writes for incar,
+    with the VASP defaults for the tags that are not set.
+    """
+    files = []
+    if incar.get("LVHAR") or incar.get("LVTOT"):
+        files.append("LOCPOT")
+    if incar.get("LCHARG", True):
+        files.extend(["CHGCAR", "AECCAR*"])
+    if incar.get("LWAVE", True):
+        files.append("WAVECAR")
+    if incar.get("LORBIT") is not None:
+        files.append("PROCAR")
+    if incar.get("LORBIT") is not None or "NEDOS" in incar:
+        files.append("DOSCAR")
+    if incar.get("LOPTICS"):
+        files.append("WAVEDER")
+    if incar.get("LELF"):
+        files.append("ELFCAR")
+    return files
+
+
+def _read_incar(calc_dir):
+    from pymatgen.io.vasp.inputs import Incar
+
+    fname = os.path.join(calc_dir, "INCAR")
+    return Incar.from_file(fname) if os.path.exists(fname) else {}
+
+
+@explicit_serialize
+class RunVaspCustodianScratch(RunVaspCustodian):
+    """
+    Run RunVaspCustodian in node-local scratch. Everything in the launch dir is
+    staged in, VASP runs in the scratch dir, and stage_out_files plus the
+    outputs the final INCAR switches on (LOCPOT for LVHAR, CHGCAR for LCHARG,
+    ..., see get_incar_outputs), with their .relaxN, .orig and compressed
+    variants, are copied back with checksum verification before the scratch
+    dir is removed. If VASP fails, everything is staged out for debugging.
+    Stage-in/out timings and checksums go to scratch_io.json and the stored_data
+    of the launch.
+
+    Optional params (in addition to those of RunVaspCustodian):
+        node_scratch_dir (str): node-local scratch root. Supports env_chk.
+            Defaults to ">>node_scratch_dir<<"; without one VASP runs in the launch dir.
+        stage_out_files ([str]): files (or glob patterns) to write back besides
+            the INCAR outputs. Defaults to STAGE_OUT_FILES; "$ALL" writes back
+            everything.
+    """
+
+    optional_params = RunVaspCustodian.optional_params + ["node_scratch_dir", "stage_out_files"]
+
+    def run_task(self, fw_spec):
+        scratch_root = env_chk(self.get("node_scratch_dir", ">>node_scratch_dir<<"), fw_spec, strict=False)
+        if not scratch_root:
+            return super(RunVaspCustodianScratch, self).run_task(fw_spec)
+
+        launch_dir = os.getcwd()
+        scratch_dir = os.path.join(scratch_root, "fw_{}".format(uuid.uuid4().hex))
+        os.makedirs(scratch_dir)
+        io = {"scratch_dir": scratch_dir, "stage_in": {}, "stage_out": {}}
+
+        t0 = time.time()
+        try:
+            for f in os.listdir(launch_dir):
+                if os.path.isfile(os.path.join(launch_dir, f)):
+                    io["stage_in"][f] = checksum_copy(os.path.join(launch_dir, f), os.path.join(scratch_dir, f))
+        except BaseException:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+            raise
+        io["stage_in_time"] = time.time() - t0
+
+        stage_out_files = self.get("stage_out_files", STAGE_OUT_FILES)
+        action = None
+        t0 = time.time()
+        try:
+            os.chdir(scratch_dir)
+            action = super(RunVaspCustodianScratch, self).run_task(fw_spec)
+        except BaseException:
+            stage_out_files = os.listdir(scratch_dir)
+            raise
+        finally:
+            os.chdir(launch_dir)
+            io["run_time"] = time.time() - t0
+            t0 = time.time()
+            if "$ALL" in stage_out_files:
+                stage_out_files = os.listdir(scratch_dir)
+            else:
+                stage_out_files = list(stage_out_files) + get_incar_outputs(_read_incar(scratch_dir))
+            srcs = set()
+            for name in stage_out_files:
+                srcs.update(glob.glob(os.path.join(scratch_dir, name)))
+                srcs.update(glob.glob(os.path.join(scratch_dir, name + ".*")))
+            for src in sorted(srcs):
+                if os.path.isfile(src):
+                    f = os.path.basename(src)
+                    io["stage_out"][f] = checksum_copy(src, os.path.join(launch_dir, f))
+            io["stage_out_time"] = time.time() - t0
+            io["stage_in_bytes"] = sum(size for _, size in io["stage_in"].values())
+            io["stage_out_bytes"] = sum(size for _, size in io["stage_out"].values())
+            with open("scratch_io.json", "w") as f:
+                json.dump(io, f, indent=4)
+            logger.info("Scratch I/O: in {:.1f} s / {} B, out {:.1f} s / {} B".format(
+                io["stage_in_time"], io["stage_in_bytes"], io["stage_out_time"], io["stage_out_bytes"]))
+            # not reached if the stage-out fails, the scratch copy is then the only complete one
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+
+        stored_data = {"scratch_io": {k: v for k, v in io.items() if k not in ("stage_in", "stage_out")}}
+        if isinstance(action, FWAction):
+            action.stored_data.update(stored_data)
+            return action
+        return FWAction(stored_data=stored_data)
+
+
+def compress_files(files, codec="gz", nthreads=None):
+    """
+    Compress files one after the other, each with all threads. Missing and
+    already compressed files are skipped.
+    """
+    compressed = []
+    for f in files:
+        if os.path.isfile(f) and not get_compressed_extension(f):
+            compressed.append(compress_file(f, codec=codec, nthreads=nthreads))
+    return compressed
+
+
+@explicit_serialize
+class CompressOutputs(FiretaskBase):
+    """
+    Compress large outputs of the current directory with a multithreaded codec.
+    Put it after VaspToDb. With background=True the compression runs in a
+    detached process and the FW completes immediately; note that the process
+    dies with the allocation if the batch job ends first.
+
+    Children stay unaffected: JCopyVaspOutputs decompresses .gz and .zst on the
+    fly, and plain CopyVaspOutputs reads the default .gz output.
+
+    Optional params:
+        files ([str]): file names, .relaxN variants included. Defaults to COMPRESS_FILES.
+        codec (str): "gz" (default, BGZF when bgzip is installed) or "zst"
+        nthreads (int): threads for the codec. Supports env_chk.
+        background (bool): compress in a detached process. Defaults to True.
+    """
+
+    optional_params = ["files", "codec", "nthreads", "background"]
+
+    def run_task(self, fw_spec):
+        files = []
+        for name in self.get("files", COMPRESS_FILES):
+            files.extend(sorted(glob.glob(name) + glob.glob(name + ".relax[0-9]")))
+        codec = self.get("codec", "gz")
+        nthreads = get_nthreads(env_chk(self.get("nthreads"), fw_spec))
+
+        if not self.get("background", True):
+            return FWAction(stored_data={"compressed": compress_files(files, codec, nthreads)})
+
+        cmd = [sys.executable, "-m", "my_atomate.firetasks.staging", "--codec", codec,
+               "--nthreads", str(nthreads)] + files
+        with open("compress_outputs.log", "ab") as log:
+            p = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+                                 start_new_session=True)
+        logger.info("Compressing {} in background process {}".format(files, p.pid))
+        return FWAction(stored_data={"compress_pid": p.pid, "compress_files": files})
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compress VASP outputs with a multithreaded codec.")
+    parser.add_argument("--codec", default="gz", choices=["gz", "zst"])
+    parser.add_argument("--nthreads", type=int, default=None)
+    parser.add_argument("files", nargs="+")
+    args = parser.parse_args()
+    for fname in compress_files(args.files, args.codec, args.nthreads):
+        print(fname)
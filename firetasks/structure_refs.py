@@ -0,0 +1,148 @@
+"""
+Structures by reference.
+
+Instead of embedding the structure (and the input set holding it) in every
+WriteVaspFromIOSet of a workflow, the structure is stored once in a
+content-addressed collection of the calculation db and the task refers to it
+by hash. Workers resolve the hash at run time and cache the structure in
+memory and on disk, so each structure is fetched once per worker.
+
+See my_atomate.powerups.use_structure_refs.
+
+"""
+
+import hashlib
+import json
+import os
+
+from fireworks import explicit_serialize, FiretaskBase
+
+from atomate.utils.utils import env_chk, get_logger
+
+__author__ = "Jeng-Yuan Tsai"
+__email__ = "tsaie79@gmail.com"
+
+
+logger = get_logger(__name__)
+
+STRUCTURES_COLLECTION = "structures"
+
+DEFAULT_CACHE_DIR = os.path.join("~", ".my_atomate", "structures")
+
+# structures resolved by this process, by hash
+_CACHE = {}
+
+
+def get_structure_hash(structure_dict):
+    """
+    sha256 of the canonical json of a Structure.as_dict().
+    """
+    from monty.json import jsanitize
+
+    content = json.dumps(jsanitize(structure_dict), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def get_structures_collection(db_file):
+    from atomate.vasp.database import VaspCalcDb
+
+    collection = VaspCalcDb.from_db_file(db_file, admin=True).db[STRUCTURES_COLLECTION]
+    collection.create_index("hash", unique=True)
+    return collection
+
+
+def store_structure(collection, structure):
+    """
+    Store a structure unless it is already there.
+
+    Returns:
+        str: hash of the structure
+    """
+    d = structure.as_dict()
+    h = get_structure_hash(d)
+    collection.update_one({"hash": h}, {"$setOnInsert": {"hash": h, "structure": d,
+                                                         "formula": structure.composition.reduced_formula}},
+                          upsert=True)
+    return h
+
+
+def load_structure(structure_ref, db_file, cache_dir=None):
+    """
+    The structure of a hash: from the process cache, the disk cache of the
+    worker or the structures collection, in that order.
+    """
+    from pymatgen.core.structure import Structure
+
+    if structure_ref in _CACHE:
+        return _CACHE[structure_ref]
+
+    cache_file = None
+    if cache_dir:
+        cache_file = os.path.join(os.path.expanduser(cache_dir), "{}.json".format(structure_ref))
+    if cache_file and os.path.exists(cache_file):
+        with open(cache_file) as f:
+            d = json.load(f)
+    else:
+        doc = get_structures_collection(db_file).find_one({"hash": structure_ref}, {"structure": 1})
+        if not doc:
+            raise ValueError("Structure {} is not in the {} collection".format(structure_ref,
+                                                                                STRUCTURES_COLLECTION))
+        d = doc["structure"]
+        if get_structure_hash(d) != structure_ref:
+            raise ValueError("Structure {} does not match its hash".format(structure_ref))
+        logger.info("Fetched structure {} from the {} collection".format(structure_ref, STRUCTURES_COLLECTION))
+        if cache_file:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            tmp_file = "{}.tmp{}".format(cache_file, os.getpid())
+            with open(tmp_file, "w") as f:
+                json.dump(d, f)
+            os.replace(tmp_file, cache_file)
+
+    _CACHE[structure_ref] = Structure.from_dict(d)
+    return _CACHE[structure_ref]
+
+
+def get_input_set(structure, vasp_input_set, vasp_input_params=None):
+    """
+    The input set of WriteVaspFromIOSetRef for structure: vasp_input_set is the
+    name of a pymatgen set or the as_dict() of an input set without its structure.
+    """
+    from monty.json import MontyDecoder
+
+    if isinstance(vasp_input_set, str):
+        from pymatgen.io.vasp import sets
+        return getattr(sets, vasp_input_set)(structure, **(vasp_input_params or {}))
+    d = dict(vasp_input_set)
+    d["structure"] = structure.as_dict()
+    return MontyDecoder().process_decoded(d)
+
+
+@explicit_serialize
+class WriteVaspFromIOSetRef(FiretaskBase):
+    """
+    WriteVaspFromIOSet with the structure given by hash.
+
+    Required params:
+        structure_ref (str): hash of the structure in the structures collection
+        vasp_input_set (dict or str): as_dict() of the input set without
+            "structure", or the name of a pymatgen input set
+
+    Optional params:
+        vasp_input_params (dict): kwargs of the input set if given by name
+        db_file (str): db of the structures collection. Supports env_chk,
+            defaults to ">>db_file<<".
+        cache_dir (str): disk cache of the worker. Supports env_chk, defaults
+            to ">>structure_cache_dir<<" or ~/.my_atomate/structures.
+        potcar_spec (bool): write POTCAR.spec instead of POTCAR
+    """
+
+    required_params = ["structure_ref", "vasp_input_set"]
+    optional_params = ["vasp_input_params", "db_file", "cache_dir", "potcar_spec"]
+
+    def run_task(self, fw_spec):
+        db_file = env_chk(self.get("db_file", ">>db_file<<"), fw_spec)
+        cache_dir = env_chk(self.get("cache_dir", ">>structure_cache_dir<<"), fw_spec, strict=False) or \
+            DEFAULT_CACHE_DIR
+        structure = load_structure(self["structure_ref"], db_file, cache_dir)
+        vis = get_input_set(structure, self["vasp_input_set"], self.get("vasp_input_params"))
+        vis.write_input(".", potcar_spec=self.get("potcar_spec", False))
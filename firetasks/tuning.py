@@ -0,0 +1,204 @@
+"""
+Empirical NCORE/KPAR tuning.
+
+Short probe runs (few electronic steps, see my_atomate.workflows.tuning) time
+different parallel layouts on a worker and record the best one in a local table
+keyed by (fworker, nsites bucket, number of k-points, functional). Production
+FWs look the layout up right before VASP starts (see
+my_atomate.powerups.add_tuned_parallel_layout).
+
+"""
+
+import fcntl
+import json
+import math
+import os
+import re
+import socket
+
+import numpy as np
+
+from fireworks import explicit_serialize, FiretaskBase, FWAction
+
+from atomate.utils.utils import env_chk, get_logger
+
+__author__ = "Jeng-Yuan Tsai"
+__email__ = "tsaie79@gmail.com"
+
+
+logger = get_logger(__name__)
+
+DEFAULT_TABLE = os.path.join("~", ".my_atomate", "parallel_table.json")
+
+LOOP_PATTERN = re.compile(r"LOOP:\s+cpu time\s+([\d.]+):\s+real time\s+([\d.]+)")
+
+
+def get_nsites_bucket(nsites):
+    """
+    Smallest power of two >= nsites.
+    """
+    return 2 ** int(math.ceil(math.log2(max(nsites, 1))))
+
+
+def count_kpoints(kpoints):
+    """
+    Number of k-points of a KPOINTS file: the listed ones, or the full mesh for
+    automatic meshes (the same number at probe and lookup time is all that matters).
+    """
+    modes = kpoints.supported_modes
+    if kpoints.style in (modes.Gamma, modes.Monkhorst):
+        return int(np.prod(kpoints.kpts[0]))
+    if kpoints.style == modes.Automatic:
+        return -1
+    return len(kpoints.kpts)
+
+
+def get_functional(incar):
+    if incar.get("LHFCALC"):
+        functional = "HSE"
+    elif incar.get("METAGGA"):
+        functional = str(incar["METAGGA"]).upper()
+    else:
+        functional = "PBE"
+    if incar.get("LSORBIT"):
+        functional += "_soc"
+    return functional
+
+
+def get_tuning_key(fworker, nsites, nkpts, functional):
+    return "{}|nsites<={}|nkpts={}|{}".format(fworker, get_nsites_bucket(nsites), nkpts, functional)
+
+
+def get_tuning_key_from_inputs(fworker, path="."):
+    from pymatgen.io.vasp.inputs import Incar, Kpoints, Poscar
+
+    incar = Incar.from_file(os.path.join(path, "INCAR"))
+    nsites = len(Poscar.from_file(os.path.join(path, "POSCAR"), check_for_POTCAR=False).structure)
+    nkpts = count_kpoints(Kpoints.from_file(os.path.join(path, "KPOINTS")))
+    return get_tuning_key(fworker, nsites, nkpts, get_functional(incar))
+
+
+def get_fworker_name(fw_spec, fworker=None):
+    return env_chk(fworker or ">>tuning_fworker<<", fw_spec, strict=False) or socket.gethostname()
+
+
+def get_table_file(fw_spec, table_file=None):
+    return os.path.expanduser(env_chk(table_file or ">>parallel_table<<", fw_spec, strict=False) or DEFAULT_TABLE)
+
+
+def load_table(table_file):
+    if not os.path.exists(table_file):
+        return {}
+    with open(table_file) as f:
+        return json.load(f)
+
+
+def update_table(table_file, key, probe):
+    """
+    Add a probe result {"NCORE", "KPAR", "time_per_step", ...} under key and
+    keep the fastest layout as "best". The table is locked while it is updated,
+    so concurrent probes do not lose results.
+    """
+    os.makedirs(os.path.dirname(table_file) or ".", exist_ok=True)
+    with open(table_file, "a+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0)
+        content = f.read()
+        table = json.loads(content) if content.strip() else {}
+        entry = table.setdefault(key, {"probes": []})
+        entry["probes"] = [p for p in entry["probes"]
+                           if (p["NCORE"], p["KPAR"]) != (probe["NCORE"], probe["KPAR"])] + [probe]
+        entry["best"] = min(entry["probes"], key=lambda p: p["time_per_step"])
+        f.seek(0)
+        f.truncate()
+        json.dump(table, f, indent=4)
+        fcntl.flock(f, fcntl.LOCK_UN)
+    return table[key]
+
+
+def read_loop_times(outcar="OUTCAR"):
+    """
+    Real time of every electronic step (LOOP lines) of an OUTCAR.
+    """
+    times = []
+    with open(outcar, "rt") as f:
+        for line in f:
+            m = LOOP_PATTERN.search(line)
+            if m:
+                times.append(float(m.group(2)))
+    return times
+
+
+@explicit_serialize
+class RecordParallelProbe(FiretaskBase):
+    """
+    Record the time per electronic step of a probe run in the tuning table.
+    The first step, which includes the setup, is skipped.
+
+    Required params:
+        layout (dict): {"NCORE": int, "KPAR": int} of the probe
+
+    Optional params:
+        table_file (str): tuning table. Supports env_chk, defaults to
+            ">>parallel_table<<" or ~/.my_atomate/parallel_table.json
+        fworker (str): fworker name in the key. Supports env_chk, defaults to
+            ">>tuning_fworker<<" or the hostname.
+    """
+
+    required_params = ["layout"]
+    optional_params = ["table_file", "fworker"]
+
+    def run_task(self, fw_spec):
+        times = read_loop_times("OUTCAR")
+        if len(times) < 2:
+            raise ValueError("Probe finished fewer than two electronic steps")
+        probe = dict(self["layout"])
+        probe["time_per_step"] = float(np.median(times[1:]))
+        probe["nsteps"] = len(times)
+
+        key = get_tuning_key_from_inputs(get_fworker_name(fw_spec, self.get("fworker")))
+        entry = update_table(get_table_file(fw_spec, self.get("table_file")), key, probe)
+        logger.info("{}: NCORE={NCORE} KPAR={KPAR} {time_per_step:.2f} s/step".format(key, **probe))
+        return FWAction(stored_data={"tuning_key": key, "probe": probe, "best": entry["best"]})
+
+
+@explicit_serialize
+class ApplyTunedParallelLayout(FiretaskBase):
+    """
+    Set NCORE/KPAR from the tuning table through ModifyIncar, right before
+    RunVaspCustodian (which has to run with auto_npar=False, otherwise its NPAR
+    wins over NCORE). Without a table entry, the auto_npar choice of NPAR is
+    made here instead.
+
+    Optional params:
+        table_file (str): see RecordParallelProbe
+        fworker (str): see RecordParallelProbe
+    """
+
+    optional_params = ["table_file", "fworker"]
+
+    def run_task(self, fw_spec):
+        from pymatgen.io.vasp.inputs import Incar
+        from atomate.vasp.firetasks.write_inputs import ModifyIncar
+
+        key = get_tuning_key_from_inputs(get_fworker_name(fw_spec, self.get("fworker")))
+        best = load_table(get_table_file(fw_spec, self.get("table_file"))).get(key, {}).get("best")
+
+        if best:
+            modify = {"incar_update": {"NCORE": best["NCORE"], "KPAR": best["KPAR"]}}
+            if "NPAR" in Incar.from_file("INCAR"):
+                modify["incar_dictmod"] = {"_unset": {"NPAR": ""}}
+            ModifyIncar(**modify).run_task(fw_spec)
+            logger.info("{}: tuned NCORE={NCORE} KPAR={KPAR}".format(key, **best))
+            return FWAction(stored_data={"tuning_key": key, "parallel_layout": best})
+
+        # same as RunVaspCustodian(auto_npar=True)
+        incar = Incar.from_file("INCAR")
+        if not (incar.get("LHFCALC") or incar.get("LRPA") or incar.get("LEPSILON")) and \
+                incar.get("IBRION") not in [5, 6, 7, 8] and "NCORE" not in incar:
+            ncores = int(os.environ.get("NSLOTS") or os.cpu_count())
+            for npar in range(int(math.sqrt(ncores)), ncores):
+                if ncores % npar == 0:
+                    ModifyIncar(incar_update={"NPAR": npar}).run_task(fw_spec)
+                    break
+        return FWAction(stored_data={"tuning_key": key, "parallel_layout": None})
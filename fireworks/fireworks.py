@@ -19,7 +19,6 @@ from atomate.vasp.config import (
     HALF_KPOINTS_FIRST_RELAX,
     RELAX_MAX_FORCE,
 )
-from atomate.vasp.firetasks.glue_tasks import CopyVaspOutputs
 from atomate.vasp.firetasks.parse_outputs import VaspToDb
 from atomate.vasp.firetasks.run_calc import (
     RunVaspCustodian,
@@ -31,10 +30,21 @@ from atomate.vasp.firetasks.write_inputs import (
     WriteVaspStaticFromPrev,
     ModifyIncar
 )
-from atomate.vasp.firetasks.jcustom import *
 from atomate.vasp.config import VASP_CMD, DB_FILE
 
-from my_atomate.firetasks.firetasks import WriteVaspHSEBSFromPrev
+from my_atomate.firetasks.firetasks import (
+    RmSelectiveDynPoscar,
+    SelectiveDynmaicPoscar,
+    JWriteScanVaspStaticFromPrev,
+    JWriteMVLGWFromPrev,
+    WriteVaspHSEBSFromPrev,
+    SplitHSEBSKpoints,
+    MergeHSEBSChunks,
+)
+from my_atomate.firetasks.staging import JCopyVaspOutputs
+from my_atomate.firetasks.calc_summary import WriteCalcSummary
+from my_atomate.firetasks.dos import get_dos_todb_task
+from my_atomate.firetasks.handlers import get_handler_group
 
 class JOptimizeFW(Firework):
     def __init__(
@@ -53,6 +63,7 @@ class JOptimizeFW(Firework):
             half_kpts_first_relax=HALF_KPOINTS_FIRST_RELAX,
             parents=None,
             vasptodb_kwargs=None,
+            handler_group="default",
             **kwargs
     ):
         """
@@ -74,6 +85,8 @@ class JOptimizeFW(Firework):
             auto_npar (bool or str): whether to set auto_npar. defaults to env_chk: ">>auto_npar<<"
             half_kpts_first_relax (bool): whether to use half the kpoints for the first relaxation
             parents ([Firework]): Parents of this particular Firework.
+            handler_group (str): custodian handlers, see
+                my_atomate.firetasks.handlers.get_handler_group
             \*\*kwargs: Other kwargs that are passed to Firework.__init__.
         """
         override_default_vasp_params = override_default_vasp_params or {}
@@ -101,8 +114,10 @@ class JOptimizeFW(Firework):
                 ediffg=ediffg,
                 auto_npar=auto_npar,
                 half_kpts_first_relax=half_kpts_first_relax,
+                handler_group=get_handler_group(handler_group),
             )
         )
+        t.append(WriteCalcSummary())
         t.append(PassCalcLocs(name=name))
         t.append(VaspToDb(db_file=db_file, **vasptodb_kwargs))
         super(JOptimizeFW, self).__init__(
@@ -134,6 +149,7 @@ class JSelectiveOptFW(Firework):
             vasptodb_kwargs=None,
             selective_dynamics=None,
             prev_calc_loc=True,
+            handler_group="default",
             **kwargs
     ):
 
@@ -150,7 +166,7 @@ class JSelectiveOptFW(Firework):
         if parents:
             if prev_calc_loc:
                 t.append(
-                    CopyVaspOutputs(calc_loc=prev_calc_loc, contcar_to_poscar=True)
+                    JCopyVaspOutputs(calc_loc=prev_calc_loc, contcar_to_poscar=True)
                 )
             mprelax_incar = MPRelaxSet(structure, force_gamma=force_gamma, **override_default_vasp_params).incar.as_dict()
             mprelax_incar.pop("@module")
@@ -170,8 +186,10 @@ class JSelectiveOptFW(Firework):
                 ediffg=ediffg,
                 auto_npar=auto_npar,
                 half_kpts_first_relax=half_kpts_first_relax,
+                handler_group=get_handler_group(handler_group),
             )
         )
+        t.append(WriteCalcSummary())
         t.append(PassCalcLocs(name=name))
         t.append(VaspToDb(db_file=db_file, additional_fields={"task_label": name}, **vasptodb_kwargs))
         super(JSelectiveOptFW, self).__init__(
@@ -195,6 +213,9 @@ class JMVLGWFW(Firework):
             reciprocal_density=100,
             nbands_factor=5,
             ncores=None,
+            plan_parallel=False,
+            mem_per_rank_gb=None,
+            handler_group="no_handler",
 
             vasp_input_set=None,
             vasp_input_set_params=None,
@@ -225,6 +246,13 @@ class JMVLGWFW(Firework):
             db_file (str): Path to file specifying db credentials.
             parents (Firework): Parents of this particular Firework. FW or list of FWS.
             vasptodb_kwargs (dict): kwargs to pass to VaspToDb
+            ncores (int or str): MPI ranks of the job, supports env_chk (e.g. ">>ncores<<")
+            plan_parallel (bool): let JWriteMVLGWFromPrev choose NBANDS/NCORE/KPAR/NOMEGA
+                from the parent calculation and the worker (see gw_planner). auto_npar of
+                RunVaspCustodian is then off, since its NPAR would override NCORE.
+            mem_per_rank_gb (float or str): memory per rank for the planner, supports env_chk
+            handler_group (str): custodian handlers, see my_atomate.firetasks.handlers.get_handler_group.
+                "scf_monitor_only" aborts stalled SCF cycles without the default handlers.
             \*\*kwargs: Other kwargs that are passed to Firework.__init__.
         """
         t = []
@@ -239,6 +267,10 @@ class JMVLGWFW(Firework):
             structure.composition.reduced_formula if structure else "unknown", name
         )
 
+        plan_kwargs = {"plan_parallel": plan_parallel}
+        if mem_per_rank_gb:
+            plan_kwargs["mem_per_rank_gb"] = mem_per_rank_gb
+
         additional_file = []
 
         if mode == "DIAG":
@@ -253,18 +285,18 @@ class JMVLGWFW(Firework):
 
 
         if prev_calc_dir:
-            t.append(CopyVaspOutputs(calc_dir=prev_calc_dir, contcar_to_poscar=True, additional_files=additional_file))
+            t.append(JCopyVaspOutputs(calc_dir=prev_calc_dir, contcar_to_poscar=True, additional_files=additional_file))
             t.append(JWriteMVLGWFromPrev(nbands=nbands, reciprocal_density=reciprocal_density,
                                          nbands_factor=nbands_factor, ncores=ncores, prev_incar=prev_incar,
-                                         mode=mode, other_params=vasp_input_set_params))
+                                         mode=mode, other_params=vasp_input_set_params, **plan_kwargs))
         elif parents:
             if prev_calc_loc:
                 t.append(
-                    CopyVaspOutputs(calc_loc=prev_calc_loc, contcar_to_poscar=True, additional_files=additional_file)
+                    JCopyVaspOutputs(calc_loc=prev_calc_loc, contcar_to_poscar=True, additional_files=additional_file)
                 )
             t.append(JWriteMVLGWFromPrev(nbands=nbands, reciprocal_density=reciprocal_density,
                                          nbands_factor=nbands_factor, ncores=ncores, prev_incar=prev_incar,
-                                         mode=mode, other_params=vasp_input_set_params))
+                                         mode=mode, other_params=vasp_input_set_params, **plan_kwargs))
         elif structure:
             vasp_input_set = vasp_input_set or MVLGWSet(
                 structure, **vasp_input_set_params
@@ -275,7 +307,9 @@ class JMVLGWFW(Firework):
         else:
             raise ValueError("Must specify structure or previous calculation")
 
-        t.append(RunVaspCustodian(vasp_cmd=vasp_cmd, auto_npar=">>auto_npar<<", handler_group="no_handler"))
+        t.append(RunVaspCustodian(vasp_cmd=vasp_cmd, auto_npar=False if plan_parallel else ">>auto_npar<<",
+                                  handler_group=get_handler_group(handler_group)))
+        t.append(WriteCalcSummary())
         t.append(PassCalcLocs(name=name))
         # t.append(VaspToDb(db_file=db_file, defuse_unsuccessful=True, **vasptodb_kwargs))
         super(JMVLGWFW, self).__init__(t, parents=parents, name=fw_name, **kwargs)
@@ -298,6 +332,7 @@ class JScanOptimizeFW(Firework):
             half_kpts_first_relax=HALF_KPOINTS_FIRST_RELAX,
             parents=None,
             vasptodb_kwargs=None,
+            handler_group="default",
             **kwargs
     ):
         """
@@ -319,6 +354,8 @@ class JScanOptimizeFW(Firework):
             auto_npar (bool or str): whether to set auto_npar. defaults to env_chk: ">>auto_npar<<"
             half_kpts_first_relax (bool): whether to use half the kpoints for the first relaxation
             parents ([Firework]): Parents of this particular Firework.
+            handler_group (str): custodian handlers, see
+                my_atomate.firetasks.handlers.get_handler_group
             \*\*kwargs: Other kwargs that are passed to Firework.__init__.
         """
         override_default_vasp_params = override_default_vasp_params or {}
@@ -353,9 +390,11 @@ class JScanOptimizeFW(Firework):
                 ediffg=ediffg,
                 auto_npar=auto_npar,
                 half_kpts_first_relax=half_kpts_first_relax,
+                handler_group=get_handler_group(handler_group),
             )
         )
 
+        t.append(WriteCalcSummary())
         t.append(PassCalcLocs(name=name))
         t.append(VaspToDb(db_file=db_file, **vasptodb_kwargs))
         super(JScanOptimizeFW, self).__init__(
@@ -380,6 +419,7 @@ class JScanStaticFW(Firework):
             db_file=DB_FILE,
             vasptodb_kwargs=None,
             parents=None,
+            handler_group="default",
             **kwargs
     ):
         """
@@ -401,6 +441,8 @@ class JScanStaticFW(Firework):
             db_file (str): Path to file specifying db credentials.
             parents (Firework): Parents of this particular Firework. FW or list of FWS.
             vasptodb_kwargs (dict): kwargs to pass to VaspToDb
+            handler_group (str): custodian handlers, see
+                my_atomate.firetasks.handlers.get_handler_group
             \*\*kwargs: Other kwargs that are passed to Firework.__init__.
         """
         t = []
@@ -416,11 +458,11 @@ class JScanStaticFW(Firework):
         )
 
         if prev_calc_dir:
-            t.append(CopyVaspOutputs(calc_dir=prev_calc_dir, contcar_to_poscar=True))
+            t.append(JCopyVaspOutputs(calc_dir=prev_calc_dir, contcar_to_poscar=True))
             t.append(JWriteScanVaspStaticFromPrev(other_params=vasp_input_set_params))
         elif parents:
             if prev_calc_loc:
-                t.append(CopyVaspOutputs(calc_loc=prev_calc_loc, contcar_to_poscar=True))
+                t.append(JCopyVaspOutputs(calc_loc=prev_calc_loc, contcar_to_poscar=True))
             t.append(JWriteScanVaspStaticFromPrev(other_params=vasp_input_set_params))
         elif structure:
             vasp_input_set = vasp_input_set or "MPScanStaticSet"
@@ -446,7 +488,9 @@ class JScanStaticFW(Firework):
         else:
             t.append(WriteVaspFromPMGObjects(
                 kpoints=MPRelaxSet(structure=structure, force_gamma=force_gamma).kpoints.as_dict()))
-        t.append(RunVaspCustodian(vasp_cmd=vasp_cmd, auto_npar=">>auto_npar<<"))
+        t.append(RunVaspCustodian(vasp_cmd=vasp_cmd, auto_npar=">>auto_npar<<",
+                                  handler_group=get_handler_group(handler_group)))
+        t.append(WriteCalcSummary())
         t.append(PassCalcLocs(name=name))
         t.append(VaspToDb(db_file=db_file, **vasptodb_kwargs))
         super(JScanStaticFW, self).__init__(t, parents=parents, name=fw_name, **kwargs)
@@ -455,7 +499,8 @@ class JScanStaticFW(Firework):
 class JHSEStaticFW(Firework):
     def __init__(self, structure=None, name="HSE_scf", vasp_input_set=None, vasp_input_set_params=None,
                  vasp_cmd=VASP_CMD, prev_calc_loc=True, prev_calc_dir=None, db_file=DB_FILE, vasptodb_kwargs=None,
-                 parents=None, force_gamma=True, default_magmom=True, **kwargs):
+                 parents=None, force_gamma=True, default_magmom=True, dos_parser="vasprun", handler_group="default",
+                 **kwargs):
         t = []
 
         vasp_input_set_params = vasp_input_set_params or {}
@@ -468,17 +513,17 @@ class JHSEStaticFW(Firework):
 
 
         if prev_calc_dir and parents:
-            t.append(CopyVaspOutputs(calc_loc=prev_calc_loc, contcar_to_poscar=True))
-            t.append(CopyFiles(from_dir=prev_calc_dir, files_to_copy=["CHGCAR.gz", "CHGCAR", "WAVECAR.gz", "WAVECAR"],
-                               continue_on_missing=True))
+            t.append(JCopyVaspOutputs(calc_loc=prev_calc_loc, contcar_to_poscar=True))
+            t.append(JCopyVaspOutputs(calc_dir=prev_calc_dir, files_to_copy=["CHGCAR", "WAVECAR"],
+                                      continue_on_missing=True))
             t.append(WriteVaspHSEBSFromPrev(mode="uniform", reciprocal_density=None, kpoints_line_density=None))
             t.append(ModifyIncar(incar_update={"ICHARG": 11}))
         elif prev_calc_dir:
-            t.append(CopyVaspOutputs(calc_dir=prev_calc_dir, contcar_to_poscar=True, additional_files=["WAVECAR", "CHGCAR"]))
+            t.append(JCopyVaspOutputs(calc_dir=prev_calc_dir, contcar_to_poscar=True, additional_files=["WAVECAR", "CHGCAR"]))
             t.append(WriteVaspHSEBSFromPrev(mode="uniform", reciprocal_density=None, kpoints_line_density=None))
         elif parents:
             if prev_calc_loc:
-                t.append(CopyVaspOutputs(calc_loc=prev_calc_loc, contcar_to_poscar=True))
+                t.append(JCopyVaspOutputs(calc_loc=prev_calc_loc, contcar_to_poscar=True))
             t.append(WriteVaspHSEBSFromPrev(mode="uniform", reciprocal_density=None, kpoints_line_density=None))
         elif structure:
             vasp_input_set = vasp_input_set or "MPHSERelaxSet"
@@ -517,9 +562,11 @@ class JHSEStaticFW(Firework):
             t.append(WriteVaspFromPMGObjects(
                 kpoints=MPHSERelaxSet(structure=structure, force_gamma=force_gamma).kpoints.as_dict()))
 
-        t.append(RunVaspCustodian(vasp_cmd=vasp_cmd, auto_npar=">>auto_npar<<"))
+        t.append(RunVaspCustodian(vasp_cmd=vasp_cmd, auto_npar=">>auto_npar<<",
+                                  handler_group=get_handler_group(handler_group)))
+        t.append(WriteCalcSummary())
         t.append(PassCalcLocs(name=name))
-        t.append(VaspToDb(db_file=db_file, **vasptodb_kwargs))
+        t.append(get_dos_todb_task(dos_parser)(db_file=db_file, **vasptodb_kwargs))
         super(JHSEStaticFW, self).__init__(t, parents=parents, name=fw_name, **kwargs)
 
 class JHSESOCFW(Firework):
@@ -538,6 +585,8 @@ class JHSESOCFW(Firework):
             db_file=DB_FILE,
             parents=None,
             vasptodb_kwargs=None,
+            dos_parser="vasprun",
+            handler_group="default",
             **kwargs
     ):
         """
@@ -553,6 +602,10 @@ class JHSESOCFW(Firework):
             db_file (str): Path to file specifying db credentials.
             parents (Firework): Parents of this particular Firework.
                 FW or list of FWS.
+            dos_parser (str): "vasprun" to parse the DOS with pymatgen's Vasprun or
+                "stream" for VaspToDbStreamDos
+            handler_group (str): custodian handlers, see
+                my_atomate.firetasks.handlers.get_handler_group
             \*\*kwargs: Other kwargs that are passed to Firework.__init__.
         """
         fw_name = "{}-{}".format(
@@ -579,7 +632,7 @@ class JHSESOCFW(Firework):
         t = []
         if prev_calc_dir:
             t.append(
-                CopyVaspOutputs(
+                JCopyVaspOutputs(
                     calc_dir=prev_calc_dir,
                     additional_files=copy_add_files_from_prev,
                     contcar_to_poscar=True
@@ -590,7 +643,7 @@ class JHSESOCFW(Firework):
             )
         elif parents and copy_vasp_outputs:
             t.append(
-                CopyVaspOutputs(
+                JCopyVaspOutputs(
                     calc_loc=True,
                     additional_files=copy_add_files_from_prev,
                     contcar_to_poscar=True
@@ -622,9 +675,11 @@ class JHSESOCFW(Firework):
 
         t.extend(
             [
-                RunVaspCustodian(vasp_cmd=vasp_cmd, auto_npar=">>auto_npar<<"),
+                RunVaspCustodian(vasp_cmd=vasp_cmd, auto_npar=">>auto_npar<<",
+                                 handler_group=get_handler_group(handler_group)),
+                WriteCalcSummary(),
                 PassCalcLocs(name=name),
-                VaspToDb(db_file=db_file, **vasptodb_kwargs),
+                get_dos_todb_task(dos_parser)(db_file=db_file, **vasptodb_kwargs),
             ]
         )
         super(JHSESOCFW, self).__init__(t, parents=parents, name=fw_name, **kwargs)
@@ -649,6 +704,7 @@ class JHSERelaxFW(Firework):
             auto_npar=">>auto_npar<<",
             default_magmom=True,
             half_kpts_first_relax=HALF_KPOINTS_FIRST_RELAX,
+            handler_group="default",
             **kwargs
     ):
 
@@ -664,12 +720,12 @@ class JHSERelaxFW(Firework):
         hse_relax_vis_incar = MPHSERelaxSet(structure=structure).incar
 
         if prev_calc_dir:
-            t.append(CopyVaspOutputs(calc_dir=prev_calc_dir, contcar_to_poscar=True))
+            t.append(JCopyVaspOutputs(calc_dir=prev_calc_dir, contcar_to_poscar=True))
             t.append(WriteVaspHSEBSFromPrev(mode="uniform", reciprocal_density=None, kpoints_line_density=None))
             t.append(ModifyIncar(incar_update=hse_relax_vis_incar))
         elif parents:
             if prev_calc_loc:
-                t.append(CopyVaspOutputs(calc_loc=prev_calc_loc, contcar_to_poscar=True))
+                t.append(JCopyVaspOutputs(calc_loc=prev_calc_loc, contcar_to_poscar=True))
             t.append(WriteVaspHSEBSFromPrev(mode="uniform", reciprocal_density=None, kpoints_line_density=None))
             t.append(ModifyIncar(incar_update=hse_relax_vis_incar))
         elif structure:
@@ -701,9 +757,11 @@ class JHSERelaxFW(Firework):
                 ediffg=ediffg,
                 auto_npar=auto_npar,
                 half_kpts_first_relax=half_kpts_first_relax,
+                handler_group=get_handler_group(handler_group),
             )
         )
 
+        t.append(WriteCalcSummary())
         t.append(PassCalcLocs(name=name))
         t.append(VaspToDb(db_file=db_file, **vasptodb_kwargs))
         super(JHSERelaxFW, self).__init__(t, parents=parents, name=fw_name, **kwargs)
@@ -716,7 +774,8 @@ class JHSEcDFTFW(Firework):
                  name="HSE_cDFT", default_magmom=True,
                  vasp_input_set_params=None, job_type="normal", max_force_threshold=None,
                  vasp_cmd=VASP_CMD, db_file=DB_FILE, vasptodb_kwargs=None,
-                 parents=None, prev_calc_loc=True, selective_dynamics=None, force_gamma=True, **kwargs):
+                 parents=None, prev_calc_loc=True, selective_dynamics=None, force_gamma=True,
+                 handler_group="default", **kwargs):
 
         t = []
         vasp_input_set_params = vasp_input_set_params or {}
@@ -728,14 +787,14 @@ class JHSEcDFTFW(Firework):
         fw_name = "{}-{}".format(structure.composition.reduced_formula if structure else "unknown", name)
 
         if prev_calc_dir:
-            t.append(CopyVaspOutputs(calc_dir=prev_calc_dir, additional_files=["WAVECAR"], contcar_to_poscar=True, filesystem=filesystem))
+            t.append(JCopyVaspOutputs(calc_dir=prev_calc_dir, additional_files=["WAVECAR"], contcar_to_poscar=True, filesystem=filesystem))
             t.append(WriteVaspHSEBSFromPrev(mode="uniform", reciprocal_density=None, kpoints_line_density=None))
             if specific_structure:
                 t.append(WriteVaspFromPMGObjects(poscar=specific_structure))
             t.append(RmSelectiveDynPoscar())
         elif parents:
             if prev_calc_loc:
-                t.append(CopyVaspOutputs(calc_loc=prev_calc_loc, contcar_to_poscar=True))
+                t.append(JCopyVaspOutputs(calc_loc=prev_calc_loc, contcar_to_poscar=True))
 
             t.append(WriteVaspHSEBSFromPrev(mode="uniform", reciprocal_density=None, kpoints_line_density=None))
             t.append(RmSelectiveDynPoscar())
@@ -772,7 +831,9 @@ class JHSEcDFTFW(Firework):
         t.append(ModifyIncar(incar_update=vis_cdft))
 
         t.append(RunVaspCustodian(vasp_cmd=vasp_cmd, auto_npar=">>auto_npar<<",
-                                  job_type=job_type, max_force_threshold=max_force_threshold))
+                                  job_type=job_type, max_force_threshold=max_force_threshold,
+                                  handler_group=get_handler_group(handler_group)))
+        t.append(WriteCalcSummary())
         t.append(PassCalcLocs(name=name))
         t.append(VaspToDb(db_file=db_file, **vasptodb_kwargs))
         super(JHSEcDFTFW, self).__init__(t, parents=parents, name=fw_name, **kwargs)
@@ -781,7 +842,7 @@ class JHSEcDFTFW(Firework):
 class JPBEcDFTRelaxFW(Firework):
     def __init__(self, prev_calc_dir, vis="MPRelaxSet", structure=None, read_structure_from=None, name="cDFT_PBE_relax",
                  vasp_input_set_params=None, vasp_cmd=VASP_CMD, db_file=DB_FILE, vasptodb_kwargs=None,
-                 parents=None, wall_time=None, **kwargs):
+                 parents=None, wall_time=None, handler_group="default", **kwargs):
         t = []
 
         vasp_input_set_params = vasp_input_set_params or {}
@@ -792,16 +853,18 @@ class JPBEcDFTRelaxFW(Firework):
 
         fw_name = "{}-{}".format(structure.composition.reduced_formula if structure else "unknown", name)
         if read_structure_from:
-            t.append(CopyVaspOutputs(additional_files=["WAVECAR"], calc_dir=read_structure_from, contcar_to_poscar=True))
+            t.append(JCopyVaspOutputs(additional_files=["WAVECAR"], calc_dir=read_structure_from, contcar_to_poscar=True))
         else:
-            t.append(CopyVaspOutputs(additional_files=["WAVECAR"], calc_dir=prev_calc_dir))
+            t.append(JCopyVaspOutputs(additional_files=["WAVECAR"], calc_dir=prev_calc_dir))
             t.append(WriteVaspFromIOSet(structure=structure, vasp_input_set=vis))
         magmom = MPRelaxSet(structure).incar.get("MAGMOM", None)
         if magmom:
             t.append(ModifyIncar(incar_update={"MAGMOM": magmom}))
         t.append(ModifyIncar(incar_update=vasp_input_set_params.get("user_incar_settings", {})))
         t.append(WriteVaspFromPMGObjects(kpoints=vasp_input_set_params.get("user_kpoints_settings", {})))
-        t.append(RunVaspCustodian(vasp_cmd=vasp_cmd, auto_npar=">>auto_npar<<", max_errors=5, wall_time=wall_time))
+        t.append(RunVaspCustodian(vasp_cmd=vasp_cmd, auto_npar=">>auto_npar<<", max_errors=5, wall_time=wall_time,
+                                  handler_group=get_handler_group(handler_group)))
+        t.append(WriteCalcSummary())
         t.append(PassCalcLocs(name=name))
         t.append(VaspToDb(db_file=db_file, **vasptodb_kwargs))
         super(JPBEcDFTRelaxFW, self).__init__(t, parents=parents, name=fw_name, **kwargs)
@@ -810,7 +873,7 @@ class JPBEcDFTRelaxFW(Firework):
 class JPBEcDFTStaticFW(Firework):
     def __init__(self, structure, name="cDFT_PBE_scf",
                  vasp_input_set_params=None, vasp_cmd=VASP_CMD, db_file=DB_FILE, vasptodb_kwargs=None,
-                 parents=None, wall_time=None, **kwargs):
+                 parents=None, wall_time=None, dos_parser="vasprun", handler_group="default", **kwargs):
         t = []
 
         vasp_input_set_params = vasp_input_set_params or {}
@@ -821,19 +884,21 @@ class JPBEcDFTStaticFW(Firework):
 
         fw_name = "{}-{}".format(structure.composition.reduced_formula if structure else "unknown", name)
         if parents:
-            t.append(CopyVaspOutputs(calc_loc=True, contcar_to_poscar=True))
+            t.append(JCopyVaspOutputs(calc_loc=True, contcar_to_poscar=True))
         else:
-            t.append(CopyVaspOutputs(additional_files=["CHGCAR"], calc_loc=True))
+            t.append(JCopyVaspOutputs(additional_files=["CHGCAR"], calc_loc=True))
         magmom = MPRelaxSet(structure).incar.get("MAGMOM", None)
         if magmom:
             t.append(ModifyIncar(incar_update={"MAGMOM": magmom}))
         t.append(WriteVaspStaticFromPrev())
         t.append(ModifyIncar(incar_update=vasp_input_set_params.get("user_incar_settings", {})))
         t.append(WriteVaspFromPMGObjects(kpoints=vasp_input_set_params.get("user_kpoints_settings", {})))
-        t.append(RunVaspCustodian(vasp_cmd=vasp_cmd, auto_npar=">>auto_npar<<", max_errors=5, wall_time=wall_time))
+        t.append(RunVaspCustodian(vasp_cmd=vasp_cmd, auto_npar=">>auto_npar<<", max_errors=5, wall_time=wall_time,
+                                  handler_group=get_handler_group(handler_group)))
+        t.append(WriteCalcSummary())
         t.append(PassCalcLocs(name=name))
-        t.append(VaspToDb(db_file=db_file, bandstructure_mode="uniform",
-                          parse_dos=True, parse_eigenvalues=True, **vasptodb_kwargs))
+        t.append(get_dos_todb_task(dos_parser)(db_file=db_file, bandstructure_mode="uniform",
+                                               parse_dos=True, parse_eigenvalues=True, **vasptodb_kwargs))
         super(JPBEcDFTStaticFW, self).__init__(t, parents=parents, name=fw_name, **kwargs)
 
 class HSEBSFW(Firework):
@@ -876,15 +941,16 @@ class HSEBSFW(Firework):
         t = []
         if prev_calc_dir:
             t.append(
-                CopyVaspOutputs(calc_dir=prev_calc_dir, additional_files=[cp_file_from_prev])
+                JCopyVaspOutputs(calc_dir=prev_calc_dir, additional_files=[cp_file_from_prev])
             )
         elif parents:
-            t.append(CopyVaspOutputs(calc_loc=True, additional_files=[cp_file_from_prev]))
+            t.append(JCopyVaspOutputs(calc_loc=True, additional_files=[cp_file_from_prev]))
         else:
             raise ValueError("Must specify a previous calculation for HSEBSFW")
 
         t.append(WriteVaspHSEBSFromPrev(prev_calc_dir=".", mode=mode, **input_set_overrides))
         t.append(RunVaspCustodian(vasp_cmd=vasp_cmd))
+        t.append(WriteCalcSummary())
         t.append(PassCalcLocs(name=name))
 
         parse_dos = True if mode == "uniform" else False
@@ -900,3 +966,80 @@ class HSEBSFW(Firework):
         )
         super(HSEBSFW, self).__init__(t, parents=parents, name=fw_name, **kwargs)
 
+
+
+class HSEBSChunkFW(Firework):
+    def __init__(
+            self,
+            ichunk,
+            nchunks,
+            parents=None,
+            prev_calc_dir=None,
+            cp_file_from_prev="CHGCAR",
+            structure=None,
+            name="hse line",
+            input_set_overrides=None,
+            vasp_cmd=VASP_CMD,
+            **kwargs
+    ):
+        """
+        One chunk of a line-mode HSE band structure: the weighted mesh of
+        HSEBSFW plus the ichunk-th slice of the path. The chunks share the
+        CHGCAR (or WAVECAR) of the parent; HSEBSMergeFW parses them.
+
+        Args:
+            ichunk (int): chunk of this FW, from 0
+            nchunks (int): number of chunks
+            parents (Firework): Parents of this particular Firework. FW or list of FWS.
+            prev_calc_dir (str): Path to a previous calculation to copy from
+            cp_file_from_prev (str or [str]): files copied from the previous calculation
+            structure (Structure): Input structure - used only to set the name of the FW.
+            name (str): Name of the band structure; the chunk is named "{name}_chunk{ichunk}".
+            input_set_overrides (dict): params of WriteVaspHSEBSFromPrev
+            vasp_cmd (str): Command to run vasp.
+            \*\*kwargs: Other kwargs that are passed to Firework.__init__.
+        """
+        name = "{}_chunk{}".format(name, ichunk)
+        fw_name = "{}-{}".format(
+            structure.composition.reduced_formula if structure else "unknown", name
+        )
+        cp_files = [cp_file_from_prev] if isinstance(cp_file_from_prev, str) else list(cp_file_from_prev)
+
+        t = []
+        if prev_calc_dir:
+            t.append(JCopyVaspOutputs(calc_dir=prev_calc_dir, additional_files=cp_files))
+        elif parents:
+            t.append(JCopyVaspOutputs(calc_loc=True, additional_files=cp_files))
+        else:
+            raise ValueError("Must specify a previous calculation for HSEBSChunkFW")
+
+        t.append(WriteVaspHSEBSFromPrev(prev_calc_dir=".", mode="line", **(input_set_overrides or {})))
+        t.append(SplitHSEBSKpoints(ichunk=ichunk, nchunks=nchunks))
+        t.append(RunVaspCustodian(vasp_cmd=vasp_cmd))
+        t.append(WriteCalcSummary())
+        t.append(PassCalcLocs(name=name))
+        super(HSEBSChunkFW, self).__init__(t, parents=parents, name=fw_name, **kwargs)
+
+
+class HSEBSMergeFW(Firework):
+    def __init__(self, parents, structure=None, name="hse line", db_file=DB_FILE, additional_fields=None, **kwargs):
+        """
+        Merge the HSEBSChunkFWs of parents into one line-mode band structure task doc.
+
+        Args:
+            parents ([HSEBSChunkFW]): the chunks, in path order
+            structure (Structure): Input structure - used only to set the name of the FW.
+            name (str): Name of the band structure, as given to the chunks.
+            db_file (str): Path to file specifying db credentials.
+            additional_fields (dict): fields added to the task doc
+            \*\*kwargs: Other kwargs that are passed to Firework.__init__.
+        """
+        fw_name = "{}-{}".format(
+            structure.composition.reduced_formula if structure else "unknown", name
+        )
+        additional_fields = dict(additional_fields or {}, task_label=name)
+        t = [
+            MergeHSEBSChunks(chunk_names=["{}_chunk{}".format(name, i) for i in range(len(parents))],
+                             db_file=db_file, additional_fields=additional_fields),
+        ]
+        super(HSEBSMergeFW, self).__init__(t, parents=parents, name=fw_name, **kwargs)
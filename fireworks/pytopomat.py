@@ -9,12 +9,13 @@ from pymatgen import Structure
 
 from atomate.vasp.config import DB_FILE
 from atomate.common.firetasks.glue_tasks import PassCalcLocs
-from atomate.vasp.firetasks.glue_tasks import CopyVaspOutputs
+from my_atomate.firetasks.staging import JCopyVaspOutputs
 
 from my_atomate.firetasks.pytopomat import (
     RunIRVSP,
     RunIRVSPAll,
     RunIRVSPsingleKpt,
+    StandardizeCell,
     IRVSPToDb
 )
 
@@ -62,7 +63,7 @@ class IrvspFW(Firework):
 
         if prev_calc_dir:
             t.append(
-                CopyVaspOutputs(
+                JCopyVaspOutputs(
                     calc_dir=prev_calc_dir,
                     additional_files=["CHGCAR", "WAVECAR"],
                     contcar_to_poscar=True,
@@ -70,7 +71,7 @@ class IrvspFW(Firework):
             )
         elif parents:
             t.append(
-                CopyVaspOutputs(
+                JCopyVaspOutputs(
                     calc_loc=True,
                     additional_files=["CHGCAR", "WAVECAR"],
                     contcar_to_poscar=True,
@@ -126,14 +127,14 @@ class StandardizeFW(Firework):
 
         if prev_calc_dir:
             t.append(
-                CopyVaspOutputs(
+                JCopyVaspOutputs(
                     calc_dir=prev_calc_dir,
                     contcar_to_poscar=True,
                 )
             )
         elif parents:
             t.append(
-                CopyVaspOutputs(
+                JCopyVaspOutputs(
                     calc_loc=True,
                     contcar_to_poscar=True,
                 )
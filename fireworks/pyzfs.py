@@ -1,10 +1,10 @@
 from fireworks import Firework
 
 from atomate.common.firetasks.glue_tasks import PassCalcLocs
-from atomate.vasp.firetasks.glue_tasks import CopyVaspOutputs
+from my_atomate.firetasks.staging import JCopyVaspOutputs
 from atomate.vasp.config import DB_FILE
 
-from firetasks.pyzfs import RunPyzfs, PyzfsToDb
+from my_atomate.firetasks.pyzfs import RunPyzfs, PyzfsToDb
 
 class PyzfsFW(Firework):
     def __init__(
@@ -31,7 +31,7 @@ class PyzfsFW(Firework):
 
         if prev_calc_dir:
             t.append(
-                CopyVaspOutputs(
+                JCopyVaspOutputs(
                     calc_dir=prev_calc_dir,
                     additional_files=["WAVECAR"],
                     contcar_to_poscar=True,
@@ -39,7 +39,7 @@ class PyzfsFW(Firework):
             )
         elif parents:
             t.append(
-                CopyVaspOutputs(
+                JCopyVaspOutputs(
                     calc_loc=True,
                     additional_files=["WAVECAR"],
                     contcar_to_poscar=True,
@@ -1,6 +1,17 @@
 from my_atomate.firetasks.firetasks import WriteTwoDBSKpoints
-
-from atomate.utils.utils import get_fws_and_tasks
+from my_atomate.firetasks.calc_summary import WriteCalcSummary
+from my_atomate.firetasks.dos import VaspToDbStreamDos
+from my_atomate.firetasks.handlers import get_handler_group
+from my_atomate.firetasks.lifecycle import TrackArtifacts, ReleaseArtifacts
+from my_atomate.firetasks.profiling import ProfiledTask, get_task_name
+from my_atomate.firetasks.tuning import ApplyTunedParallelLayout
+from my_atomate.firetasks.structure_refs import get_structures_collection, store_structure, WriteVaspFromIOSetRef
+from my_atomate.tools.estimator import get_fw_vasp_params, estimate_run, load_calibration
+from my_atomate.tools.scheduler import get_sjf_updates, get_sjf_priority
+from my_atomate.firetasks.staging import get_compressed_extension, RunVaspCustodianScratch, STAGE_OUT_FILES, \
+    CompressOutputs
+
+from atomate.utils.utils import get_logger
 from atomate.vasp.config import (
     GAMMA_VASP_CMD,
     VDW_KERNEL_DIR
@@ -13,10 +24,358 @@ from atomate.vasp.firetasks.write_inputs import ModifyIncar, ModifyKpoints, Writ
 from pymatgen import Structure
 from pymatgen.io.vasp.sets import MPRelaxSet
 
+from concurrent.futures import ProcessPoolExecutor
+from copy import deepcopy
+from uuid import uuid4
+import math
+import time
+
 __author__ = "Jeng-Yuan Tsai"
 __email__ = "tsaie79@gmail.com"
 
 
+logger = get_logger(__name__)
+
+
+class FWTaskIndex(object):
+    """
+    (fw index, task index) positions of every task of a workflow, keyed by the
+    task class name (of the wrapped task for a ProfiledTask). Built once, so that matching a constraint costs a lookup
+    over the distinct task classes instead of a scan over every task.
+    """
+
+    def __init__(self, wf):
+        self.wf = wf
+        self.by_task = {}
+        for idx_fw, fw in enumerate(wf.fws):
+            for idx_t, t in enumerate(fw.tasks):
+                self.by_task.setdefault(get_task_name(t), []).append((idx_fw, idx_t))
+
+    def find(self, task_name_constraint=None, fw_name_constraint=None):
+        """
+        Same matches as get_fws_and_tasks, except that task_name_constraint is
+        matched against the task class name only.
+        """
+        matches = []
+        for name, positions in self.by_task.items():
+            if task_name_constraint is None or task_name_constraint in name:
+                matches.extend(positions)
+        if fw_name_constraint is not None:
+            matches = [(i, j) for i, j in matches if fw_name_constraint in self.wf.fws[i].name]
+        return sorted(matches)
+
+    def rename(self, position, old_name, new_name):
+        """
+        Move position from old_name to new_name after its task was replaced.
+        """
+        self.by_task[old_name].remove(position)
+        self.by_task.setdefault(new_name, []).append(position)
+
+
+def _get_fw_plan(plan, idx_fw):
+    """
+    The changes a PowerupPipeline plans for fw idx_fw:
+    {"before": {idx_t: [tasks]}, "after": {idx_t: [tasks]}, "remove": set()}.
+    """
+    return plan.setdefault(idx_fw, {"before": {}, "after": {}, "remove": set()})
+
+
+class PowerupPipeline(object):
+    """
+    Compose powerups and apply them to a workflow in a single pass: the
+    (fw, task) index is built once, every step looks up its matches in it and
+    each task list is rebuilt once at the end instead of item by item.
+
+    Positions always refer to the task lists as they were before the pipeline
+    ran, e.g. two steps inserting before RunVaspCustodian end up before it in
+    step order.
+
+        wf = PowerupPipeline().cp_vdw_file().jmodify_to_soc(structure).remove_todb().apply(wf)
+    """
+
+    def __init__(self):
+        self.steps = []
+
+    def add_step(self, step):
+        """
+        Add a step(wf, index, plan) callable. plan maps a fw index to the
+        changes of that fw, see _get_fw_plan.
+        """
+        self.steps.append(step)
+        return self
+
+    def insert(self, task, task_name_constraint, position="before", fw_name_constraint=None):
+        """
+        Insert a task before or after every matching task. position "previous"
+        inserts before the task preceding the match. task may be a Firetask
+        (copied for every match) or a function(fw, matched_task) returning one.
+        """
+        def step(wf, index, plan):
+            for idx_fw, idx_t in index.find(task_name_constraint, fw_name_constraint):
+                fw = wf.fws[idx_fw]
+                new_task = task(fw, fw.tasks[idx_t]) if callable(task) else deepcopy(task)
+                fw_plan = _get_fw_plan(plan, idx_fw)
+                if position == "after":
+                    fw_plan["after"].setdefault(idx_t, []).insert(0, new_task)
+                else:
+                    anchor = max(idx_t - 1, 0) if position == "previous" else idx_t
+                    fw_plan["before"].setdefault(anchor, []).append(new_task)
+        return self.add_step(step)
+
+    def update(self, func, task_name_constraint=None, fw_name_constraint=None):
+        """
+        Call func(fw, task) on every matching task; func modifies them in place.
+        """
+        def step(wf, index, plan):
+            for idx_fw, idx_t in index.find(task_name_constraint, fw_name_constraint):
+                func(wf.fws[idx_fw], wf.fws[idx_fw].tasks[idx_t])
+        return self.add_step(step)
+
+    def replace(self, func, task_name_constraint, fw_name_constraint=None):
+        """
+        Replace every matching task by func(fw, task), unless it returns None.
+        The new task takes the position of the old one right away, so that the
+        following steps see and modify it.
+        """
+        def step(wf, index, plan):
+            for idx_fw, idx_t in index.find(task_name_constraint, fw_name_constraint):
+                fw = wf.fws[idx_fw]
+                new_task = func(fw, fw.tasks[idx_t])
+                if new_task is not None:
+                    index.rename((idx_fw, idx_t), get_task_name(fw.tasks[idx_t]), get_task_name(new_task))
+                    fw.tasks[idx_t] = new_task
+        return self.add_step(step)
+
+    def remove(self, task_name_constraint, fw_name_constraint=None):
+        def step(wf, index, plan):
+            for idx_fw, idx_t in index.find(task_name_constraint, fw_name_constraint):
+                _get_fw_plan(plan, idx_fw)["remove"].add(idx_t)
+        return self.add_step(step)
+
+    def apply(self, original_wf, index=None):
+        index = index or FWTaskIndex(original_wf)
+        plan = {}
+        for step in self.steps:
+            step(original_wf, index, plan)
+
+        for idx_fw, fw_plan in plan.items():
+            fw = original_wf.fws[idx_fw]
+            tasks = []
+            for idx_t, t in enumerate(fw.tasks):
+                tasks.extend(fw_plan["before"].get(idx_t, []))
+                if idx_t not in fw_plan["remove"]:
+                    tasks.append(t)
+                tasks.extend(fw_plan["after"].get(idx_t, []))
+            fw.tasks = tasks
+        return original_wf
+
+    def scp_files(self, dest, fw_name_constraint=None, task_name_constraint="VaspToDb"):
+        return self.insert(
+            lambda fw, t: JFileTransferTask(mode="rtransfer", files=["all"], dest=dest, server="localhost",
+                                            user="jengyuantsai"),
+            task_name_constraint, position="after", fw_name_constraint=fw_name_constraint,
+        )
+
+    def write_inputs_from_db(self, db_file, task_id, modify_incar, write_chgcar=True, fw_name_constraint=None):
+        return self.insert(
+            lambda fw, t: JWriteInputsFromDB(db_file=db_file, task_id=task_id, write_chgcar=write_chgcar,
+                                             modify_incar=modify_incar),
+            "RunVasp", position="previous", fw_name_constraint=fw_name_constraint,
+        )
+
+    def jmodify_to_soc(self, structure, nbands=None, saxis=(0, 0, 1), magmom=None, modify_incar_params=None,
+                       fw_name_constraint=None):
+        def step(wf, index, plan):
+            modify_incar_soc = get_soc_incar_update(
+                structure or _get_opt_structure(wf, index), nbands=nbands, saxis=saxis, magmom=magmom,
+                modify_incar_params=modify_incar_params
+            )
+
+            def to_soc(fw, t):
+                t["vasp_cmd"] = ">>vasp_ncl<<"
+                fw.name += "_soc"
+
+            def rename(fw, t):
+                fw.name += "_soc"
+
+            def label(fw, t):
+                t["additional_fields"].update({"task_label": fw.name})
+
+            PowerupPipeline().insert(
+                lambda fw, t: ModifyIncar(**modify_incar_soc), "RunVasp", fw_name_constraint=fw_name_constraint
+            ).update(
+                to_soc, "RunVasp", fw_name_constraint
+            ).update(
+                rename, "RunBoltztrap", fw_name_constraint
+            ).update(
+                label, "VaspToDb", fw_name_constraint
+            ).steps_into(wf, index, plan)
+        return self.add_step(step)
+
+    def steps_into(self, wf, index, plan):
+        """
+        Run the steps of this pipeline as part of another pipeline's pass.
+        """
+        for step in self.steps:
+            step(wf, index, plan)
+
+    def remove_todb(self, fw_name_constraint=None):
+        return self.remove("VaspToDb", fw_name_constraint)
+
+    def write_PMGObjects(self, pmg_objs, fw_name_constraint=None):
+        return self.insert(lambda fw, t: WriteVaspFromPMGObjects(**pmg_objs), "RunVasp",
+                           fw_name_constraint=fw_name_constraint)
+
+    def cp_vdw_file(self, fw_name_constraint=None):
+        return self.insert(lambda fw, t: CopyFiles(from_dir=VDW_KERNEL_DIR), "RunVasp", position="previous",
+                           fw_name_constraint=fw_name_constraint)
+
+    def cp_vasp_from_prev(self, vasp_io, fw_name_constraint=None):
+        def add_files(fw, t):
+            if t.get("additional_files"):
+                t["additional_files"].extend(vasp_io)
+            else:
+                t.update({"additional_files": list(vasp_io)})
+        return self.update(add_files, "CopyVaspOutputs", fw_name_constraint)
+
+    def add_calc_summary(self, fw_name_constraint=None):
+        def step(wf, index, plan):
+            summarized = set(idx_fw for idx_fw, _ in index.find("WriteCalcSummary", fw_name_constraint))
+            for idx_fw, idx_t in index.find("RunVasp", fw_name_constraint):
+                if idx_fw not in summarized:
+                    _get_fw_plan(plan, idx_fw)["after"].setdefault(idx_t, []).insert(0, WriteCalcSummary())
+        return self.add_step(step)
+
+    def add_modify_twod_bs_kpoints(self, modify_kpoints_params=None, fw_name_constraint=None):
+        modify_kpoints_params = modify_kpoints_params or {
+            "twod_kpoints_update": ">>twod_kpoints_update<<"
+        }
+        return self.insert(lambda fw, t: WriteTwoDBSKpoints(**modify_kpoints_params), "RunVasp",
+                           fw_name_constraint=fw_name_constraint)
+
+    def manage_artifacts(self, artifacts=("WAVECAR", "CHGCAR", "WAVEDER", "WFULL"), action="compress", codec="gz",
+                         fw_name_constraint=None):
+        def step(wf, index, plan):
+            producers = {}
+            for idx_fw, idx_t in index.find("RunVasp", fw_name_constraint):
+                producers.setdefault(wf.fws[idx_fw].fw_id, {a: [] for a in artifacts})
+
+            parent_links = wf.links.parent_links
+            for idx_fw, fw in enumerate(wf.fws):
+                consumed = _get_files_from_parents(fw).intersection(artifacts)
+                parents = [p for p in parent_links.get(fw.fw_id, []) if p in producers]
+                if not consumed or not parents:
+                    continue
+                token = uuid4().hex
+                for parent in parents:
+                    for artifact in consumed:
+                        producers[parent][artifact].append(token)
+                _get_fw_plan(plan, idx_fw)["after"].setdefault(len(fw.tasks) - 1, []).append(
+                    ReleaseArtifacts(token=token))
+
+            for idx_fw, fw in enumerate(wf.fws):
+                if fw.fw_id in producers:
+                    _get_fw_plan(plan, idx_fw)["after"].setdefault(len(fw.tasks) - 1, []).append(
+                        TrackArtifacts(artifacts=producers[fw.fw_id], action=action, codec=codec))
+        return self.add_step(step)
+
+    def use_stream_dos(self, dos_storage="adaptive", fw_name_constraint=None, **storage_params):
+        def to_stream_dos(fw, t):
+            if get_task_name(t) != "VaspToDb" or not t.get("parse_dos"):
+                return None
+            params = dict(t)
+            params.update(storage_params, dos_storage=dos_storage)
+            return VaspToDbStreamDos(**params)
+        return self.replace(to_stream_dos, "VaspToDb", fw_name_constraint)
+
+    def use_handler_group(self, handler_group="incremental", fw_name_constraint=None):
+        handlers = get_handler_group(handler_group)
+
+        def set_handlers(fw, t):
+            t["handler_group"] = handlers
+        return self.update(set_handlers, "RunVaspCustodian", fw_name_constraint)
+
+    def use_node_scratch(self, node_scratch_dir=">>node_scratch_dir<<", stage_out_files=None,
+                         fw_name_constraint=None):
+        stage_out_files = stage_out_files or STAGE_OUT_FILES
+
+        def step(wf, index, plan):
+            fws = {fw.fw_id: fw for fw in wf.fws}
+
+            def to_scratch(fw, t):
+                files = list(stage_out_files)
+                for child in wf.links.get(fw.fw_id, []):
+                    files.extend(f for f in _get_files_from_parents(fws[child]) if f not in files)
+                params = dict(t)
+                params.update({"node_scratch_dir": node_scratch_dir, "stage_out_files": files})
+                return RunVaspCustodianScratch(**params)
+
+            PowerupPipeline().replace(to_scratch, "RunVaspCustodian", fw_name_constraint).steps_into(wf, index, plan)
+        return self.add_step(step)
+
+    def add_compress_outputs(self, files=None, codec="gz", nthreads=None, background=True, fw_name_constraint=None):
+        params = {"codec": codec, "background": background}
+        if files:
+            params["files"] = files
+        if nthreads:
+            params["nthreads"] = nthreads
+
+        def no_gzip(wf, index, plan):
+            # leave the compression to CompressOutputs
+            compressed_fws = set(idx_fw for idx_fw, _ in index.find("VaspToDb", fw_name_constraint))
+            for idx_fw, idx_t in index.find("RunVaspCustodian", fw_name_constraint):
+                if idx_fw in compressed_fws:
+                    wf.fws[idx_fw].tasks[idx_t]["gzip_output"] = False
+
+        return self.insert(lambda fw, t: CompressOutputs(**params), "VaspToDb", position="after",
+                           fw_name_constraint=fw_name_constraint).add_step(no_gzip)
+
+    def set_queue_from_estimate(self, structure, ranks_per_node, mem_per_node_gb, max_nodes=1, max_walltime_h=48,
+                                safety=1.5, calibration_file=None, fw_name_constraint=None):
+        def step(wf, index, plan):
+            calibration = load_calibration(calibration_file)
+            for idx_fw in sorted(set(idx_fw for idx_fw, _ in index.find("RunVasp", fw_name_constraint))):
+                _set_queue_from_estimate(wf.fws[idx_fw], structure, ranks_per_node, mem_per_node_gb, max_nodes,
+                                         max_walltime_h, safety, calibration)
+        return self.add_step(step)
+
+
+def _get_opt_structure(wf, index):
+    try:
+        idx_fw, idx_t = index.find("WriteVasp", "structure optimization")[0]
+        return wf.fws[idx_fw].tasks[idx_t]["vasp_input_set"].structure
+    except Exception:
+        raise ValueError(
+            "modify_to_soc powerup requires the structure in vasp_input_set"
+        )
+
+
+def get_soc_incar_update(structure, nbands=None, saxis=(0, 0, 1), magmom=None, modify_incar_params=None):
+    """
+    ModifyIncar params turning a collinear run into a SOC run.
+    """
+    if not magmom:
+        magmom = [[0, 0, mag_z] for mag_z in MPRelaxSet(structure).incar.get("MAGMOM", None)]
+
+    modify_incar_soc = {
+        "incar_update": {
+            "LSORBIT": "T",
+            "SAXIS": list(saxis),
+            "MAGMOM": magmom,
+            "ISPIN": 2,
+            "ICHARG": 11,
+            # "LMAXMIX": 4,
+            "ISYM": 0,
+        }
+    }
+    if nbands:
+        modify_incar_soc["incar_update"].update({"NBANDS": nbands})
+
+    if modify_incar_params:
+        modify_incar_soc["incar_update"].update(modify_incar_params)
+    return modify_incar_soc
+
+
 def scp_files(
         original_wf,
         dest,
@@ -35,34 +394,11 @@ def scp_files(
     Returns:
        Workflow
     """
-    idx_list = get_fws_and_tasks(
-        original_wf,
-        fw_name_constraint=fw_name_constraint,
-        task_name_constraint=task_name_constraint,
-    )
-    for idx_fw, idx_t in idx_list:
-        original_wf.fws[idx_fw].tasks.insert(idx_t + 1, JFileTransferTask(
-            mode="rtransfer",
-            files=["all"],
-            dest=dest,
-            server="localhost",
-            user="jengyuantsai"
-        ))
-
-    return original_wf
+    return PowerupPipeline().scp_files(dest, fw_name_constraint, task_name_constraint).apply(original_wf)
 
 def write_inputs_from_db(original_wf, db_file, task_id, modify_incar, write_chgcar=True, fw_name_constraint=None):
-
-    idx_list = get_fws_and_tasks(
-        original_wf,
-        fw_name_constraint=fw_name_constraint,
-        task_name_constraint="RunVasp",
-    )
-    for idx_fw, idx_t in idx_list:
-        original_wf.fws[idx_fw].tasks.insert(idx_t - 1, JWriteInputsFromDB(db_file=db_file, task_id=task_id,
-                                                                           write_chgcar=write_chgcar,
-                                                                           modify_incar=modify_incar))
-    return original_wf
+    return PowerupPipeline().write_inputs_from_db(
+        db_file, task_id, modify_incar, write_chgcar, fw_name_constraint).apply(original_wf)
 
 def jmodify_to_soc(
         original_wf,
@@ -88,73 +424,8 @@ def jmodify_to_soc(
     Returns:
         Workflow: modified with SOC
     """
-
-    if structure is None:
-        try:
-            sid = get_fws_and_tasks(
-                original_wf,
-                fw_name_constraint="structure optimization",
-                task_name_constraint="WriteVasp",
-            )
-            fw_id = sid[0][0]
-            task_id = sid[0][1]
-            structure = (
-                original_wf.fws[fw_id].tasks[task_id]["vasp_input_set"].structure
-            )
-        except:
-            raise ValueError(
-                "modify_to_soc powerup requires the structure in vasp_input_set"
-            )
-
-    if not magmom:
-        magmom = [[0,0,mag_z] for mag_z in MPRelaxSet(structure).incar.get("MAGMOM", None)]
-
-    modify_incar_soc = {
-        "incar_update": {
-            "LSORBIT": "T",
-            "SAXIS": saxis,
-            "MAGMOM": magmom,
-            "ISPIN": 2,
-            "ICHARG":11,
-            # "LMAXMIX": 4,
-            "ISYM": 0,
-        }
-    }
-    if nbands:
-        modify_incar_soc["incar_update"].update({"NBANDS": nbands})
-
-    if modify_incar_params:
-        modify_incar_soc["incar_update"].update(modify_incar_params)
-
-    run_vasp_list = get_fws_and_tasks(
-        original_wf,
-        fw_name_constraint=fw_name_constraint,
-        task_name_constraint="RunVasp",
-    )
-    for idx_fw, idx_t in run_vasp_list:
-        original_wf.fws[idx_fw].tasks[idx_t]["vasp_cmd"] = ">>vasp_ncl<<"
-        original_wf.fws[idx_fw].tasks.insert(idx_t, ModifyIncar(**modify_incar_soc))
-
-        original_wf.fws[idx_fw].name += "_soc"
-
-    run_boltztrap_list = get_fws_and_tasks(
-        original_wf,
-        fw_name_constraint=fw_name_constraint,
-        task_name_constraint="RunBoltztrap",
-    )
-    for idx_fw, idx_t in run_boltztrap_list:
-        original_wf.fws[idx_fw].name += "_soc"
-
-    # revise task_label to xxx_soc in db
-    to_db_list = get_fws_and_tasks(
-        original_wf,
-        fw_name_constraint=fw_name_constraint,
-        task_name_constraint="VaspToDb",
-    )
-    for idx_fw, idx_t in to_db_list:
-        original_wf.fws[idx_fw].tasks[idx_t]["additional_fields"].update({"task_label": original_wf.fws[idx_fw].name})
-
-    return original_wf
+    return PowerupPipeline().jmodify_to_soc(
+        structure, nbands, saxis, magmom, modify_incar_params, fw_name_constraint).apply(original_wf)
 
 def remove_todb(original_wf, fw_name_constraint=None):
     """
@@ -164,56 +435,31 @@ def remove_todb(original_wf, fw_name_constraint=None):
         fw_name_constraint (str): name constraint for fireworks to
             have their modification tasks removed
     """
-    idx_list = get_fws_and_tasks(
-        original_wf,
-        fw_name_constraint=fw_name_constraint,
-        task_name_constraint="VaspToDb",
-    )
-    idx_list.reverse()
-    for idx_fw, idx_t in idx_list:
-        original_wf.fws[idx_fw].tasks.pop(idx_t)
-    return original_wf
+    return PowerupPipeline().remove_todb(fw_name_constraint).apply(original_wf)
 
 def write_PMGObjects(original_wf, pmg_objs, fw_name_constraint=None):
-
-    idx_list = get_fws_and_tasks(
-        original_wf,
-        fw_name_constraint=fw_name_constraint,
-        task_name_constraint="RunVasp",
-    )
-
-    for idx_fw, idx_t in idx_list:
-        original_wf.fws[idx_fw].tasks.insert(
-            idx_t, WriteVaspFromPMGObjects(**pmg_objs)
-        )
-    return original_wf
+    return PowerupPipeline().write_PMGObjects(pmg_objs, fw_name_constraint).apply(original_wf)
 
 def cp_vdw_file(original_wf, fw_name_constraint=None):
+    return PowerupPipeline().cp_vdw_file(fw_name_constraint).apply(original_wf)
 
-    idx_list = get_fws_and_tasks(
-        original_wf,
-        fw_name_constraint=fw_name_constraint,
-        task_name_constraint="RunVasp",
-    )
+def cp_vasp_from_prev(original_wf, vasp_io, fw_name_constraint=None):
+    return PowerupPipeline().cp_vasp_from_prev(vasp_io, fw_name_constraint).apply(original_wf)
 
-    for idx_fw, idx_t in idx_list:
-        original_wf.fws[idx_fw].tasks.insert(
-            idx_t-1, CopyFiles(from_dir=VDW_KERNEL_DIR)
-        )
-    return original_wf
+def add_calc_summary(original_wf, fw_name_constraint=None):
+    """
+    Write calc_summary.json right after every RunVasp task, so that the
+    *FromPrev writers of the children do not parse vasprun.xml and OUTCAR
+    again. FWs that already summarize their run are left alone.
 
-def cp_vasp_from_prev(original_wf, vasp_io, fw_name_constraint=None):
-    idx_list = get_fws_and_tasks(
-        original_wf,
-        fw_name_constraint=fw_name_constraint,
-        task_name_constraint="CopyVaspOutputs",
-    )
-    for idx_fw, idx_t in idx_list:
-        if original_wf.fws[idx_fw].tasks[idx_t]["additional_files"]:
-            original_wf.fws[idx_fw].tasks[idx_t]["additional_files"].extend(vasp_io)
-        else:
-            original_wf.fws[idx_fw].tasks[idx_t].update({"additional_files": vasp_io})
-    return original_wf
+    Args:
+        original_wf (Workflow)
+        fw_name_constraint (str): Only apply changes to FWs where fw_name contains this substring.
+
+    Returns:
+       Workflow
+    """
+    return PowerupPipeline().add_calc_summary(fw_name_constraint).apply(original_wf)
 
 def add_modify_twod_bs_kpoints(
         original_wf, modify_kpoints_params=None, fw_name_constraint=None
@@ -232,18 +478,400 @@ def add_modify_twod_bs_kpoints(
     Returns:
        Workflow
     """
-    modify_kpoints_params = modify_kpoints_params or {
-        "twod_kpoints_update": ">>twod_kpoints_update<<"
-    }
+    return PowerupPipeline().add_modify_twod_bs_kpoints(modify_kpoints_params, fw_name_constraint).apply(original_wf)
 
-    idx_list = get_fws_and_tasks(
+
+def _get_files_from_parents(fw):
+    """
+    Names of the files a FW copies from its parents' directories (calc_loc copies only).
+    """
+    files = set()
+    for t in fw.tasks:
+        if "CopyVaspOutputs" in t._fw_name and t.get("calc_loc") and not t.get("filesystem"):
+            for f in t.get("files_to_copy") or t.get("additional_files") or []:
+                ext = get_compressed_extension(f)
+                files.add(f[:-len(ext)] if ext else f)
+    return files
+
+
+def manage_artifacts(
         original_wf,
-        fw_name_constraint=fw_name_constraint,
-        task_name_constraint="RunVasp",
+        artifacts=("WAVECAR", "CHGCAR", "WAVEDER", "WFULL"),
+        action="compress",
+        codec="gz",
+        fw_name_constraint=None
+):
+    """
+    Release large intermediate files as soon as the last child that copies them
+    has finished. Every VASP FW gets a TrackArtifacts task recording which
+    children consume its artifacts, and every consuming child gets a
+    ReleaseArtifacts task that checks in once it is done.
+
+    Args:
+        original_wf (Workflow)
+        artifacts ([str]): file names to manage
+        action (str): "compress" keeps reruns of children possible, "delete" frees the most space
+        codec (str): "gz" or "zst", for action="compress"
+        fw_name_constraint (str): only manage the artifacts of FWs whose name contains this substring
+
+    Returns:
+       Workflow
+    """
+    return PowerupPipeline().manage_artifacts(artifacts, action, codec, fw_name_constraint).apply(original_wf)
+
+
+def use_stream_dos(original_wf, dos_storage="adaptive", fw_name_constraint=None, **storage_params):
+    """
+    Parse the DOS of every VaspToDb with parse_dos by VaspToDbStreamDos and store
+    it the dos_storage way ("gridfs" or "adaptive", see my_atomate.firetasks.dos).
+
+    Args:
+        original_wf (Workflow)
+        dos_storage (str): "gridfs" or "adaptive"
+        fw_name_constraint (str): Only apply changes to FWs where fw_name contains this substring.
+        storage_params: fine_window, coarse_stride and nlevel_bands of VaspToDbStreamDos
+
+    Returns:
+       Workflow
+    """
+    return PowerupPipeline().use_stream_dos(dos_storage, fw_name_constraint, **storage_params).apply(original_wf)
+
+
+def use_handler_group(original_wf, handler_group="incremental", fw_name_constraint=None):
+    """
+    Run every RunVaspCustodian* with the custodian handlers of handler_group,
+    e.g. "incremental" to poll only the new lines of the VASP outputs (see
+    my_atomate.firetasks.handlers).
+
+    Args:
+        original_wf (Workflow)
+        handler_group (str): name of an atomate or my_atomate handler group
+        fw_name_constraint (str): Only apply changes to FWs where fw_name contains this substring.
+
+    Returns:
+       Workflow
+    """
+    return PowerupPipeline().use_handler_group(handler_group, fw_name_constraint).apply(original_wf)
+
+
+def use_node_scratch(
+        original_wf,
+        node_scratch_dir=">>node_scratch_dir<<",
+        stage_out_files=None,
+        fw_name_constraint=None
+):
+    """
+    Run VASP in node-local scratch instead of the shared-filesystem launch dir.
+    stage_out_files are written back together with the outputs the INCAR
+    switches on (LOCPOT, CHGCAR, WAVECAR, ...) and whatever the children of
+    each FW copy from it. A child copying "$ALL" writes back everything.
+
+    Args:
+        original_wf (Workflow)
+        node_scratch_dir (str): node-local scratch root, supports env_chk
+        stage_out_files ([str]): files to write back besides the INCAR outputs. Defaults to STAGE_OUT_FILES.
+        fw_name_constraint (str): Only apply changes to FWs where fw_name contains this substring.
+
+    Returns:
+       Workflow
+    """
+    return PowerupPipeline().use_node_scratch(node_scratch_dir, stage_out_files, fw_name_constraint).apply(
+        original_wf)
+
+
+def add_compress_outputs(
+        original_wf,
+        files=None,
+        codec="gz",
+        nthreads=None,
+        background=True,
+        fw_name_constraint=None
+):
+    """
+    Compress the large outputs of every VASP FW with a multithreaded codec once
+    VaspToDb is done, instead of custodian's serial gzip at the end of the run.
+
+    Args:
+        original_wf (Workflow)
+        files ([str]): files to compress. Defaults to vasprun.xml, OUTCAR, PROCAR, DOSCAR and WAVECAR.
+        codec (str): "gz" or "zst"
+        nthreads (int): threads for the codec, supports env_chk
+        background (bool): compress in a detached process so the FW completes right away
+        fw_name_constraint (str): Only apply changes to FWs where fw_name contains this substring.
+
+    Returns:
+       Workflow
+    """
+    return PowerupPipeline().add_compress_outputs(files, codec, nthreads, background, fw_name_constraint).apply(
+        original_wf)
+
+
+def add_profiling(original_wf, fw_name_constraint=None):
+    """
+    Wrap every firetask in ProfiledTask to record wall time, CPU time, peak RSS,
+    bytes read/written and file counts. The records are attached to the task doc
+    by VaspToDb and to the stored_data of the launch.
+
+    Apply this powerup last: the other powerups find the wrapped tasks by name
+    but would modify the parameters of the wrapper.
+
+    Args:
+        original_wf (Workflow)
+        fw_name_constraint (str): Only apply changes to FWs where fw_name contains this substring.
+
+    Returns:
+       Workflow
+    """
+    for fw in original_wf.fws:
+        if fw_name_constraint and fw_name_constraint not in fw.name:
+            continue
+        fw.tasks = [t if isinstance(t, ProfiledTask) else ProfiledTask(task=t.to_dict(), index=i)
+                    for i, t in enumerate(fw.tasks)]
+    return original_wf
+
+
+def get_structure_fingerprint(structure):
+    """
+    Key of the values derived from a structure by the powerups: the species
+    sequence and the site magmoms, which is all the default MAGMOM depends on.
+    """
+    magmoms = structure.site_properties.get("magmom")
+    return (
+        tuple(str(site.specie) for site in structure),
+        tuple(tuple(m) if isinstance(m, (list, tuple)) else m for m in magmoms) if magmoms else None,
     )
-    for idx_fw, idx_t in idx_list:
-        original_wf.fws[idx_fw].tasks.insert(
-            idx_t,
-            WriteTwoDBSKpoints(**modify_kpoints_params)
-        )
+
+
+def _jmodify_to_soc_worker(args):
+    from fireworks import Workflow
+    wf_dict, structure, kwargs = args
+    return jmodify_to_soc(Workflow.from_dict(wf_dict), structure, **kwargs).to_dict()
+
+
+def batch_jmodify_to_soc(
+        original_wfs,
+        structures=None,
+        nbands=None,
+        saxis=(0, 0, 1),
+        modify_incar_params=None,
+        fw_name_constraint=None,
+        nprocs=1
+):
+    """
+    jmodify_to_soc for many workflows. Workflows are grouped by structure
+    fingerprint and the SOC MAGMOM is computed once per group, then the
+    changes are applied in a pool of nprocs processes. With nprocs > 1 the
+    workflows are serialized to the workers and back, which only pays off for
+    large workflows.
+
+    Args:
+        original_wfs ([Workflow])
+        structures ([Structure]): one per workflow. If None, taken from the
+            "structure optimization" FW of each workflow.
+        nbands, saxis, modify_incar_params, fw_name_constraint: see jmodify_to_soc
+        nprocs (int): number of processes applying the changes
+
+    Returns:
+        ([Workflow], dict): the modified workflows and throughput statistics
+    """
+    t0 = time.time()
+    structures = structures or [_get_opt_structure(wf, FWTaskIndex(wf)) for wf in original_wfs]
+    magmoms = {}
+    for structure in structures:
+        key = get_structure_fingerprint(structure)
+        if key not in magmoms:
+            magmoms[key] = get_soc_incar_update(structure)["incar_update"]["MAGMOM"]
+    t_precompute = time.time() - t0
+
+    t0 = time.time()
+    kwargs = [dict(nbands=nbands, saxis=saxis, magmom=magmoms[get_structure_fingerprint(s)],
+                   modify_incar_params=modify_incar_params, fw_name_constraint=fw_name_constraint)
+              for s in structures]
+    if nprocs > 1:
+        from fireworks import Workflow
+        with ProcessPoolExecutor(nprocs) as executor:
+            wf_dicts = executor.map(_jmodify_to_soc_worker,
+                                    [(wf.to_dict(), s, k) for wf, s, k in zip(original_wfs, structures, kwargs)],
+                                    chunksize=max(1, len(original_wfs) // (4 * nprocs)))
+            wfs = [Workflow.from_dict(d) for d in wf_dicts]
+    else:
+        wfs = [jmodify_to_soc(wf, s, **k) for wf, s, k in zip(original_wfs, structures, kwargs)]
+    t_apply = time.time() - t0
+
+    stats = {
+        "nwfs": len(wfs),
+        "nfws": sum(len(wf.fws) for wf in wfs),
+        "ngroups": len(magmoms),
+        "precompute_time": t_precompute,
+        "apply_time": t_apply,
+        "wfs_per_s": len(wfs) / (t_precompute + t_apply) if wfs else 0.0,
+    }
+    logger.info("batch_jmodify_to_soc: {nwfs} wfs ({nfws} fws) in {ngroups} structure groups, "
+                "{precompute_time:.2f} s precompute + {apply_time:.2f} s apply, {wfs_per_s:.1f} wfs/s".format(**stats))
+    return wfs, stats
+
+
+def add_tuned_parallel_layout(original_wf, table_file=None, fworker=None, fw_name_constraint=None):
+    """
+    Set NCORE/KPAR of every VASP FW from the NCORE/KPAR tuning table of the
+    worker it runs on (see my_atomate.workflows.tuning.get_wf_parallel_probe).
+    The lookup happens at run time through ModifyIncar; auto_npar of
+    RunVaspCustodian is turned off since its NPAR would override NCORE, and the
+    same NPAR choice is used when the table has no entry.
+
+    Args:
+        original_wf (Workflow)
+        table_file (str): tuning table, supports env_chk. Defaults to ">>parallel_table<<".
+        fworker (str): fworker name of the table key, supports env_chk. Defaults to ">>tuning_fworker<<".
+        fw_name_constraint (str): Only apply changes to FWs where fw_name contains this substring.
+
+    Returns:
+       Workflow
+    """
+    params = {}
+    if table_file:
+        params["table_file"] = table_file
+    if fworker:
+        params["fworker"] = fworker
+
+    def no_auto_npar(fw, t):
+        t["auto_npar"] = False
+
+    return PowerupPipeline().insert(
+        lambda fw, t: ApplyTunedParallelLayout(**params), "RunVaspCustodian", fw_name_constraint=fw_name_constraint
+    ).update(no_auto_npar, "RunVaspCustodian", fw_name_constraint).apply(original_wf)
+
+
+def set_queue_from_estimate(original_wf, structure, ranks_per_node, mem_per_node_gb, max_nodes=1, max_walltime_h=48,
+                            safety=1.5, calibration_file=None, fw_name_constraint=None):
+    """
+    Set the nodes and walltime of the _queueadapter of every VASP FW from a
+    pre-flight estimate of its memory per rank and wall time (see
+    my_atomate.tools.estimator). The fewest nodes whose memory per rank fits
+    and whose walltime stays under max_walltime_h are used. FWs that fit on no
+    number of nodes up to max_nodes are refused before submission.
+
+    Args:
+        original_wf (Workflow)
+        structure (Structure): structure of the workflow
+        ranks_per_node (int): MPI ranks per node
+        mem_per_node_gb (float): memory per node
+        max_nodes (int): most nodes a FW may use
+        max_walltime_h (float): longest walltime of the queue
+        safety (float): factor on the predicted wall time
+        calibration_file (str): output of save_calibration. Defaults to the uncalibrated prefactors.
+        fw_name_constraint (str): Only apply changes to FWs where fw_name contains this substring.
+
+    Returns:
+       Workflow
+
+    Raises:
+        ValueError: if a FW does not fit
+    """
+    return PowerupPipeline().set_queue_from_estimate(
+        structure, ranks_per_node, mem_per_node_gb, max_nodes, max_walltime_h, safety, calibration_file,
+        fw_name_constraint).apply(original_wf)
+
+
+def _set_queue_from_estimate(fw, structure, ranks_per_node, mem_per_node_gb, max_nodes, max_walltime_h, safety,
+                             calibration):
+    mem_per_rank = mem_per_node_gb / ranks_per_node
+    params = get_fw_vasp_params(fw, structure)
+    for nodes in range(1, max_nodes + 1):
+        estimate = estimate_run(structure, params["incar"], params["nkpts"], nodes * ranks_per_node,
+                                soc=params["soc"], calibration=calibration)
+        walltime = estimate["walltime_s"] * safety
+        if estimate["mem_per_rank_gb"] <= mem_per_rank and walltime <= max_walltime_h * 3600:
+            break
+    else:
+        raise ValueError(
+            "{} does not fit on {} nodes: {:.2f} GB per rank (of {:.2f}), {:.1f} h (of {} h)".format(
+                fw.name, max_nodes, estimate["mem_per_rank_gb"], mem_per_rank, walltime / 3600, max_walltime_h))
+
+    # same _queueadapter entries as atomate's set_queue_options, plus nodes
+    walltime = int(math.ceil(walltime))
+    qsettings = dict(fw.spec.get("_queueadapter", {}))
+    qsettings.update({"nodes": nodes,
+                      "walltime": "{:02d}:{:02d}:{:02d}".format(walltime // 3600, walltime % 3600 // 60,
+                                                                walltime % 60)})
+    fw.spec["_queueadapter"] = qsettings
+    fw.spec["_preflight_estimate"] = dict(estimate, nodes=nodes)
+    logger.info("{}: {} nodes, {} walltime, {:.2f} GB per rank".format(
+        fw.name, nodes, qsettings["walltime"], estimate["mem_per_rank_gb"]))
+
+
+def add_sjf_priority(original_wf, structure, nranks=16, calibration_file=None, category_thresholds=None,
+                     history=None, fw_name_constraint=None):
+    """
+    Shortest-predicted-job-first _priority for the FWs of a new workflow, and
+    optionally a _category by the predicted cost of each FW (see
+    my_atomate.tools.scheduler, which also re-prioritizes submitted workflows).
+
+    Args:
+        original_wf (Workflow)
+        structure (Structure): structure of the workflow
+        nranks (int): ranks of FWs without spec._ncores
+        calibration_file (str): see my_atomate.tools.estimator.save_calibration
+        category_thresholds (dict): {category: max core-hours}
+        history (dict): output of my_atomate.tools.scheduler.get_runtime_history
+        fw_name_constraint (str): Only apply changes to FWs where fw_name contains this substring.
+
+    Returns:
+       Workflow
+    """
+    updates, remaining = get_sjf_updates(original_wf.fws, set(), structure, nranks,
+                                         load_calibration(calibration_file), history, category_thresholds)
+    for fw in original_wf.fws:
+        if fw_name_constraint is None or fw_name_constraint in fw.name:
+            fw.spec.update(updates[fw.fw_id])
+    logger.info("{}: {:.1f} predicted core-hours, priority {}".format(
+        original_wf.name, remaining, get_sjf_priority(remaining)))
+    return original_wf
+
+
+def use_structure_refs(original_wf, db_file, task_db_file=">>db_file<<", fw_name_constraint=None):
+    """
+    Store the structures of the WriteVaspFromIOSet tasks once in the
+    structures collection of db_file and replace the tasks by
+    WriteVaspFromIOSetRef, which refer to them by hash (see
+    my_atomate.firetasks.structure_refs). The input sets are kept without
+    their structure.
+
+    Args:
+        original_wf (Workflow)
+        db_file (str): db file to store the structures with, on this machine
+        task_db_file (str): db file the workers resolve the hashes with, supports env_chk
+        fw_name_constraint (str): Only apply changes to FWs where fw_name contains this substring.
+
+    Returns:
+       Workflow
+    """
+    collection = get_structures_collection(db_file)
+    stored = {}
+
+    def step(wf, index, plan):
+        for idx_fw, idx_t in index.find("WriteVaspFromIOSet", fw_name_constraint):
+            t = wf.fws[idx_fw].tasks[idx_t]
+            if get_task_name(t) != "WriteVaspFromIOSet":
+                continue
+            vis = t["vasp_input_set"]
+            if isinstance(vis, str):
+                structure, vis_ref = t["structure"], vis
+            else:
+                structure, vis_ref = vis.structure, vis.as_dict()
+                vis_ref.pop("structure")
+            key = id(structure)
+            if key not in stored:
+                stored[key] = store_structure(collection, structure)
+
+            params = {"structure_ref": stored[key], "vasp_input_set": vis_ref, "db_file": task_db_file}
+            for k in ("vasp_input_params", "potcar_spec"):
+                if t.get(k):
+                    params[k] = t[k]
+            fw_plan = _get_fw_plan(plan, idx_fw)
+            fw_plan["before"].setdefault(idx_t, []).append(WriteVaspFromIOSetRef(**params))
+            fw_plan["remove"].add(idx_t)
+
+    original_wf = PowerupPipeline().add_step(step).apply(original_wf)
+    logger.info("{}: {} structures stored by reference".format(original_wf.name, len(set(stored.values()))))
     return original_wf
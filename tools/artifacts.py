@@ -0,0 +1,78 @@
+"""
+Disk usage of the launch directories of a workflow.
+
+    from fireworks import LaunchPad
+    from my_atomate.tools.artifacts import get_wf_disk_usage, print_wf_disk_usage
+
+    print_wf_disk_usage(get_wf_disk_usage(LaunchPad.auto_load(), fw_id))
+
+"""
+
+import os
+
+from my_atomate.firetasks.lifecycle import MANIFEST, get_artifact_files
+
+__author__ = "Jeng-Yuan Tsai"
+__email__ = "tsaie79@gmail.com"
+
+
+ARTIFACTS = ("WAVECAR", "CHGCAR", "WAVEDER", "WFULL")
+
+
+def get_dir_size(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for f in files:
+            try:
+                total += os.lstat(os.path.join(root, f)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def get_wf_disk_usage(lpad, fw_id, artifacts=ARTIFACTS):
+    """
+    Disk usage of every launch dir of the workflow containing fw_id.
+
+    Args:
+        lpad (LaunchPad)
+        fw_id (int): any fw_id of the workflow
+        artifacts ([str]): artifacts to account for separately
+
+    Returns:
+        dict: {"name", "total", "artifacts_total", "fws": [{"fw_id", "name", "state", "launch_dir",
+            "managed", "total", "artifacts": {artifact: bytes}}]}
+    """
+    wf = lpad.get_wf_by_fw_id_lzyfw(fw_id)
+    report = {"name": wf.name, "total": 0, "artifacts_total": 0, "fws": []}
+    for fw in wf.fws:
+        for launch in fw.launches + fw.archived_launches:
+            launch_dir = launch.launch_dir
+            if not launch_dir or not os.path.isdir(launch_dir):
+                continue
+            entry = {
+                "fw_id": fw.fw_id,
+                "name": fw.name,
+                "state": fw.state,
+                "launch_dir": launch_dir,
+                "managed": os.path.exists(os.path.join(launch_dir, MANIFEST)),
+                "total": get_dir_size(launch_dir),
+                "artifacts": {},
+            }
+            for artifact in artifacts:
+                entry["artifacts"][artifact] = sum(os.path.getsize(f) for f in get_artifact_files(launch_dir, artifact))
+            report["fws"].append(entry)
+            report["total"] += entry["total"]
+            report["artifacts_total"] += sum(entry["artifacts"].values())
+    return report
+
+
+def print_wf_disk_usage(report):
+    gb = 1024 ** 3
+    print("{}: {:.2f} GB, artifacts {:.2f} GB".format(report["name"], report["total"] / gb,
+                                                      report["artifacts_total"] / gb))
+    for entry in sorted(report["fws"], key=lambda e: -e["total"]):
+        artifacts = ", ".join("{} {:.2f}".format(k, v / gb) for k, v in entry["artifacts"].items() if v)
+        print("  {:>7} {:<40} {:<10} {:8.2f} GB {}{}".format(
+            entry["fw_id"], entry["name"], entry["state"], entry["total"] / gb,
+            "[managed] " if entry["managed"] else "", artifacts))
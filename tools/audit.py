@@ -0,0 +1,274 @@
+"""
+Build-time and size audit of a workflow configuration.
+
+The configuration is a json file naming the workflow function, the structure
+file and the keyword arguments, and optionally powerups to apply:
+
+    {
+        "function": "my_atomate.workflows.wf_full.get_wf_full_hse",
+        "structure": "POSCAR",
+        "kwargs": {"charge_states": [0, 1], "gamma_only": true, "gamma_mesh": true, "nupdowns": [-1, -1],
+                   "task": "opt-hse_relax-hse_scf"},
+        "powerups": [{"function": "my_atomate.powerups.remove_todb", "kwargs": {}}]
+    }
+
+    python -m my_atomate.tools.audit wf_config.json
+    python -m my_atomate.tools.audit wf_config.json --compare HEAD~5 HEAD
+
+The report has the serialized size of every FW and task, the largest embedded
+objects (structures, input sets, k-points, long INCAR strings such as
+occupations) and the time spent in every Firework, Workflow and input set
+constructor. --compare builds the configuration at two commits (through git
+worktree) and lists the regressions.
+
+"""
+
+import contextlib
+import functools
+import importlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+__author__ = "Jeng-Yuan Tsai"
+__email__ = "tsaie79@gmail.com"
+
+
+# smallest embedded object to report, in bytes
+MIN_OBJECT_SIZE = 1024
+
+SIZE_TOLERANCE = 0.05
+TIME_TOLERANCE = 0.2
+
+
+def get_size(obj):
+    return len(json.dumps(obj, default=str))
+
+
+def load_function(path):
+    module, name = path.rsplit(".", 1)
+    return getattr(importlib.import_module(module), name)
+
+
+def get_subclasses(cls):
+    subclasses = set()
+    for c in cls.__subclasses__():
+        subclasses.add(c)
+        subclasses |= get_subclasses(c)
+    return subclasses
+
+
+def instrument_constructors(timings):
+    """
+    Wrap __init__ of Workflow and of every imported Firework and VaspInputSet
+    subclass to accumulate (inclusive) time and calls in timings.
+    """
+    from fireworks import Firework, Workflow
+    from pymatgen.io.vasp.sets import VaspInputSet
+
+    def wrap(cls):
+        init = cls.__dict__.get("__init__")
+        if init is None or getattr(init, "_audited", False):
+            return
+        name = "{}.{}".format(cls.__module__, cls.__name__)
+
+        @functools.wraps(init)
+        def timed_init(self, *args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return init(self, *args, **kwargs)
+            finally:
+                entry = timings.setdefault(name, {"calls": 0, "time": 0.0})
+                entry["calls"] += 1
+                entry["time"] += time.perf_counter() - t0
+
+        timed_init._audited = True
+        cls.__init__ = timed_init
+
+    for cls in {Workflow, Firework} | get_subclasses(Firework) | get_subclasses(VaspInputSet):
+        wrap(cls)
+
+
+def find_large_objects(obj, path="", min_size=MIN_OBJECT_SIZE):
+    """
+    Embedded MSONable objects (by @class) and long strings or lists of a
+    serialized FW, largest first. Objects inside a reported object are not
+    reported again.
+
+    Returns:
+        [dict]: {"path", "type", "size"}
+    """
+    found = []
+    if isinstance(obj, dict):
+        if "@class" in obj and path:
+            size = get_size(obj)
+            if size >= min_size:
+                return [{"path": path, "type": obj["@class"], "size": size}]
+        for k, v in obj.items():
+            found.extend(find_large_objects(v, "{}.{}".format(path, k) if path else str(k), min_size))
+    elif isinstance(obj, list):
+        size = get_size(obj)
+        children = []
+        for i, v in enumerate(obj):
+            children.extend(find_large_objects(v, "{}[{}]".format(path, i), min_size))
+        if children:
+            found.extend(children)
+        elif size >= min_size:
+            found.append({"path": path, "type": "list", "size": size})
+    elif isinstance(obj, str) and len(obj) >= min_size:
+        found.append({"path": path, "type": "str", "size": len(obj)})
+    return sorted(found, key=lambda x: -x["size"])
+
+
+def build_workflow(config, structure):
+    """
+    The workflow of config for structure, with the powerups of config applied.
+    The workflow functions print; their output goes to stderr so that stdout
+    stays clean for the reports.
+    """
+    with contextlib.redirect_stdout(sys.stderr):
+        wf = load_function(config["function"])(structure, **config.get("kwargs", {}))
+        for powerup in config.get("powerups", []):
+            wf = load_function(powerup["function"])(wf, **powerup.get("kwargs", {}))
+    return wf
+
+
+def audit_workflow(config, top=20):
+    """
+    Build the workflow of config and measure it.
+
+    Args:
+        config (dict): see the module docstring
+        top (int): number of largest objects to report
+
+    Returns:
+        dict: {"name", "build_time", "total_size", "fws": [...], "largest": [...], "constructors": {...}}
+    """
+    from pymatgen.core.structure import Structure
+
+    timings = {}
+    # import the workflow module first, so that its Fireworks are instrumented
+    load_function(config["function"])
+    instrument_constructors(timings)
+    structure = Structure.from_file(config["structure"])
+
+    t0 = time.perf_counter()
+    wf = build_workflow(config, structure)
+    build_time = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    wf_dict = wf.to_dict()
+    serialize_time = time.perf_counter() - t0
+
+    fws, largest = [], []
+    for fw_dict in wf_dict["fws"]:
+        tasks = [{"task": t["_fw_name"].strip("{}").split(".")[-1], "size": get_size(t)}
+                 for t in fw_dict["spec"]["_tasks"]]
+        fws.append({"name": fw_dict["name"], "size": get_size(fw_dict), "tasks": tasks})
+        for obj in find_large_objects(fw_dict["spec"]):
+            largest.append(dict(obj, fw=fw_dict["name"]))
+
+    return {
+        "name": wf.name,
+        "nfws": len(wf.fws),
+        "build_time": build_time,
+        "serialize_time": serialize_time,
+        "total_size": get_size(wf_dict),
+        "fws": fws,
+        "largest": sorted(largest, key=lambda x: -x["size"])[:top],
+        "constructors": timings,
+    }
+
+
+def print_audit(report):
+    kb = 1024
+    print("{}: {} FWs, {:.1f} KB, built in {:.2f} s, serialized in {:.2f} s".format(
+        report["name"], report["nfws"], report["total_size"] / kb, report["build_time"], report["serialize_time"]))
+    print("\nFWs")
+    for fw in sorted(report["fws"], key=lambda f: -f["size"]):
+        print("  {:<56} {:>9.1f} KB".format(fw["name"], fw["size"] / kb))
+        for t in fw["tasks"]:
+            print("      {:<52} {:>9.1f} KB".format(t["task"], t["size"] / kb))
+    print("\nLargest embedded objects")
+    for obj in report["largest"]:
+        print("  {:>9.1f} KB  {:<20} {} :: {}".format(obj["size"] / kb, obj["type"], obj["fw"], obj["path"]))
+    print("\nConstructors (inclusive)")
+    for name, t in sorted(report["constructors"].items(), key=lambda x: -x[1]["time"]):
+        print("  {:<64} {:>5} calls {:>8.3f} s".format(name, t["calls"], t["time"]))
+
+
+def audit_at_commit(config_file, commit, repo_dir=None):
+    """
+    Run this script on config_file against the tree of commit, checked out
+    in a temporary git worktree.
+    """
+    repo_dir = repo_dir or os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    tmp = tempfile.mkdtemp(prefix="audit_")
+    worktree = os.path.join(tmp, "my_atomate")
+    subprocess.check_call(["git", "-C", repo_dir, "worktree", "add", "--detach", worktree, commit],
+                          stdout=subprocess.DEVNULL)
+    try:
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([tmp, os.environ.get("PYTHONPATH", "")]))
+        out = subprocess.check_output([sys.executable, os.path.abspath(__file__), os.path.abspath(config_file),
+                                       "--json"], env=env, cwd=tmp, universal_newlines=True)
+        return json.loads(out)
+    finally:
+        subprocess.call(["git", "-C", repo_dir, "worktree", "remove", "--force", worktree])
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def compare_audits(old, new, size_tolerance=SIZE_TOLERANCE, time_tolerance=TIME_TOLERANCE):
+    """
+    Regressions of new against old: total size and build time, and the size
+    of every FW present in both.
+
+    Returns:
+        [dict]: {"what", "old", "new", "change"}
+    """
+    def check(what, a, b, tolerance):
+        if a and (b - a) / a > tolerance:
+            regressions.append({"what": what, "old": a, "new": b, "change": (b - a) / a})
+
+    regressions = []
+    check("total_size", old["total_size"], new["total_size"], size_tolerance)
+    check("build_time", old["build_time"], new["build_time"], time_tolerance)
+    old_fws = {fw["name"]: fw["size"] for fw in old["fws"]}
+    for fw in new["fws"]:
+        if fw["name"] in old_fws:
+            check("size of " + fw["name"], old_fws[fw["name"]], fw["size"], size_tolerance)
+    return regressions
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Audit the build time and size of a workflow configuration.")
+    parser.add_argument("config", help="workflow configuration (json)")
+    parser.add_argument("--top", type=int, default=20, help="number of largest objects to list")
+    parser.add_argument("--json", action="store_true", help="print the report as json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two commits")
+    args = parser.parse_args()
+
+    if args.compare:
+        old, new = [audit_at_commit(args.config, commit) for commit in args.compare]
+        print("{}: {:.1f} KB -> {:.1f} KB, {:.2f} s -> {:.2f} s".format(
+            new["name"], old["total_size"] / 1024, new["total_size"] / 1024, old["build_time"], new["build_time"]))
+        regressions = compare_audits(old, new)
+        for r in regressions:
+            print("  REGRESSION {:<56} {:>12.4g} -> {:>12.4g} ({:+.0%})".format(r["what"], r["old"], r["new"],
+                                                                               r["change"]))
+        sys.exit(1 if regressions else 0)
+
+    with open(args.config) as f:
+        config = json.load(f)
+    # the structure file is relative to the configuration
+    config["structure"] = os.path.join(os.path.dirname(os.path.abspath(args.config)), config["structure"])
+    report = audit_workflow(config, args.top)
+    if args.json:
+        print(json.dumps(report))
+    else:
+        print_audit(report)
@@ -0,0 +1,174 @@
+"""
+Long-lived runner for FWs made only of light Python tasks (standardization,
+IRVSP and its parsing, the *ToDb tasks).
+
+The worker processes import pymatgen/atomate/pytopomat once when the pool
+starts and then run READY FWs in batches through launch_rocket, so the
+interpreter startup and import cost of rlaunch is paid once per worker
+instead of once per FW. Each FW still goes through a normal Rocket and
+updates the LaunchPad itself; a summary is logged per batch.
+
+    python -m my_atomate.tools.batch_runner -l my_launchpad.yaml -w my_fworker.yaml -n 8
+
+"""
+
+import importlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from fireworks import FWorker, LaunchPad
+from fireworks.core.rocket_launcher import launch_rocket
+
+from atomate.utils.utils import get_logger
+
+__author__ = "Jeng-Yuan Tsai"
+__email__ = "tsaie79@gmail.com"
+
+
+logger = get_logger(__name__)
+
+ALLOWED_TASKS = {
+    "CopyVaspOutputs", "JCopyVaspOutputs", "PassCalcLocs", "StandardizeCell", "RunIRVSP", "RunIRVSPAll",
+    "RunIRVSPsingleKpt", "IRVSPToDb", "PyzfsToDb",
+}
+
+PRELOAD_MODULES = [
+    "pymatgen.core",
+    "pymatgen.io.vasp",
+    "pymatgen.symmetry.analyzer",
+    "atomate.vasp.firetasks.glue_tasks",
+    "atomate.vasp.database",
+    "my_atomate.firetasks.staging",
+    "my_atomate.firetasks.pytopomat",
+    "my_atomate.firetasks.pyzfs",
+]
+
+IDLE_INTERVAL = 30
+
+# set in every worker process by _init_worker
+_WORKER = {}
+
+
+def get_fw_task_names(fw_doc):
+    return [t["_fw_name"].strip("{}").split(".")[-1] for t in fw_doc["spec"]["_tasks"]]
+
+
+def get_batch(lpad, fworker, batch_size, allowed_tasks=ALLOWED_TASKS, exclude=()):
+    """
+    Up to batch_size READY fw_ids of the fworker whose tasks are all allowed, by _priority.
+    """
+    query = dict(fworker.query)
+    query["state"] = "READY"
+    if exclude:
+        query["fw_id"] = {"$nin": list(exclude)}
+    fw_ids = []
+    for doc in lpad.fireworks.find(query, {"fw_id": 1, "spec._tasks._fw_name": 1}).sort(
+            [("spec._priority", -1), ("created_on", 1)]):
+        if set(get_fw_task_names(doc)) <= set(allowed_tasks):
+            fw_ids.append(doc["fw_id"])
+            if len(fw_ids) == batch_size:
+                break
+    return fw_ids
+
+
+def _init_worker(launchpad_file, fworker_file, modules):
+    for module in modules:
+        importlib.import_module(module)
+    _WORKER["lpad"] = LaunchPad.from_file(launchpad_file) if launchpad_file else LaunchPad.auto_load()
+    _WORKER["fworker"] = FWorker.from_file(fworker_file) if fworker_file else FWorker.auto_load()
+
+
+def _run_fw(args):
+    fw_id, launch_root = args
+    # launch_rocket runs in the cwd; a process only runs one FW at a time
+    launch_dir = os.path.join(launch_root, "fw_{}".format(fw_id))
+    os.makedirs(launch_dir, exist_ok=True)
+    os.chdir(launch_dir)
+    t0 = time.time()
+    try:
+        launched = launch_rocket(_WORKER["lpad"], _WORKER["fworker"], fw_id=fw_id, strm_lvl="WARNING")
+        error = None
+    except Exception as e:
+        launched, error = False, repr(e)
+    state = _WORKER["lpad"].fireworks.find_one({"fw_id": fw_id}, {"state": 1})["state"]
+    return {"fw_id": fw_id, "launched": launched, "state": state, "wall_time": time.time() - t0, "error": error}
+
+
+def log_batch_summary(results, elapsed):
+    states = {}
+    for r in results:
+        states[r["state"]] = states.get(r["state"], 0) + 1
+    logger.info("batch of {} FWs in {:.1f} s ({:.2f} FWs/s): {}".format(
+        len(results), elapsed, len(results) / max(elapsed, 1e-9),
+        ", ".join("{} {}".format(n, s) for s, n in sorted(states.items()))))
+    for r in results:
+        if r["error"] or r["state"] != "COMPLETED":
+            logger.warning("fw_id {}: {} {}".format(r["fw_id"], r["state"], r["error"] or ""))
+
+
+def run_batches(launchpad_file=None, fworker_file=None, nprocs=4, batch_size=None, allowed_tasks=ALLOWED_TASKS,
+                launch_root=".", max_batches=None, exit_when_idle=True, preload_modules=PRELOAD_MODULES):
+    """
+    Run READY FWs made only of allowed_tasks in batches on a process pool
+    that stays alive between batches.
+
+    Args:
+        launchpad_file (str): defaults to LaunchPad.auto_load
+        fworker_file (str): defaults to FWorker.auto_load; its category and query select the FWs
+        nprocs (int): worker processes
+        batch_size (int): FWs per batch, defaults to 4 * nprocs
+        allowed_tasks (set): task names the FWs may consist of
+        launch_root (str): the launch dirs go to launch_root/fw_<fw_id>
+        max_batches (int): stop after this many batches
+        exit_when_idle (bool): stop when no FW is READY, otherwise wait for more
+        preload_modules ([str]): imported once per worker process
+
+    Returns:
+        [dict]: {"fw_id", "launched", "state", "wall_time", "error"} per FW
+    """
+    lpad = LaunchPad.from_file(launchpad_file) if launchpad_file else LaunchPad.auto_load()
+    fworker = FWorker.from_file(fworker_file) if fworker_file else FWorker.auto_load()
+    batch_size = batch_size or 4 * nprocs
+    launch_root = os.path.abspath(launch_root)
+
+    results, tried, nbatches = [], set(), 0
+    t0 = time.time()
+    with ProcessPoolExecutor(nprocs, initializer=_init_worker,
+                             initargs=(launchpad_file, fworker_file, preload_modules)) as executor:
+        logger.info("started {} workers".format(nprocs))
+        while not max_batches or nbatches < max_batches:
+            fw_ids = get_batch(lpad, fworker, batch_size, allowed_tasks, exclude=tried)
+            if not fw_ids:
+                if exit_when_idle:
+                    break
+                time.sleep(IDLE_INTERVAL)
+                continue
+            tried.update(fw_ids)
+            t_batch = time.time()
+            batch = list(executor.map(_run_fw, [(fw_id, launch_root) for fw_id in fw_ids]))
+            log_batch_summary(batch, time.time() - t_batch)
+            results.extend(batch)
+            nbatches += 1
+
+    logger.info("{} FWs in {} batches, {:.1f} s".format(len(results), nbatches, time.time() - t0))
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run light Python FWs in batches on a warm process pool.")
+    parser.add_argument("-l", "--launchpad_file", default=None)
+    parser.add_argument("-w", "--fworker_file", default=None)
+    parser.add_argument("-n", "--nprocs", type=int, default=4)
+    parser.add_argument("-b", "--batch_size", type=int, default=None)
+    parser.add_argument("--tasks", nargs="+", default=None, help="allowed task names, default ALLOWED_TASKS")
+    parser.add_argument("--launch_root", default=".")
+    parser.add_argument("--max_batches", type=int, default=None)
+    parser.add_argument("--wait", action="store_true", help="wait for new FWs instead of exiting when idle")
+    args = parser.parse_args()
+
+    run_batches(args.launchpad_file, args.fworker_file, args.nprocs, args.batch_size,
+                set(args.tasks) if args.tasks else ALLOWED_TASKS, args.launch_root, args.max_batches,
+                not args.wait)
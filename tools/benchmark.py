@@ -0,0 +1,396 @@
+"""
+Benchmark suite: workflow builders, powerup stacks, db ingestion, output
+parsers and custodian handlers.
+
+Every benchmark reports the median time per call, the throughput and the
+tracemalloc peak. A run is appended as one json line (commit, host, results)
+to the history file, so trends can be followed across commits.
+
+    python -m my_atomate.tools.benchmark --sizes 1 2 3 --history benchmark_history.jsonl
+    python -m my_atomate.tools.benchmark --only ingestion --mongo mongomock
+    python -m my_atomate.tools.benchmark --only parsers --vasprun hse_scf/vasprun.xml.gz --outcar hse_scf/OUTCAR
+    python -m my_atomate.tools.benchmark --only handlers --npolls 500
+
+The workflow builders need the POTCARs of pymatgen (PMG_VASP_PSP_DIR). The
+ingestion benchmarks run against a throwaway mongod (--mongo mongod, needs
+the mongod binary) or against mongomock (--mongo mongomock). The parser
+benchmark compares pymatgen's Vasprun and Outcar with the extractors of
+my_atomate.firetasks.parsers on the files given by --vasprun and --outcar.
+The handler benchmark grows synthetic vasp.out, OSZICAR and std_err.txt files
+poll by poll and times the check() of the standard custodian monitors against
+the Incremental* handlers of my_atomate.firetasks.handlers; it also writes the
+inputs of the synthetic structure and so needs the POTCARs.
+
+"""
+
+import contextlib
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+__author__ = "Jeng-Yuan Tsai"
+__email__ = "tsaie79@gmail.com"
+
+
+HISTORY_FILE = "benchmark_history.jsonl"
+
+BENCHMARKS = ["builders", "powerups", "ingestion", "parsers", "handlers"]
+
+
+def get_synthetic_structure(size):
+    """
+    MgO rocksalt supercell of size^3 conventional cells (8 * size^3 sites)
+    with one Mg vacancy, so symmetry is lowered like in a defect calculation.
+    """
+    from pymatgen.core.lattice import Lattice
+    from pymatgen.core.structure import Structure
+
+    structure = Structure.from_spacegroup("Fm-3m", Lattice.cubic(4.21), ["Mg", "O"], [[0, 0, 0], [0.5, 0.5, 0.5]])
+    structure.make_supercell([size, size, size])
+    structure.remove_sites([0])
+    return structure
+
+
+def measure(func, repeat=3, **info):
+    """
+    Median wall time, throughput and the largest tracemalloc peak of repeat calls of func.
+    """
+    times, peaks = [], []
+    for _ in range(repeat):
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(sys.stderr):
+            func()
+        times.append(time.perf_counter() - t0)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    t = float(np.median(times))
+    return dict(info, time=t, throughput=1 / t if t else None, peak_mb=max(peaks) / 1024 ** 2, repeat=repeat)
+
+
+def get_builders():
+    from my_atomate.workflows.wf_full import get_wf_full_hse, get_wf_full_scan
+    from my_atomate.workflows.gw_workflow import gw_wf
+
+    return {
+        "get_wf_full_hse": lambda s: get_wf_full_hse(s, charge_states=[0, 1], gamma_only=True, gamma_mesh=True,
+                                                     nupdowns=[-1, -1], task="opt-hse_relax-hse_scf"),
+        "get_wf_full_scan": lambda s: get_wf_full_scan(s, charge_states=[0, 1], gamma_only=True, gamma_mesh=True,
+                                                       dos=False, nupdowns=[-1, -1], task="scan_relax-scan_scf",
+                                                       category="benchmark"),
+        "gw_wf": lambda s: gw_wf(s, prev_dir="."),
+    }
+
+
+def benchmark_builders(sizes, repeat=3):
+    results = []
+    for name, build in get_builders().items():
+        for size in sizes:
+            structure = get_synthetic_structure(size)
+            results.append(measure(lambda: build(structure.copy()), repeat, benchmark="builders", name=name,
+                                   nsites=len(structure)))
+    return results
+
+
+def get_powerup_stacks(structure):
+    from my_atomate import powerups
+
+    return {
+        "pipeline_soc": lambda wf: powerups.PowerupPipeline().cp_vdw_file().jmodify_to_soc(
+            structure).remove_todb().apply(wf),
+        "sequential_soc": lambda wf: powerups.remove_todb(powerups.jmodify_to_soc(
+            powerups.cp_vdw_file(wf), structure)),
+        "campaign": lambda wf: powerups.add_profiling(powerups.add_compress_outputs(
+            powerups.manage_artifacts(powerups.use_node_scratch(wf)))),
+    }
+
+
+def benchmark_powerups(sizes, repeat=3):
+    from copy import deepcopy
+
+    build = get_builders()["get_wf_full_hse"]
+    results = []
+    for size in sizes:
+        structure = get_synthetic_structure(size)
+        with contextlib.redirect_stdout(sys.stderr):
+            wf = build(structure.copy())
+        for name, stack in get_powerup_stacks(structure).items():
+            results.append(measure(lambda: stack(deepcopy(wf)), repeat, benchmark="powerups", name=name,
+                                   nsites=len(structure), nfws=len(wf.fws)))
+    return results
+
+
+@contextlib.contextmanager
+def throwaway_db(backend="mongod"):
+    """
+    A db file pointing at an empty database: a mongod on a free port in a
+    temporary dir, or mongomock patched into pymongo.
+    """
+    tmp = tempfile.mkdtemp(prefix="benchmark_db_")
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        port = s.getsockname()[1]
+    db_file = os.path.join(tmp, "db.json")
+    with open(db_file, "w") as f:
+        json.dump({"host": "localhost", "port": port, "database": "benchmark", "collection": "tasks"}, f)
+
+    try:
+        if backend == "mongomock":
+            import mongomock
+            with mongomock.patch(servers=(("localhost", port),)):
+                yield db_file
+        else:
+            os.makedirs(os.path.join(tmp, "data"))
+            mongod = subprocess.Popen(["mongod", "--dbpath", os.path.join(tmp, "data"), "--port", str(port),
+                                       "--bind_ip", "localhost"], stdout=subprocess.DEVNULL)
+            try:
+                from pymongo import MongoClient
+                MongoClient("localhost", port, serverSelectionTimeoutMS=30000).admin.command("ping")
+                yield db_file
+            finally:
+                mongod.terminate()
+                mongod.wait()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def get_synthetic_irvsp_spec(structure, nkpts=50, nbands=200):
+    rng = np.random.RandomState(0)
+    return {
+        "irvsp_out": {
+            "parity_eigenvals": {"general": {str(k): {"band_index": list(range(nbands)),
+                                                      "band_eigenval": rng.rand(nbands).tolist(),
+                                                      "irreps": ["GM1+"] * nbands} for k in range(nkpts)}},
+        },
+        "formula": structure.composition.formula,
+        "efermi": 0.0,
+        "structure": structure.as_dict(),
+        "post_relax_sg_name": "Fm-3m",
+        "post_relax_sg_number": 225,
+    }
+
+
+def benchmark_ingestion(sizes, repeat=3, ndocs=20, backend="mongod"):
+    from my_atomate.firetasks.pytopomat import IRVSPToDb
+    from my_atomate.firetasks.pyzfs import PyzfsToDb
+
+    results = []
+    cwd = os.getcwd()
+    with throwaway_db(backend) as db_file:
+        for size in sizes:
+            structure = get_synthetic_structure(size)
+            work_dir = tempfile.mkdtemp(prefix="benchmark_ingest_")
+            os.chdir(work_dir)
+            try:
+                irvsp_spec = get_synthetic_irvsp_spec(structure)
+                irvsp = IRVSPToDb(irvsp_out=irvsp_spec["irvsp_out"], db_file=db_file, collection_name="irvsp")
+
+                with open("pyzfs_out.json", "w") as f:
+                    json.dump({"D": np.eye(3).tolist(), "Dvalue": 1.0, "Evalue": 0.1,
+                               "I": np.random.RandomState(0).rand(len(structure), 3).tolist()}, f)
+                pyzfs = PyzfsToDb(db_file=db_file, collection_name="pyzfs")
+                pyzfs_spec = {"formula": structure.composition.formula, "structure": structure.as_dict()}
+
+                for name, task, spec in [("IRVSPToDb", irvsp, irvsp_spec), ("PyzfsToDb", pyzfs, pyzfs_spec)]:
+                    def ingest():
+                        for _ in range(ndocs):
+                            task.run_task(spec)
+                    r = measure(ingest, repeat, benchmark="ingestion", name=name, nsites=len(structure),
+                                backend=backend)
+                    r["docs_per_s"] = ndocs / r["time"]
+                    results.append(r)
+            finally:
+                os.chdir(cwd)
+                shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def get_parsers():
+    from pymatgen.io.vasp.outputs import Vasprun
+    from my_atomate.firetasks.parsers import stream_vasprun
+
+    return {
+        "Vasprun": lambda f: Vasprun(f, parse_dos=True, parse_eigen=True, parse_potcar_file=False).complete_dos,
+        "stream_vasprun": lambda f: stream_vasprun(f),
+    }
+
+
+def benchmark_parsers(vasprun_files, repeat=3):
+    from my_atomate.firetasks.parsers import stream_vasprun
+
+    results = []
+    for vasprun_file in vasprun_files:
+        info = stream_vasprun(vasprun_file, parse_eigen=False, parse_dos=False, parse_pdos=False)
+        for name, parse in get_parsers().items():
+            results.append(measure(lambda: parse(vasprun_file), repeat, benchmark="parsers", name=name,
+                                   nsites=len(info["species"]), file=vasprun_file,
+                                   file_mb=os.path.getsize(vasprun_file) / 1024 ** 2))
+    return results
+
+
+def get_outcar_parsers():
+    from pymatgen.io.vasp.outputs import Outcar
+    from my_atomate.firetasks.parsers import get_outcar_convergence, get_outcar_values
+
+    return {
+        "Outcar": lambda f: Outcar(f).efermi,
+        "get_outcar_values": lambda f: (get_outcar_values(f), get_outcar_convergence(f)),
+    }
+
+
+def benchmark_outcar_parsers(outcar_files, repeat=3):
+    from my_atomate.firetasks.parsers import get_outcar_parameters
+
+    results = []
+    for outcar_file in outcar_files:
+        nions = get_outcar_parameters(outcar_file, ["NIONS"]).get("NIONS")
+        for name, parse in get_outcar_parsers().items():
+            results.append(measure(lambda: parse(outcar_file), repeat, benchmark="parsers", name=name,
+                                   nsites=nions or 0, file=outcar_file,
+                                   file_mb=os.path.getsize(outcar_file) / 1024 ** 2))
+    return results
+
+
+def get_handler_pairs():
+    from custodian.vasp.handlers import (
+        VaspErrorHandler, StdErrHandler, NonConvergingErrorHandler, PotimErrorHandler, PositiveEnergyErrorHandler,
+    )
+    from my_atomate.firetasks.handlers import (
+        IncrementalVaspErrorHandler, IncrementalStdErrHandler, IncrementalNonConvergingErrorHandler,
+        IncrementalPotimErrorHandler, IncrementalPositiveEnergyErrorHandler,
+    )
+
+    return {
+        "VaspErrorHandler": (VaspErrorHandler, IncrementalVaspErrorHandler),
+        "StdErrHandler": (StdErrHandler, IncrementalStdErrHandler),
+        "NonConvergingErrorHandler": (NonConvergingErrorHandler, IncrementalNonConvergingErrorHandler),
+        "PotimErrorHandler": (PotimErrorHandler, IncrementalPotimErrorHandler),
+        "PositiveEnergyErrorHandler": (PositiveEnergyErrorHandler, IncrementalPositiveEnergyErrorHandler),
+    }
+
+
+def get_synthetic_poll(poll, nlines, nscf=40):
+    """
+    The lines VASP appends to OSZICAR, vasp.out and std_err.txt between two
+    polls: nlines electronic steps, with an ionic step every nscf of them.
+    """
+    oszicar = []
+    for i in range(poll * nlines, (poll + 1) * nlines):
+        n = i % nscf + 1
+        oszicar.append("DAV: {:3d}    -0.{:012d}E+03   -0.{:05d}E-{:02d}   -0.12345E-04  1200   0.123E-01\n".format(
+            n, i, i % 99999, n))
+        if n == nscf:
+            oszicar.append("{:4d} F= -.10809502E+03 E0= -.10809174E+03  d E =-.{:06d}E-02  mag=     2.0000\n".format(
+                i // nscf + 1, i % 999999))
+    return {"OSZICAR": oszicar, "vasp.out": oszicar, "std_err.txt": ["rank 0: running\n"]}
+
+
+def benchmark_handlers(sizes, repeat=3, npolls=200, nlines=20):
+    from pymatgen.io.vasp.sets import MPStaticSet
+
+    results = []
+    cwd = os.getcwd()
+    for size in sizes:
+        structure = get_synthetic_structure(size)
+        work_dir = tempfile.mkdtemp(prefix="benchmark_handlers_")
+        os.chdir(work_dir)
+        try:
+            MPStaticSet(structure, user_incar_settings={"NELM": 60}).write_input(".")
+            for name, variants in get_handler_pairs().items():
+                for handler_cls in variants:
+                    times, peaks = [], []
+                    for _ in range(repeat):
+                        for fname in ("OSZICAR", "vasp.out", "std_err.txt"):
+                            open(fname, "w").close()
+                        handler = handler_cls()
+                        t = 0
+                        tracemalloc.start()
+                        for poll in range(npolls):
+                            for fname, lines in get_synthetic_poll(poll, nlines).items():
+                                with open(fname, "a") as f:
+                                    f.writelines(lines)
+                            t0 = time.perf_counter()
+                            handler.check()
+                            t += time.perf_counter() - t0
+                        peaks.append(tracemalloc.get_traced_memory()[1])
+                        tracemalloc.stop()
+                        times.append(t)
+                    t = float(np.median(times))
+                    results.append({"benchmark": "handlers", "name": handler_cls.__name__, "handler": name,
+                                    "nsites": len(structure), "npolls": npolls, "time": t,
+                                    "throughput": npolls / t if t else None, "peak_mb": max(peaks) / 1024 ** 2,
+                                    "oszicar_mb": os.path.getsize("OSZICAR") / 1024 ** 2, "repeat": repeat})
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       universal_newlines=True, stderr=subprocess.DEVNULL).strip()
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+
+def append_history(results, history_file=HISTORY_FILE):
+    entry = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": get_commit(),
+        "host": socket.gethostname(),
+        "python": platform.python_version(),
+        "results": results,
+    }
+    with open(history_file, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+    return entry
+
+
+def run_benchmarks(benchmarks=BENCHMARKS, sizes=(1, 2), repeat=3, backend="mongod", vasprun_files=None,
+                   outcar_files=None, npolls=200):
+    results = []
+    if "builders" in benchmarks:
+        results.extend(benchmark_builders(sizes, repeat))
+    if "powerups" in benchmarks:
+        results.extend(benchmark_powerups(sizes, repeat))
+    if "ingestion" in benchmarks:
+        results.extend(benchmark_ingestion(sizes, repeat, backend=backend))
+    if "parsers" in benchmarks and vasprun_files:
+        results.extend(benchmark_parsers(vasprun_files, repeat))
+    if "parsers" in benchmarks and outcar_files:
+        results.extend(benchmark_outcar_parsers(outcar_files, repeat))
+    if "handlers" in benchmarks:
+        results.extend(benchmark_handlers(sizes, repeat, npolls))
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark workflow builders, powerups and db ingestion.")
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, default=BENCHMARKS)
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1, 2], help="supercell sizes (8 * n^3 - 1 sites)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--mongo", choices=["mongod", "mongomock"], default="mongod")
+    parser.add_argument("--vasprun", nargs="+", default=None, help="vasprun.xml files for the parser benchmark")
+    parser.add_argument("--outcar", nargs="+", default=None, help="OUTCAR files for the parser benchmark")
+    parser.add_argument("--npolls", type=int, default=200, help="custodian polls of the handler benchmark")
+    parser.add_argument("--history", default=HISTORY_FILE)
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.only, args.sizes, args.repeat, args.mongo, args.vasprun, args.outcar,
+                             args.npolls)
+    for r in results:
+        print("{:<10} {:<38} {:>5} sites {:>9.3f} s {:>8.2f}/s {:>9.1f} MB".format(
+            r["benchmark"], r["name"], r["nsites"], r["time"], r["throughput"], r["peak_mb"]))
+    append_history(results, args.history)
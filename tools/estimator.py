@@ -0,0 +1,252 @@
+"""
+Pre-flight memory and wall time estimates for VASP Fireworks.
+
+The estimates follow the scaling of the plane-wave code (bands x plane waves x
+k-points, squared in bands and k-points for exact exchange) with prefactors
+calibrated on the run_stats of finished task docs:
+
+    from my_atomate.tools.estimator import calibrate_from_task_docs, save_calibration
+    save_calibration(calibrate_from_task_docs(db.collection), "estimator.json")
+
+See my_atomate.powerups.set_queue_from_estimate for using them at submission.
+
+"""
+
+import json
+import math
+
+import numpy as np
+
+from pymatgen import Structure
+from pymatgen.io.vasp.inputs import Kpoints
+from pymatgen.io.vasp import sets
+from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
+
+from my_atomate.firetasks.profiling import get_task_name, unwrap_task
+from my_atomate.firetasks.structure_refs import get_input_set
+from my_atomate.firetasks.tuning import get_functional
+
+__author__ = "Jeng-Yuan Tsai"
+__email__ = "tsaie79@gmail.com"
+
+
+# hbar^2 / 2m_e in eV A^2
+HBAR2_2M = 3.80998
+
+COMPLEX = 16
+
+# ionic steps after the first converge in fewer electronic steps
+NSCF_PER_IONIC_STEP = 0.4
+
+DEFAULT_CALIBRATION = {
+    # log(wall time * ranks^c) = a + b * log(cost), per functional
+    "time": {"PBE": [-17.0, 1.0, 0.8], "SCAN": [-16.0, 1.0, 0.8], "HSE": [-19.0, 1.0, 0.8]},
+    # measured / modelled memory per rank
+    "memory_factor": 1.0,
+    "memory_overhead_gb": 0.3,
+}
+
+
+def get_nplw(volume, encut):
+    """
+    Plane waves per k-point inside the ENCUT sphere.
+    """
+    kmax = math.sqrt(encut / HBAR2_2M)
+    return volume * kmax ** 3 / (6 * math.pi ** 2)
+
+
+def get_default_nbands(nelect, nsites, soc=False):
+    nbands = max(int(math.ceil(nelect / 2 + nsites / 2)), int(math.ceil(nelect * 0.6)))
+    return 2 * nbands if soc else nbands
+
+
+def count_irreducible_kpoints(structure, kpoints, isym=None):
+    if kpoints.style in (Kpoints.supported_modes.Gamma, Kpoints.supported_modes.Monkhorst):
+        if isym in (0, -1):
+            return int(np.prod(kpoints.kpts[0]))
+        shift = kpoints.kpts_shift if kpoints.style == Kpoints.supported_modes.Monkhorst else (0, 0, 0)
+        return len(SpacegroupAnalyzer(structure, symprec=0.1).get_ir_reciprocal_mesh(kpoints.kpts[0], shift))
+    # zero-weight k-points cost as much as weighted ones
+    return len(kpoints.kpts)
+
+
+def get_fw_vasp_params(fw, structure):
+    """
+    The INCAR settings and k-point count a VASP Firework will run with, as far
+    as they can be known before it runs: the input set of WriteVaspFromIOSet(Ref) or
+    the user_incar_settings of a *FromPrev writer, updated by every ModifyIncar
+    and k-point writer in task order. env_chk values are ignored.
+
+    Returns:
+        dict: {"incar": dict, "nkpts": int, "soc": bool}
+    """
+    incar, kpoints, soc = {}, None, False
+    for t in fw.tasks:
+        t = unwrap_task(t)
+        name = get_task_name(t)
+        if name == "WriteVaspFromIOSet":
+            vis = t["vasp_input_set"]
+            if isinstance(vis, str):
+                vis = getattr(sets, vis)(structure, **t.get("vasp_input_params", {}))
+            incar.update(vis.incar)
+            kpoints = vis.kpoints
+        elif name == "WriteVaspFromIOSetRef":
+            vis = get_input_set(structure, t["vasp_input_set"], t.get("vasp_input_params"))
+            incar.update(vis.incar)
+            kpoints = vis.kpoints
+        elif name in ("WriteVaspHSEBSFromPrev", "JWriteScanVaspStaticFromPrev", "JWriteMVLGWFromPrev"):
+            incar.update(t.get("other_params", {}).get("user_incar_settings", {}))
+            if name == "WriteVaspHSEBSFromPrev":
+                incar.setdefault("LHFCALC", True)
+        elif name == "WriteVaspSOCFromPrev":
+            soc = True
+        elif name == "ModifyIncar" and isinstance(t.get("incar_update"), dict):
+            incar.update({k: v for k, v in t["incar_update"].items()
+                          if not (isinstance(v, str) and v.startswith(">>"))})
+        elif name == "WriteVaspFromPMGObjects" and t.get("kpoints"):
+            kpoints = t["kpoints"] if isinstance(t["kpoints"], Kpoints) else Kpoints.from_dict(t["kpoints"])
+        elif "RunVasp" in name and "ncl" in str(t.get("vasp_cmd", "")):
+            soc = True
+
+    soc = soc or bool(incar.get("LSORBIT"))
+    kpoints = kpoints or sets.MPRelaxSet(structure).kpoints
+    nkpts = count_irreducible_kpoints(structure, kpoints, 0 if soc else incar.get("ISYM"))
+    return {"incar": incar, "nkpts": nkpts, "soc": soc}
+
+
+def get_cost(nsites, volume, nelect, encut, nkpts, nbands=None, ispin=1, soc=False, hf=False):
+    """
+    Cost proxy of one SCF cycle and the modelled bytes of the wavefunctions.
+    """
+    nplw = get_nplw(volume, encut)
+    nbands = nbands or get_default_nbands(nelect, nsites, soc)
+    nspinor = 2 if soc else ispin
+    fft = nplw * math.log(nplw)
+    cost = nkpts * nspinor * nbands * fft
+    if hf:
+        # every occupied band at every k-point acts on every band at every k-point
+        cost *= nkpts * nelect / 2
+    wfn_bytes = nkpts * nspinor * nbands * nplw * COMPLEX
+    return {"cost": cost, "wfn_bytes": wfn_bytes, "nplw": nplw, "nbands": nbands}
+
+
+def estimate_run(structure, incar, nkpts, nranks, ncore=None, kpar=None, soc=False, calibration=None, nelect=None):
+    """
+    Estimate memory per rank and wall time of a VASP run.
+
+    Args:
+        structure (Structure)
+        incar (dict): INCAR settings (ENCUT, NBANDS, NELECT, ISPIN, LHFCALC, NSW, ...)
+        nkpts (int): irreducible k-points
+        nranks (int): MPI ranks
+        ncore, kpar (int): parallel layout; default to the INCAR or 1
+        soc (bool): noncollinear run
+        calibration (dict): see calibrate_from_task_docs. Defaults to DEFAULT_CALIBRATION.
+        nelect (float): number of electrons when INCAR has no NELECT. Defaults to 8 per site.
+
+    Returns:
+        dict: {"mem_per_rank_gb", "walltime_s", "functional", "cost", "nbands", "nplw"}
+    """
+    calibration = calibration or DEFAULT_CALIBRATION
+    kpar = int(kpar or incar.get("KPAR", 1))
+    ncore = int(ncore or incar.get("NCORE", 1))
+    hf = bool(incar.get("LHFCALC"))
+    nelect = incar.get("NELECT") or nelect or 8 * len(structure)
+    c = get_cost(len(structure), structure.volume, nelect, incar.get("ENCUT", 520), nkpts,
+                 incar.get("NBANDS"), incar.get("ISPIN", 1), soc, hf)
+
+    ranks_per_group = max(nranks // kpar, 1)
+    # Davidson keeps ~3 copies of the bands; exact exchange keeps every k-point in every group
+    wfn = 3 * c["wfn_bytes"] * math.ceil(nkpts / kpar) / nkpts / ranks_per_group
+    if hf:
+        wfn += c["wfn_bytes"] / ranks_per_group
+    # charge densities and FFT work arrays are replicated NCORE-fold less
+    grid = 8 * c["nplw"] / (math.pi / 6) * COMPLEX * 10 / max(ranks_per_group // ncore, 1) * ncore
+    mem = calibration["memory_overhead_gb"] + calibration["memory_factor"] * (wfn + grid) / 1024 ** 3
+
+    # SOC is already in the cost, the prefactors are per functional only
+    functional = get_functional(incar).replace("_soc", "")
+    a, b, exp_ranks = calibration["time"].get(functional, calibration["time"]["PBE"])
+    nionic = max(int(incar.get("NSW", 0)), 1) if incar.get("IBRION", -1) != -1 else 1
+    nscf = 1 + NSCF_PER_IONIC_STEP * (nionic - 1)
+    walltime = math.exp(a) * c["cost"] ** b * nscf / nranks ** exp_ranks
+    return {"mem_per_rank_gb": mem, "walltime_s": walltime, "functional": functional,
+            "cost": c["cost"], "nbands": c["nbands"], "nplw": c["nplw"]}
+
+
+def get_task_doc_features(doc, calibration=None):
+    """
+    Features and measured wall time/memory of a finished atomate task doc, or
+    None if the doc has no run_stats.
+    """
+    stats = doc.get("run_stats", {}).get("overall") or {}
+    if not stats.get("Elapsed time (sec)") or not stats.get("cores"):
+        return None
+    calc = doc["calcs_reversed"][0]
+    incar = dict(doc["input"]["incar"])
+    params = doc["input"].get("parameters", {})
+    incar.update({k: params[k] for k in ("NBANDS", "ISPIN", "NELECT", "ENCUT") if k in params})
+    nkpts = len(calc["input"]["kpoints"].get("actual_points", [])) or 1
+    nranks = int(stats["cores"])
+    nionic = len(calc["output"].get("ionic_steps", [])) or 1
+
+    structure = Structure.from_dict(doc["input"]["structure"])
+    estimate = estimate_run(structure, incar, nkpts, nranks, soc=bool(incar.get("LSORBIT")),
+                            calibration=calibration)
+    return {
+        "functional": estimate["functional"],
+        "cost": estimate["cost"],
+        "nscf": 1 + NSCF_PER_IONIC_STEP * (nionic - 1),
+        "nranks": nranks,
+        "modelled_mem_gb": estimate["mem_per_rank_gb"],
+        "walltime_s": float(stats["Elapsed time (sec)"]),
+        # OUTCAR reports the memory of one rank
+        "mem_gb": float(stats.get("Maximum memory used (kb)", 0)) / 1024 ** 2,
+    }
+
+
+def calibrate_from_task_docs(collection, query=None, min_docs=5):
+    """
+    Fit the wall time prefactors per functional and the memory factor to the
+    run_stats of the task docs matching query.
+
+    Args:
+        collection: pymongo collection of atomate task docs
+        query (dict): e.g. {"task_label": {"$regex": "HSE"}}
+        min_docs (int): functionals with fewer docs keep the default prefactors
+
+    Returns:
+        dict: calibration for estimate_run
+    """
+    proj = {"run_stats": 1, "input.incar": 1, "input.parameters": 1, "input.structure": 1,
+            "calcs_reversed.input.kpoints.actual_points": 1, "calcs_reversed.output.ionic_steps.e_wo_entrp": 1}
+    features = [f for f in (get_task_doc_features(d, DEFAULT_CALIBRATION)
+                            for d in collection.find(query or {}, proj)) if f]
+
+    calibration = json.loads(json.dumps(DEFAULT_CALIBRATION))
+    for functional in calibration["time"]:
+        fs = [f for f in features if f["functional"] == functional]
+        if len(fs) < min_docs:
+            continue
+        x = np.array([[1.0, math.log(f["cost"]), -math.log(f["nranks"])] for f in fs])
+        y = np.array([math.log(f["walltime_s"] / f["nscf"]) for f in fs])
+        calibration["time"][functional] = [float(c) for c in np.linalg.lstsq(x, y, rcond=None)[0]]
+
+    overhead = DEFAULT_CALIBRATION["memory_overhead_gb"]
+    ratios = [(f["mem_gb"] - overhead) / max(f["modelled_mem_gb"] - overhead, 1e-3) for f in features if f["mem_gb"]]
+    if len(ratios) >= min_docs:
+        calibration["memory_factor"] = float(np.median(ratios))
+    calibration["ndocs"] = len(features)
+    return calibration
+
+
+def save_calibration(calibration, filename):
+    with open(filename, "w") as f:
+        json.dump(calibration, f, indent=4)
+
+
+def load_calibration(filename=None):
+    if not filename:
+        return DEFAULT_CALIBRATION
+    with open(filename) as f:
+        return json.load(f)
@@ -0,0 +1,101 @@
+"""
+Import-time guard for the firetask modules.
+
+Deserializing a FW imports the modules of all its tasks, so these modules have
+to stay light: heavy dependencies belong in run_task. Every module is imported
+in a fresh interpreter with -X importtime; the script fails if a module takes
+longer than its threshold or pulls in one of HEAVY_MODULES.
+
+    python -m my_atomate.tools.import_benchmark --repeat 3
+
+"""
+
+import re
+import subprocess
+import sys
+
+import numpy as np
+
+__author__ = "Jeng-Yuan Tsai"
+__email__ = "tsaie79@gmail.com"
+
+
+# module: threshold of the cumulative import time in seconds
+LIGHT_MODULES = {
+    "my_atomate.firetasks.firetasks": 1.5,
+    "my_atomate.firetasks.pytopomat": 1.5,
+    "my_atomate.firetasks.pyzfs": 1.5,
+    "my_atomate.firetasks.gw_planner": 0.1,
+    "my_atomate.firetasks.tuning": 1.5,
+    "my_atomate.firetasks.profiling": 1.0,
+    "my_atomate.firetasks.structure_refs": 1.0,
+    "my_atomate.firetasks.calc_summary": 1.0,
+    "my_atomate.firetasks.parsers": 1.0,
+    "my_atomate.firetasks.handlers": 1.5,
+}
+
+HEAVY_MODULES = [
+    "pytopomat",
+    "z2pack",
+    "spglib",
+    "pymatgen.io.vasp.sets",
+    "pymatgen.symmetry.analyzer",
+    "pymatgen.symmetry.bandstructure",
+    "atomate.vasp.database",
+]
+
+IMPORTTIME_PATTERN = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s+(\S+)")
+
+
+def measure_import(module):
+    """
+    Cumulative import time of module in a fresh interpreter and the heavy
+    modules it imported.
+
+    Returns:
+        dict: {"module", "time", "heavy": [str]}
+    """
+    code = "import sys, {0}; print(','.join(m for m in {1} if m in sys.modules))".format(module, HEAVY_MODULES)
+    p = subprocess.run([sys.executable, "-X", "importtime", "-c", code], stdout=subprocess.PIPE,
+                       stderr=subprocess.PIPE, universal_newlines=True)
+    if p.returncode:
+        raise RuntimeError("Cannot import {}:\n{}".format(module, p.stderr[-2000:]))
+    cumulative = 0
+    for line in p.stderr.splitlines():
+        m = IMPORTTIME_PATTERN.search(line)
+        if m and m.group(3) == module:
+            cumulative = int(m.group(2)) / 1e6
+    heavy = [m for m in p.stdout.strip().split(",") if m]
+    return {"module": module, "time": cumulative, "heavy": heavy}
+
+
+def run_benchmark(modules=None, repeat=3):
+    """
+    Returns:
+        [dict]: {"module", "time" (median), "threshold", "heavy", "ok"} per module
+    """
+    modules = modules or LIGHT_MODULES
+    results = []
+    for module, threshold in modules.items():
+        runs = [measure_import(module) for _ in range(repeat)]
+        t = float(np.median([r["time"] for r in runs]))
+        heavy = runs[-1]["heavy"]
+        results.append({"module": module, "time": t, "threshold": threshold, "heavy": heavy,
+                        "ok": t <= threshold and not heavy})
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Fail if a firetask module imports slowly or heavily.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply every threshold, e.g. on slow nodes")
+    args = parser.parse_args()
+
+    results = run_benchmark({m: t * args.scale for m, t in LIGHT_MODULES.items()}, args.repeat)
+    for r in results:
+        print("{:<36} {:>7.3f} s (max {:.2f} s) {:<4} {}".format(
+            r["module"], r["time"], r["threshold"], "ok" if r["ok"] else "FAIL",
+            "imports " + ", ".join(r["heavy"]) if r["heavy"] else ""))
+    sys.exit(0 if all(r["ok"] for r in results) else 1)
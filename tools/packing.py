@@ -0,0 +1,182 @@
+"""
+Run many small READY FWs of a category side by side inside one allocation.
+
+The cores of the allocation are split by the spec._ncores of each FW (default
+1). Every FW runs in its own rlaunch singleshot process with its own fworker
+file, whose env has ncores and vasp_cmd filled for that FW, so a crash of one
+FW leaves the others running and each FW reports to the LaunchPad on its own.
+Freed cores are backfilled with more FWs until the queue of the category is
+empty or the time budget is used up.
+
+    python -m my_atomate.tools.packing -l my_launchpad.yaml -w my_fworker.yaml -c small -n 64 \
+        --vasp_cmd "srun -n {ncores} vasp_gam"
+
+The packed FWs are picked by _priority; the checkout itself is done by rlaunch,
+so a FW taken by another launcher in between is reported as not run.
+
+"""
+
+import os
+import subprocess
+import time
+from copy import deepcopy
+
+from fireworks import FWorker
+
+from atomate.utils.utils import get_logger
+
+__author__ = "Jeng-Yuan Tsai"
+__email__ = "tsaie79@gmail.com"
+
+
+logger = get_logger(__name__)
+
+POLL_INTERVAL = 10
+
+
+def get_ready_fws(lpad, fworker, exclude=(), limit=100):
+    """
+    READY FWs the fworker may run, by _priority.
+
+    Returns:
+        [dict]: {"fw_id", "name", "ncores"}
+    """
+    query = dict(fworker.query)
+    query["state"] = "READY"
+    if exclude:
+        query["fw_id"] = {"$nin": list(exclude)}
+    docs = lpad.fireworks.find(query, {"fw_id": 1, "name": 1, "spec._ncores": 1}).sort(
+        [("spec._priority", -1), ("created_on", 1)]).limit(limit)
+    return [{"fw_id": d["fw_id"], "name": d["name"], "ncores": int(d["spec"].get("_ncores") or 1)} for d in docs]
+
+
+def write_slot_fworker(fworker, slot_dir, ncores, vasp_cmd_template=None):
+    """
+    The fworker file of one slot: the env of fworker with ncores set and
+    vasp_cmd formatted with it. The name stays the one of fworker, so FWs
+    pinned to it (preserve_fworker) run in the slots and pin their children
+    to a worker that exists.
+    """
+    env = dict(fworker.env)
+    env["ncores"] = ncores
+    if vasp_cmd_template:
+        env["vasp_cmd"] = vasp_cmd_template.format(ncores=ncores)
+    slot = deepcopy(fworker)
+    slot.env = env
+    filename = os.path.join(slot_dir, "my_fworker.yaml")
+    slot.to_file(filename)
+    return filename
+
+
+def start_fw(fw, fworker, pack_dir, launchpad_file=None, vasp_cmd_template=None):
+    slot_dir = os.path.join(pack_dir, "fw_{}".format(fw["fw_id"]))
+    os.makedirs(slot_dir, exist_ok=True)
+    cmd = ["rlaunch"]
+    if launchpad_file:
+        cmd += ["-l", os.path.abspath(launchpad_file)]
+    cmd += ["-w", write_slot_fworker(fworker, slot_dir, fw["ncores"], vasp_cmd_template),
+            "singleshot", "-f", str(fw["fw_id"])]
+    log = open(os.path.join(slot_dir, "rlaunch.log"), "w")
+    process = subprocess.Popen(cmd, cwd=slot_dir, stdout=log, stderr=subprocess.STDOUT)
+    logger.info("started fw_id {} ({}) on {} cores".format(fw["fw_id"], fw["name"], fw["ncores"]))
+    return dict(fw, process=process, log=log, start=time.time(), slot_dir=slot_dir)
+
+
+def pack_launch(lpad, fworker, ncores, launchpad_file=None, vasp_cmd_template=None, max_fws=None, backfill=True,
+                time_budget_s=None, pack_dir="."):
+    """
+    Run READY FWs of the fworker concurrently on ncores cores.
+
+    Args:
+        lpad (LaunchPad)
+        fworker (FWorker): base fworker; its category and query select the FWs
+        ncores (int): cores of the allocation
+        launchpad_file (str): passed to rlaunch, which otherwise auto-loads the LaunchPad
+        vasp_cmd_template (str): e.g. "srun -n {ncores} vasp_gam", sets vasp_cmd of every slot
+        max_fws (int): stop claiming after this many FWs
+        backfill (bool): start new FWs on freed cores
+        time_budget_s (float): do not start FWs after this many seconds
+        pack_dir (str): the launch dirs go to pack_dir/fw_<fw_id>
+
+    Returns:
+        [dict]: {"fw_id", "name", "ncores", "returncode", "state", "wall_time"} per FW
+    """
+    t0 = time.time()
+    running, results, tried = [], [], set()
+    free = ncores
+    claiming = True
+
+    while True:
+        if claiming:
+            for fw in get_ready_fws(lpad, fworker, exclude=tried):
+                if max_fws and len(tried) >= max_fws:
+                    break
+                if time_budget_s and time.time() - t0 > time_budget_s:
+                    break
+                if fw["ncores"] > ncores:
+                    logger.warning("fw_id {} needs {} cores, more than the allocation".format(fw["fw_id"],
+                                                                                              fw["ncores"]))
+                    tried.add(fw["fw_id"])
+                    continue
+                if fw["ncores"] <= free:
+                    tried.add(fw["fw_id"])
+                    running.append(start_fw(fw, fworker, pack_dir, launchpad_file, vasp_cmd_template))
+                    free -= fw["ncores"]
+            claiming = backfill
+
+        if not running:
+            break
+        time.sleep(POLL_INTERVAL)
+        for r in [r for r in running if r["process"].poll() is not None]:
+            running.remove(r)
+            r["log"].close()
+            free += r["ncores"]
+            state = lpad.fireworks.find_one({"fw_id": r["fw_id"]}, {"state": 1})["state"]
+            results.append({"fw_id": r["fw_id"], "name": r["name"], "ncores": r["ncores"],
+                            "returncode": r["process"].returncode, "state": state,
+                            "wall_time": time.time() - r["start"]})
+            logger.info("fw_id {} finished: {} (rlaunch exit {})".format(r["fw_id"], state,
+                                                                         r["process"].returncode))
+        if not running and not get_ready_fws(lpad, fworker, exclude=tried, limit=1):
+            claiming = False
+
+    return results
+
+
+def print_pack_summary(results, ncores, elapsed):
+    busy = sum(r["ncores"] * r["wall_time"] for r in results)
+    states = {}
+    for r in results:
+        states[r["state"]] = states.get(r["state"], 0) + 1
+    print("{} FWs in {:.0f} s, {:.0f}% core utilization, {}".format(
+        len(results), elapsed, 100 * busy / max(ncores * elapsed, 1),
+        ", ".join("{} {}".format(n, s) for s, n in sorted(states.items()))))
+    for r in results:
+        print("  {:>7} {:<48} {:>4} cores {:>8.0f} s  {}".format(r["fw_id"], r["name"], r["ncores"],
+                                                                 r["wall_time"], r["state"]))
+
+
+if __name__ == "__main__":
+    import argparse
+    from fireworks import LaunchPad
+
+    parser = argparse.ArgumentParser(description="Run many small FWs of a category in one allocation.")
+    parser.add_argument("-l", "--launchpad_file", default=None)
+    parser.add_argument("-w", "--fworker_file", default=None)
+    parser.add_argument("-c", "--category", default=None, help="overrides the category of the fworker")
+    parser.add_argument("-n", "--ncores", type=int, required=True, help="cores of the allocation")
+    parser.add_argument("--vasp_cmd", default=None, help='vasp_cmd template, e.g. "srun -n {ncores} vasp_gam"')
+    parser.add_argument("--max_fws", type=int, default=None)
+    parser.add_argument("--no_backfill", action="store_true")
+    parser.add_argument("--time_budget", type=float, default=None, help="seconds after which no FW is started")
+    parser.add_argument("--pack_dir", default=".")
+    args = parser.parse_args()
+
+    lpad = LaunchPad.from_file(args.launchpad_file) if args.launchpad_file else LaunchPad.auto_load()
+    fworker = FWorker.from_file(args.fworker_file) if args.fworker_file else FWorker.auto_load()
+    if args.category:
+        fworker.category = args.category
+    t_start = time.time()
+    results = pack_launch(lpad, fworker, args.ncores, args.launchpad_file, args.vasp_cmd, args.max_fws,
+                          not args.no_backfill, args.time_budget, args.pack_dir)
+    print_pack_summary(results, args.ncores, time.time() - t_start)
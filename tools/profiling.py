@@ -0,0 +1,85 @@
+"""
+Aggregate the ProfiledTask records of a campaign per task type.
+
+    python -m my_atomate.tools.profiling -l my_launchpad.yaml -q '{"name": {"$regex": "HSE"}}'
+
+"""
+
+import json
+
+import numpy as np
+
+__author__ = "Jeng-Yuan Tsai"
+__email__ = "tsaie79@gmail.com"
+
+
+METRICS = ["wall_time", "cpu_time", "bytes_read", "bytes_written", "peak_rss", "peak_rss_children", "nfiles_created"]
+
+
+def get_profiling_records(lpad, query=None):
+    """
+    All profiling records stored in the launches of the FWs matching query.
+
+    Args:
+        lpad (LaunchPad)
+        query (dict): query on the fireworks collection
+
+    Returns:
+        [dict]: records, each with the fw_id and fw name added
+    """
+    fws = {d["fw_id"]: d["name"] for d in lpad.fireworks.find(query or {}, {"fw_id": 1, "name": 1})}
+    records = []
+    for launch in lpad.launches.find(
+            {"fw_id": {"$in": list(fws)}, "action.stored_data.profiling": {"$exists": True}},
+            {"fw_id": 1, "action.stored_data.profiling": 1}):
+        for record in launch["action"]["stored_data"]["profiling"]:
+            records.append(dict(record, fw_id=launch["fw_id"], fw_name=fws[launch["fw_id"]]))
+    return records
+
+
+def aggregate_profiling(records):
+    """
+    Returns:
+        dict: {task: {"count": int, metric: {"total", "mean", "median", "max"}}}
+    """
+    tasks = {}
+    for record in records:
+        tasks.setdefault(record["task"], []).append(record)
+
+    report = {}
+    for task, rs in tasks.items():
+        report[task] = {"count": len(rs), "failed": sum(1 for r in rs if r.get("failed"))}
+        for metric in METRICS:
+            values = np.array([r.get(metric, 0) for r in rs], dtype=float)
+            report[task][metric] = {"total": values.sum(), "mean": values.mean(),
+                                    "median": float(np.median(values)), "max": values.max()}
+    return report
+
+
+def print_profiling_report(report):
+    total_wall = sum(r["wall_time"]["total"] for r in report.values()) or 1
+    print("{:<32} {:>6} {:>12} {:>7} {:>12} {:>12} {:>10} {:>10}".format(
+        "task", "count", "wall [h]", "wall %", "mean wall [s]", "mean cpu [s]", "read [GB]", "write [GB]"))
+    for task, r in sorted(report.items(), key=lambda x: -x[1]["wall_time"]["total"]):
+        print("{:<32} {:>6} {:>12.2f} {:>7.1f} {:>12.1f} {:>12.1f} {:>10.2f} {:>10.2f}".format(
+            task, r["count"], r["wall_time"]["total"] / 3600, 100 * r["wall_time"]["total"] / total_wall,
+            r["wall_time"]["mean"], r["cpu_time"]["mean"], r["bytes_read"]["total"] / 1024 ** 3,
+            r["bytes_written"]["total"] / 1024 ** 3))
+
+
+if __name__ == "__main__":
+    import argparse
+    from fireworks import LaunchPad
+
+    parser = argparse.ArgumentParser(description="Report firetask profiling per task type.")
+    parser.add_argument("-l", "--launchpad_file", default=None)
+    parser.add_argument("-q", "--query", default="{}", help="query on the fireworks collection (json)")
+    parser.add_argument("--json", action="store_true", help="print the report as json")
+    args = parser.parse_args()
+
+    lpad = LaunchPad.from_file(args.launchpad_file) if args.launchpad_file else LaunchPad.auto_load()
+    report = aggregate_profiling(get_profiling_records(lpad, json.loads(args.query)))
+    if args.json:
+        print(json.dumps(report, indent=4, default=float))
+    else:
+        print_profiling_report(report)
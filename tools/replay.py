@@ -0,0 +1,225 @@
+"""
+Replay harness: run a whole workflow with recorded VASP outputs.
+
+Every RunVasp* task of the workflow is replaced by atomate's RunVaspFake
+(use_fake_vasp), which copies the outputs of a reference calculation instead
+of running VASP, and every task is profiled (add_profiling). The DAG then
+runs with rapidfire against a LaunchPad and a calculation db on a throwaway
+mongod, so what is measured is the orchestration around VASP: input writing,
+copying, parsing and db insertion.
+
+Record reference outputs from a finished workflow:
+
+    python -m my_atomate.tools.replay record -l my_launchpad.yaml -f 1234 -o refs/
+
+and replay a workflow configuration (see my_atomate.tools.audit) with them:
+
+    python -m my_atomate.tools.replay run wf_config.json refs/ref_dirs.json
+
+"""
+
+import contextlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from my_atomate.firetasks.staging import decompress_copy, get_compressed_extension
+from my_atomate.tools.audit import build_workflow
+from my_atomate.tools.benchmark import throwaway_db
+from my_atomate.tools.profiling import get_profiling_records
+
+__author__ = "Jeng-Yuan Tsai"
+__email__ = "tsaie79@gmail.com"
+
+
+INPUT_FILES = ["INCAR", "KPOINTS", "POSCAR", "POTCAR"]
+
+# everything the workflows resolve with env_chk
+DEFAULT_ENV = {
+    "vasp_cmd": "fake_vasp",
+    "vasp_ncl": "fake_vasp",
+    "gamma_vasp_cmd": "fake_vasp",
+    "ncores": 16,
+    "auto_npar": False,
+    "scratch_dir": None,
+    "twod_kpoints_update": None,
+}
+
+
+def record_reference(launch_dir, ref_dir):
+    """
+    Copy a finished VASP launch dir into the inputs/outputs layout of RunVaspFake.
+    """
+    inputs, outputs = os.path.join(ref_dir, "inputs"), os.path.join(ref_dir, "outputs")
+    os.makedirs(inputs, exist_ok=True)
+    os.makedirs(outputs, exist_ok=True)
+    for f in os.listdir(launch_dir):
+        src = os.path.join(launch_dir, f)
+        if not os.path.isfile(src):
+            continue
+        shutil.copy2(src, os.path.join(outputs, f))
+        # custodian may have changed the inputs; the .orig files are what the FW wrote
+        ext = get_compressed_extension(f)
+        name = f[:-len(ext)] if ext else f
+        is_orig = name.endswith(".orig")
+        name = name[:-len(".orig")] if is_orig else name
+        has_orig = any(g.startswith(name + ".orig") for g in os.listdir(launch_dir))
+        if name in INPUT_FILES and (is_orig or not has_orig):
+            decompress_copy(src, os.path.join(inputs, name))
+
+
+def record_wf_references(lpad, fw_id, ref_root):
+    """
+    Record the last launch of every VASP FW of the workflow of fw_id.
+
+    Returns:
+        dict: {fw name: ref_dir}, the ref_dirs of use_fake_vasp; also written
+            to ref_root/ref_dirs.json
+    """
+    wf = lpad.get_wf_by_fw_id_lzyfw(fw_id)
+    ref_dirs = {}
+    for fw in wf.fws:
+        if fw.state != "COMPLETED" or not any("RunVasp" in t._fw_name for t in fw.tasks):
+            continue
+        launch_dir = fw.launches[-1].launch_dir
+        # FW names start with the formula, the stage follows
+        stage = fw.name.split("-", 1)[-1]
+        ref_dir = os.path.abspath(os.path.join(ref_root, stage))
+        if stage not in ref_dirs:
+            record_reference(launch_dir, ref_dir)
+            ref_dirs[stage] = ref_dir
+    with open(os.path.join(ref_root, "ref_dirs.json"), "w") as f:
+        json.dump(ref_dirs, f, indent=4)
+    return ref_dirs
+
+
+def get_stage_report(lpad, records):
+    """
+    Per FW: wall time of the launch, of every task and of the rocket around them.
+    """
+    runtimes = {d["fw_id"]: d.get("runtime_secs") or 0
+                for d in lpad.launches.find({}, {"fw_id": 1, "runtime_secs": 1})}
+    stages = {}
+    for r in records:
+        stage = stages.setdefault(r["fw_id"], {"fw_id": r["fw_id"], "name": r["fw_name"], "tasks": {},
+                                               "launch_time": runtimes.get(r["fw_id"], 0)})
+        stage["tasks"][r["task"]] = stage["tasks"].get(r["task"], 0) + r["wall_time"]
+    for stage in stages.values():
+        tasks_time = sum(stage["tasks"].values())
+        stage["fake_vasp_time"] = sum(t for name, t in stage["tasks"].items() if "RunVasp" in name)
+        stage["orchestration_time"] = tasks_time - stage["fake_vasp_time"]
+        stage["rocket_overhead"] = max(stage["launch_time"] - tasks_time, 0)
+    return sorted(stages.values(), key=lambda s: s["fw_id"])
+
+
+def replay_workflow(wf, ref_dirs, env=None, check_inputs=False, launch_root=None, backend="mongod"):
+    """
+    Run wf with the reference outputs of ref_dirs on a throwaway LaunchPad and db.
+
+    Args:
+        wf (Workflow)
+        ref_dirs (dict): {fw name substring: ref_dir} as for use_fake_vasp
+        env (dict): fworker env on top of DEFAULT_ENV
+        check_inputs (bool): let RunVaspFake compare INCAR/KPOINTS/POSCAR/POTCAR with the reference
+        launch_root (str): launch dirs; a temporary dir that is removed afterwards if None
+        backend (str): "mongod" or "mongomock", see my_atomate.tools.benchmark.throwaway_db
+
+    Returns:
+        dict: {"name", "wall_time", "states", "stages": [...]}
+    """
+    from fireworks import FWorker, LaunchPad
+    from fireworks.core.rocket_launcher import rapidfire
+    from atomate.vasp.powerups import use_fake_vasp
+    from my_atomate.powerups import add_profiling
+
+    wf = use_fake_vasp(wf, ref_dirs, check_incar=check_inputs, check_kpoints=check_inputs,
+                       check_poscar=check_inputs, check_potcar=check_inputs)
+    wf = add_profiling(wf)
+
+    cwd = os.getcwd()
+    tmp_root = None if launch_root else tempfile.mkdtemp(prefix="replay_")
+    launch_root = os.path.abspath(launch_root or tmp_root)
+    os.makedirs(launch_root, exist_ok=True)
+    try:
+        with throwaway_db(backend) as db_file:
+            with open(db_file) as f:
+                db = json.load(f)
+            lpad = LaunchPad(host=db["host"], port=db["port"], name="replay")
+            lpad.reset("", require_password=False)
+            lpad.add_wf(wf)
+            fworker = FWorker(name="replay", env=dict(DEFAULT_ENV, db_file=db_file, **(env or {})))
+
+            os.chdir(launch_root)
+            t0 = time.time()
+            rapidfire(lpad, fworker, nlaunches=0, strm_lvl="WARNING")
+            wall_time = time.time() - t0
+
+            states = {}
+            for d in lpad.fireworks.find({}, {"state": 1}):
+                states[d["state"]] = states.get(d["state"], 0) + 1
+            return {"name": wf.name, "wall_time": wall_time, "states": states,
+                    "stages": get_stage_report(lpad, get_profiling_records(lpad))}
+    finally:
+        os.chdir(cwd)
+        if tmp_root:
+            shutil.rmtree(tmp_root, ignore_errors=True)
+
+
+def print_replay(report):
+    print("{}: {:.1f} s, {}".format(report["name"], report["wall_time"],
+                                    ", ".join("{} {}".format(n, s) for s, n in sorted(report["states"].items()))))
+    print("  {:<48} {:>10} {:>10} {:>12} {:>10}".format("FW", "launch [s]", "VASP [s]", "orchestr. [s]",
+                                                        "rocket [s]"))
+    for s in report["stages"]:
+        print("  {:<48} {:>10.2f} {:>10.2f} {:>12.2f} {:>10.2f}".format(
+            s["name"], s["launch_time"], s["fake_vasp_time"], s["orchestration_time"], s["rocket_overhead"]))
+        for task, t in sorted(s["tasks"].items(), key=lambda x: -x[1]):
+            print("      {:<44} {:>10.2f}".format(task, t))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Replay recorded VASP outputs through a whole workflow.")
+    sub = parser.add_subparsers(dest="command")
+
+    record = sub.add_parser("record", help="record reference outputs of a finished workflow")
+    record.add_argument("-l", "--launchpad_file", default=None)
+    record.add_argument("-f", "--fw_id", type=int, required=True, help="any fw_id of the workflow")
+    record.add_argument("-o", "--ref_root", required=True)
+
+    run = sub.add_parser("run", help="replay a workflow configuration")
+    run.add_argument("config", help="workflow configuration (json), see my_atomate.tools.audit")
+    run.add_argument("ref_dirs", help="{fw name substring: ref_dir} (json)")
+    run.add_argument("--env", default="{}", help="fworker env (json)")
+    run.add_argument("--check_inputs", action="store_true")
+    run.add_argument("--launch_root", default=None)
+    run.add_argument("--mongo", choices=["mongod", "mongomock"], default="mongod")
+    run.add_argument("--json", action="store_true", help="print the report as json")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        from fireworks import LaunchPad
+        lpad = LaunchPad.from_file(args.launchpad_file) if args.launchpad_file else LaunchPad.auto_load()
+        for stage, ref_dir in record_wf_references(lpad, args.fw_id, args.ref_root).items():
+            print("{:<32} {}".format(stage, ref_dir))
+    else:
+        from pymatgen.core.structure import Structure
+        with open(args.config) as f:
+            config = json.load(f)
+        with open(args.ref_dirs) as f:
+            ref_dirs = json.load(f)
+        structure = Structure.from_file(os.path.join(os.path.dirname(os.path.abspath(args.config)),
+                                                     config["structure"]))
+        wf = build_workflow(config, structure)
+        # keep stdout for the report, the launches print as well
+        with contextlib.redirect_stdout(sys.stderr):
+            report = replay_workflow(wf, ref_dirs, json.loads(args.env), args.check_inputs, args.launch_root,
+                                     args.mongo)
+        if args.json:
+            print(json.dumps(report, indent=4))
+        else:
+            print_replay(report)
@@ -0,0 +1,212 @@
+"""
+Shortest-predicted-job-first priorities for a campaign.
+
+Every FW of a workflow gets the same _priority, which falls with the predicted
+core-hours the workflow still has to run, so nearly finished and cheap
+workflows complete first. VASP FWs are predicted by my_atomate.tools.estimator,
+other FWs by the median of past ProfiledTask records of the same task list.
+Optionally, FWs are given a _category by their own predicted cost (e.g. a
+"small" category for my_atomate.tools.packing).
+
+    python -m my_atomate.tools.scheduler -l my_launchpad.yaml -q '{"name": {"$regex": "HSE"}}' \
+        --calibration estimator.json --categories '{"small": 1}'
+
+"""
+
+import math
+
+import numpy as np
+
+from pymongo import UpdateOne
+
+from fireworks import Firework
+
+from pymatgen import Structure
+
+from my_atomate.firetasks.profiling import get_task_name, unwrap_task
+from my_atomate.tools.estimator import get_fw_vasp_params, estimate_run, load_calibration
+from my_atomate.tools.profiling import get_profiling_records
+
+__author__ = "Jeng-Yuan Tsai"
+__email__ = "tsaie79@gmail.com"
+
+
+# core-hours of a FW without an estimate or history
+DEFAULT_COST = 0.1
+
+MAX_PRIORITY = 1000
+
+PENDING_STATES = ["READY", "WAITING"]
+
+
+def get_fw_kind(fw):
+    """
+    The task names of a FW joined by "+", with ProfiledTask wrappers seen through.
+    """
+    return "+".join(get_task_name(t) for t in fw.tasks)
+
+
+def get_fw_ncores(fw, nranks):
+    return int(fw.spec.get("_ncores") or nranks)
+
+
+def get_wf_structure(fws):
+    """
+    The first structure given to a task of the workflow, or None.
+    """
+    for fw in fws:
+        for t in fw.tasks:
+            structure = unwrap_task(t).get("structure")
+            if isinstance(structure, Structure):
+                return structure
+            if isinstance(structure, dict):
+                return Structure.from_dict(structure)
+    return None
+
+
+def get_runtime_history(lpad, query=None):
+    """
+    Median core-hours per FW kind (its list of task names) from the
+    ProfiledTask records of finished FWs.
+
+    Returns:
+        dict: {kind: core-hours}
+    """
+    wall = {}
+    for record in get_profiling_records(lpad, query):
+        wall[record["fw_id"]] = wall.get(record["fw_id"], 0) + record["wall_time"]
+
+    costs = {}
+    for doc in lpad.fireworks.find({"fw_id": {"$in": list(wall)}}, {"fw_id": 1, "spec": 1, "name": 1}):
+        fw = Firework.from_dict(doc)
+        costs.setdefault(get_fw_kind(fw), []).append(wall[doc["fw_id"]] * get_fw_ncores(fw, 1) / 3600)
+    return {kind: float(np.median(c)) for kind, c in costs.items()}
+
+
+def predict_fw_cost(fw, structure, nranks, calibration=None, history=None):
+    """
+    Predicted core-hours of a FW.
+    """
+    kind = get_fw_kind(fw)
+    ncores = get_fw_ncores(fw, nranks)
+    if structure is not None and any("RunVasp" in get_task_name(t) for t in fw.tasks):
+        try:
+            params = get_fw_vasp_params(fw, structure)
+            estimate = estimate_run(structure, params["incar"], params["nkpts"], ncores, soc=params["soc"],
+                                    calibration=calibration)
+            return estimate["walltime_s"] * ncores / 3600
+        except (ValueError, KeyError, TypeError, AttributeError):
+            pass
+    return (history or {}).get(kind, DEFAULT_COST)
+
+
+def get_sjf_priority(core_hours):
+    """
+    Higher for cheaper work, one step per ~2.5% of cost, never below 1.
+    """
+    return max(1, int(round(MAX_PRIORITY - 100 * math.log10(1 + core_hours))))
+
+
+def get_category(core_hours, category_thresholds):
+    """
+    The category with the smallest threshold (core-hours) not below core_hours, or None.
+    """
+    for category, threshold in sorted(category_thresholds.items(), key=lambda x: x[1]):
+        if core_hours <= threshold:
+            return category
+    return None
+
+
+def get_sjf_updates(fws, done_fw_ids, structure, nranks, calibration=None, history=None, category_thresholds=None):
+    """
+    _priority (and _category) updates of the FWs of one workflow.
+
+    Args:
+        fws ([Firework]): all FWs of the workflow
+        done_fw_ids (set): FWs not to count in the remaining cost
+        structure (Structure): structure of the workflow, or None
+
+    Returns:
+        ({fw_id: {"_priority": int[, "_category": str]}}, float): the updates and the remaining core-hours
+    """
+    costs = {fw.fw_id: predict_fw_cost(fw, structure, nranks, calibration, history) for fw in fws}
+    remaining = sum(c for fw_id, c in costs.items() if fw_id not in done_fw_ids)
+    priority = get_sjf_priority(remaining)
+    updates = {}
+    for fw in fws:
+        update = {"_priority": priority}
+        category = get_category(costs[fw.fw_id], category_thresholds) if category_thresholds else None
+        if category:
+            update["_category"] = category
+        updates[fw.fw_id] = update
+    return updates, remaining
+
+
+def reprioritize(lpad, query=None, nranks=16, calibration_file=None, category_thresholds=None, use_history=True,
+                 dry_run=False):
+    """
+    Recompute the priorities of the READY and WAITING FWs of every workflow
+    matching query and write them in one bulk update, e.g. after
+    recalibrating the estimator.
+
+    Args:
+        lpad (LaunchPad)
+        query (dict): query on the workflows collection
+        nranks (int): ranks of FWs without spec._ncores
+        calibration_file (str): see my_atomate.tools.estimator.save_calibration
+        category_thresholds (dict): {category: max core-hours}
+        use_history (bool): predict non-VASP FWs from past profiling records
+        dry_run (bool): only return the updates
+
+    Returns:
+        [dict]: {"fw_id", "name", "remaining", "_priority"[, "_category"]} per updated FW
+    """
+    calibration = load_calibration(calibration_file)
+    history = get_runtime_history(lpad) if use_history else {}
+
+    changes, requests = [], []
+    for wf_doc in lpad.workflows.find(query or {}, {"nodes": 1}):
+        fws = [Firework.from_dict(d) for d in lpad.fireworks.find({"fw_id": {"$in": wf_doc["nodes"]}})]
+        pending = {fw.fw_id for fw in fws if fw.state in PENDING_STATES}
+        if not pending:
+            continue
+        done = {fw.fw_id for fw in fws if fw.state == "COMPLETED"}
+        updates, remaining = get_sjf_updates(fws, done, get_wf_structure(fws), nranks, calibration, history,
+                                             category_thresholds)
+        for fw in fws:
+            if fw.fw_id not in pending:
+                continue
+            update = updates[fw.fw_id]
+            if all(fw.spec.get(k) == v for k, v in update.items()):
+                continue
+            changes.append(dict(update, fw_id=fw.fw_id, name=fw.name, remaining=remaining))
+            requests.append(UpdateOne({"fw_id": fw.fw_id}, {"$set": {"spec." + k: v for k, v in update.items()}}))
+
+    if requests and not dry_run:
+        lpad.fireworks.bulk_write(requests, ordered=False)
+    return changes
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    from fireworks import LaunchPad
+
+    parser = argparse.ArgumentParser(description="Shortest-predicted-job-first priorities for pending FWs.")
+    parser.add_argument("-l", "--launchpad_file", default=None)
+    parser.add_argument("-q", "--query", default="{}", help="query on the workflows collection (json)")
+    parser.add_argument("-n", "--nranks", type=int, default=16, help="ranks of FWs without spec._ncores")
+    parser.add_argument("--calibration", default=None, help="estimator calibration file")
+    parser.add_argument("--categories", default=None, help='{"category": max core-hours} (json)')
+    parser.add_argument("--no_history", action="store_true", help="ignore past profiling records")
+    parser.add_argument("--dry_run", action="store_true")
+    args = parser.parse_args()
+
+    lpad = LaunchPad.from_file(args.launchpad_file) if args.launchpad_file else LaunchPad.auto_load()
+    changes = reprioritize(lpad, json.loads(args.query), args.nranks, args.calibration,
+                           json.loads(args.categories) if args.categories else None, not args.no_history,
+                           args.dry_run)
+    for c in sorted(changes, key=lambda c: -c["_priority"]):
+        print("{:>7} {:<48} {:>10.1f} core-h  priority {:>4}  {}".format(
+            c["fw_id"], c["name"], c["remaining"], c["_priority"], c.get("_category", "")))
+    print("{} FWs {}".format(len(changes), "to update" if args.dry_run else "updated"))
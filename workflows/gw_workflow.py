@@ -7,11 +7,19 @@ from atomate.vasp.powerups import use_fake_vasp, add_namefile, add_additional_fi
     add_modify_incar, add_modify_kpoints, set_queue_options, set_execution_options
 
 from my_atomate.vasp.fireworks import Firework, LaunchPad, Workflow
+from my_atomate.powerups import add_calc_summary
 
 import numpy as np
 
 
-def gw_wf(structure,prev_dir, ncores, nbands_factor, vis_static=None, vasp_input_set_params=None, vasptodb=None, wf_addition_name=None):
+def gw_wf(structure, prev_dir, ncores=">>ncores<<", nbands_factor=5, vis_static=None, vasp_input_set_params=None,
+          vasptodb=None, wf_addition_name=None, plan_parallel=False):
+    """
+    DIAG -> GW -> BSE. With plan_parallel, NBANDS/NCORE/KPAR/NOMEGA are chosen at
+    run time from the parent calculation and the worker's ">>ncores<<" and
+    ">>mem_per_rank_gb<<" (see my_atomate.firetasks.gw_planner); ncores and
+    nbands_factor then only set the defaults of the planner.
+    """
     fws = []
     # 1. STATIC
     # static_fw = StaticFW(
@@ -24,17 +32,20 @@ def gw_wf(structure,prev_dir, ncores, nbands_factor, vis_static=None, vasp_input
     # 2. DIAG
     diag_fw = JMVLGWFW(structure, ncores=ncores, prev_calc_dir=prev_dir, vasp_cmd=">>vasp_ncl<<",
                        vasp_input_set_params={"user_incar_settings": {"LWAVE": True, "LCHARG":False}},
-                       mode="DIAG", name="gw_diag", nbands_factor=nbands_factor)
+                       mode="DIAG", name="gw_diag", nbands_factor=nbands_factor,
+                       plan_parallel=plan_parallel)
 
     # 3. GW
     gw_fw = JMVLGWFW(structure, ncores=ncores, parents=diag_fw, vasp_cmd=">>vasp_ncl<<",
                      vasp_input_set_params={"user_incar_settings": {"LWAVE": True, "LCHARG":False}},
-                     mode="GW", name="gw_gw", nbands_factor=nbands_factor)
+                     mode="GW", name="gw_gw", nbands_factor=nbands_factor,
+                     plan_parallel=plan_parallel)
 
     # 4. BSE
     bse_fw = JMVLGWFW(structure, ncores=ncores, parents=gw_fw, vasp_cmd=">>vasp_ncl<<",
                       vasp_input_set_params={"user_incar_settings": {"LWAVE": False, "LCHARG":False}},
-                      mode="BSE", name="gw_bse", nbands_factor=nbands_factor)
+                      mode="BSE", name="gw_bse", nbands_factor=nbands_factor,
+                      plan_parallel=plan_parallel)
 
     # fws.append(static_fw)
     fws.append(diag_fw)
@@ -43,9 +54,11 @@ def gw_wf(structure,prev_dir, ncores, nbands_factor, vis_static=None, vasp_input
 
     wf_name = "{}:{}".format("".join(structure.formula.split(" ")), wf_addition_name)
     wf = Workflow(fws, name=wf_name)
+    vasptodb = vasptodb or {}
     vasptodb.update({"wf": [fw.name for fw in wf.fws]})
     wf = add_additional_fields_to_taskdocs(wf, vasptodb)
     wf = add_namefile(wf)
+    wf = add_calc_summary(wf)
     wf = add_modify_incar(wf)
     return wf
 
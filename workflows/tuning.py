@@ -0,0 +1,87 @@
+from fireworks import Firework, Workflow
+
+from pymatgen.io.vasp.sets import MPHSERelaxSet
+
+from atomate.vasp.config import VASP_CMD
+from atomate.vasp.firetasks.run_calc import RunVaspCustodian
+from atomate.vasp.firetasks.write_inputs import WriteVaspFromIOSet, ModifyIncar
+
+from my_atomate.firetasks.tuning import RecordParallelProbe
+
+
+def get_parallel_layouts(ncores, ncore_options=(1, 2, 4, 8, 16), kpar_options=(1, 2, 4), nkpts=None):
+    """
+    All (NCORE, KPAR) pairs that divide ncores evenly.
+    """
+    layouts = []
+    for kpar in kpar_options:
+        if ncores % kpar or (nkpts and kpar > nkpts):
+            continue
+        for ncore in ncore_options:
+            if (ncores // kpar) % ncore == 0:
+                layouts.append({"NCORE": ncore, "KPAR": kpar})
+    return layouts
+
+
+def get_wf_parallel_probe(structure, ncores, vasp_input_set=None, vasp_input_set_params=None, layouts=None,
+                          nelm=6, fworker=None, category=None, table_file=None, vasp_cmd=VASP_CMD,
+                          wf_addition_name=None):
+    """
+    Time a few electronic steps of a representative structure for several
+    NCORE/KPAR layouts and record the fastest one in the tuning table of the
+    worker (see my_atomate.firetasks.tuning). Use the same input set, k-points
+    and functional as production, since they are part of the table key.
+
+    Args:
+        structure (Structure): representative supercell
+        ncores (int): MPI ranks of the production jobs on this worker
+        vasp_input_set (VaspInputSet or str): defaults to MPHSERelaxSet
+        vasp_input_set_params (dict): kwargs of the input set if given as str
+        layouts ([dict]): [{"NCORE": int, "KPAR": int}]. Defaults to every
+            layout dividing ncores.
+        nelm (int): electronic steps per probe
+        fworker (str): pin the probes to this fworker (_fworker) and use it as
+            the fworker name of the table key
+        category (str): _category of the probes
+        table_file (str): tuning table, supports env_chk
+        vasp_cmd (str): command to run vasp
+        wf_addition_name (str): appended to the workflow name
+
+    Returns:
+        Workflow
+    """
+    vasp_input_set = vasp_input_set or MPHSERelaxSet(structure, **(vasp_input_set_params or {}))
+    layouts = layouts or get_parallel_layouts(ncores)
+
+    spec = {}
+    if fworker:
+        spec["_fworker"] = fworker
+    if category:
+        spec["_category"] = category
+
+    record_params = {}
+    if fworker:
+        record_params["fworker"] = fworker
+    if table_file:
+        record_params["table_file"] = table_file
+
+    fws = []
+    for layout in layouts:
+        incar_update = {"NELM": nelm, "NELMIN": nelm, "NSW": 0, "EDIFF": 1E-10,
+                        "LWAVE": False, "LCHARG": False}
+        incar_update.update(layout)
+        t = [
+            WriteVaspFromIOSet(structure=structure, vasp_input_set=vasp_input_set,
+                               vasp_input_params=vasp_input_set_params or {}),
+            ModifyIncar(incar_update=incar_update),
+            RunVaspCustodian(vasp_cmd=vasp_cmd, auto_npar=False, handler_group="no_handler", gzip_output=False),
+            RecordParallelProbe(layout=layout, **record_params),
+        ]
+        fws.append(Firework(
+            t, spec=dict(spec),
+            name="{}-probe-NCORE{}-KPAR{}".format(structure.composition.reduced_formula, layout["NCORE"],
+                                                  layout["KPAR"])
+        ))
+
+    wf_name = "{}:{}:parallel_probe".format("".join(structure.formula.split(" ")), wf_addition_name)
+    return Workflow(fws, name=wf_name)
@@ -8,12 +8,21 @@ from atomate.vasp.powerups import use_fake_vasp, add_namefile, add_additional_fi
 from atomate.vasp.config import GAMMA_VASP_CMD
 
 from my_atomate.vasp.fireworks import Firework, LaunchPad, Workflow
+from my_atomate.powerups import add_calc_summary, use_stream_dos
+from my_atomate.fireworks.fireworks import HSEBSChunkFW, HSEBSMergeFW
 
 import numpy as np
 
 
 def get_wf_full_hse(structure, charge_states, gamma_only, gamma_mesh, nupdowns, task,
-                    vasptodb=None, wf_addition_name=None, task_arg=None):
+                    vasptodb=None, wf_addition_name=None, task_arg=None, dos_storage=None):
+    """
+    Args (besides the charge states, k-points and task chain):
+        dos_storage (str): None parses the DOS with VaspToDb as usual; "gridfs" or
+            "adaptive" stream it with VaspToDbStreamDos, see my_atomate.firetasks.dos.
+        task_arg (dict): kwargs of the last FW of the chain; for hse_bs, nchunks > 1
+            splits the line-mode path into parallel HSEBSChunkFWs merged by HSEBSMergeFW.
+    """
 
     encut = 1.3*max([potcar.enmax for potcar in MPHSERelaxSet(structure).potcar])
 
@@ -199,24 +208,45 @@ def get_wf_full_hse(structure, charge_states, gamma_only, gamma_mesh, nupdowns,
             return fw
 
 
-        def hse_bs(parents, mode="line", prev_calc_dir=None):
+        def hse_bs(parents, mode="line", prev_calc_dir=None, nchunks=1):
             if mode == "uniform":
                 uis_hse_scf["user_incar_settings"].update({"ENMAX": 10, "ENMIN": -10, "NEDOS": 9000})
 
+            input_set_overrides = {"other_params": {"two_d_kpoints": True,
+                                                    "user_incar_settings":uis_hse_scf["user_incar_settings"],
+                                                    },
+                                   "kpoints_line_density": 20
+                                   }
+
+            # line mode: run the path in nchunks parallel FWs and merge them
+            if mode == "line" and nchunks > 1:
+                chunks = [
+                    HSEBSChunkFW(
+                        ichunk=i,
+                        nchunks=nchunks,
+                        structure=structure,
+                        input_set_overrides=input_set_overrides,
+                        cp_file_from_prev="CHGCAR",
+                        prev_calc_dir=prev_calc_dir,
+                        parents=parents,
+                        name="HSE_bs"
+                    )
+                    for i in range(nchunks)
+                ]
+                merge = HSEBSMergeFW(chunks, structure=structure, name="HSE_bs",
+                                     additional_fields={"charge_state": cs, "nupdown_set": nupdown})
+                return chunks + [merge]
+
             fw = HSEBSFW(
                 structure=structure,
                 mode=mode,
-                input_set_overrides={"other_params": {"two_d_kpoints": True,
-                                                      "user_incar_settings":uis_hse_scf["user_incar_settings"],
-                                                      },
-                                     "kpoints_line_density": 20
-                                     },
+                input_set_overrides=input_set_overrides,
                 cp_file_from_prev="CHGCAR",
                 prev_calc_dir=prev_calc_dir,
                 parents=parents,
                 name="HSE_bs"
             )
-            return fw
+            return [fw]
 
         if task == "opt":
             fws.append(opt)
@@ -225,14 +255,14 @@ def get_wf_full_hse(structure, charge_states, gamma_only, gamma_mesh, nupdowns,
         elif task == "hse_scf":
             fws.append(hse_scf(parents=None, **task_arg))
         elif task == "hse_bs":
-            fws.append(hse_bs(parents=None, **task_arg))
+            fws.extend(hse_bs(parents=None, **task_arg))
         elif task == "hse_soc":
             fws.append(hse_soc(parents=None, **task_arg))
         elif task == "hse_scf-hse_bs":
             fws.append(hse_scf(parents=None))
-            fws.append(hse_bs(parents=fws[-1], **task_arg))
+            fws.extend(hse_bs(parents=fws[-1], **task_arg))
         elif task == "hse_scf-hse_soc":
-            fws.append(hse_scf(parents=None, lcharge=True, **task_arg))
+            fws.append(hse_scf(parents=None, lcharg=True, **task_arg))
             fws.append(hse_soc(parents=fws[-1]))
         elif task == "hse_relax-hse_scf":
             fws.append(hse_relax(parents=None))
@@ -243,17 +273,17 @@ def get_wf_full_hse(structure, charge_states, gamma_only, gamma_mesh, nupdowns,
             fws.append(hse_scf(parents=fws[-1], **task_arg))
         elif task == "hse_relax-hse_scf-hse_bs":
             fws.append(hse_relax(parents=None))
-            fws.append(hse_scf(parents=fws[-1], lcharge=True))
-            fws.append(hse_bs(parents=fws[-1], **task_arg))
+            fws.append(hse_scf(parents=fws[-1], lcharg=True))
+            fws.extend(hse_bs(parents=fws[-1], **task_arg))
         elif task == "hse_relax-hse_scf-hse_soc":
             fws.append(hse_relax(parents=None))
-            fws.append(hse_scf(parents=fws[-1], lcharge=True))
+            fws.append(hse_scf(parents=fws[-1], lcharg=True))
             fws.append(hse_soc(parents=fws[-1]))
         elif task == "opt-hse_relax-hse_scf-hse_bs":
             fws.append(opt)
             fws.append(hse_relax(parents=fws[-1]))
-            fws.append(hse_scf(parents=fws[-1], lcharge=True))
-            fws.append(hse_bs(parents=fws[-1], **task_arg))
+            fws.append(hse_scf(parents=fws[-1], lcharg=True))
+            fws.extend(hse_bs(parents=fws[-1], **task_arg))
 
 
     wf_name = "{}:{}:q{}:sp{}".format("".join(structure.formula.split(" ")), wf_addition_name, charge_states, nupdowns)
@@ -262,7 +292,11 @@ def get_wf_full_hse(structure, charge_states, gamma_only, gamma_mesh, nupdowns,
 
     vasptodb.update({"wf": [fw.name for fw in wf.fws]})
     wf = add_additional_fields_to_taskdocs(wf, vasptodb)
+    wf = add_additional_fields_to_taskdocs(wf, vasptodb, task_name_constraint="MergeHSEBSChunks")
     wf = add_namefile(wf)
+    wf = add_calc_summary(wf)
+    if dos_storage:
+        wf = use_stream_dos(wf, dos_storage)
     return wf
 
 
@@ -398,6 +432,7 @@ def get_wf_full_scan(structure, charge_states, gamma_only, gamma_mesh, dos, nupd
     wf = set_execution_options(wf, category=category)
     wf = preserve_fworker(wf)
     wf = add_namefile(wf)
+    wf = add_calc_summary(wf)
     wf = add_modify_incar(wf)
     return wf
 